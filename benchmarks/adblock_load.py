@@ -0,0 +1,118 @@
+# This file is part of webmacs.
+#
+# webmacs is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# webmacs is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare the loading of the adblock cache file using AdBlock.load() and
+AdBlock.load_mmap().
+
+Each load is done in a fresh python process, so the memory usage is not
+polluted by previous runs. The resident memory is split into the anonymous
+part (private to the process) and the file backed part (shared between the
+processes mapping the same file). Linux only, as it reads /proc/self/status.
+
+Usage (the _adblock extension must be built, e.g. with
+`python setup.py build_ext --inplace`):
+
+    python benchmarks/adblock_load.py [--runs 10] [CACHE_FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".webmacs", "adblock",
+                             "cache.dat")
+
+
+def read_rss():
+    rss = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "RssAnon", "RssFile"):
+                rss[key] = int(value.split()[0])  # in kB
+    return rss
+
+
+def child(method, path):
+    from _adblock import AdBlock
+
+    adblock = AdBlock()
+    before = read_rss()
+    start = time.perf_counter()
+    loaded = getattr(adblock, method)(path)
+    elapsed = time.perf_counter() - start
+    # matching touches the deserialized data, as a running browser would.
+    adblock.matches("https://example.com/ads/banner.js", "example.com")
+    after = read_rss()
+    json.dump({
+        "loaded": bool(loaded),
+        "time": elapsed,
+        "rss": {k: after[k] - before.get(k, 0) for k in after},
+    }, sys.stdout)
+
+
+def run(method, path, runs):
+    results = []
+    for _ in range(runs):
+        out = subprocess.check_output(
+            [sys.executable, __file__, "--child", method, path])
+        res = json.loads(out.decode("utf-8"))
+        if not res["loaded"]:
+            sys.exit("Unable to load %s with %s()" % (path, method))
+        results.append(res)
+    return results
+
+
+def report(method, results):
+    times = [r["time"] * 1000 for r in results]
+    print("{}():".format(method))
+    print("  load time (ms): min {:.2f}, median {:.2f}, max {:.2f}".format(
+        min(times), statistics.median(times), max(times)))
+    for key in ("VmRSS", "RssAnon", "RssFile"):
+        values = [r["rss"].get(key, 0) for r in results]
+        print("  {:<8} (kB): median {}".format(
+            key, int(statistics.median(values))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("cache", nargs="?", default=DEFAULT_CACHE,
+                        help="adblock cache file, defaults to %(default)s")
+    parser.add_argument("--runs", type=int, default=10,
+                        help="number of loads per method")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    opts = parser.parse_args()
+
+    if opts.child:
+        child(*opts.child)
+        return
+
+    if not os.path.isfile(opts.cache):
+        sys.exit("No such cache file: %s" % opts.cache)
+
+    print("cache file: {} ({} kB)".format(
+        opts.cache, os.path.getsize(opts.cache) // 1024))
+    for method in ("load", "load_mmap"):
+        report(method, run(method, opts.cache, opts.runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+# This file is part of webmacs.
+#
+# webmacs is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# webmacs is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark the ad-blocking by replaying a corpus of requests.
+
+The compiled filter lists are loaded with Adblocker.local_adblock(), then
+each (url, first party url) pair of the corpus is matched, first directly
+against the ad-blocker, then through the UrlInterceptor python pipeline
+using fake request objects. The load time, the memory used by the loaded
+lists, the match latency percentiles and the throughput are reported, as
+well as the number of blocked requests: a change of that number means the
+matching itself changed.
+
+By default the lists compiled by webmacs in ~/.webmacs/adblock are used.
+With --lists, the given filter list files are compiled in a temporary
+directory first; benchmarks/data/filters.txt is used when no compiled list
+is found.
+
+Usage (the _adblock extension must be built, e.g. with
+`python setup.py build_ext --inplace`):
+
+    python benchmarks/adblock_match.py [--repeat 5] [--json]
+        [--corpus FILE] [--cache-dir DIR | --lists FILE [FILE ...]]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from adblock_load import read_rss
+
+THIS_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(THIS_DIR))
+
+from webmacs.adblock import Adblocker  # noqa: E402
+
+
+DATA_DIR = os.path.join(THIS_DIR, "data")
+DEFAULT_CORPUS = os.path.join(DATA_DIR, "requests.tsv")
+DEFAULT_LISTS = [os.path.join(DATA_DIR, "filters.txt")]
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".webmacs",
+                                 "adblock")
+
+
+def read_corpus(path):
+    """
+    Returns the list of (url, first party url) pairs of the corpus.
+    """
+    corpus = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line and not line.startswith("#"):
+                url, first_party = line.split("\t")
+                corpus.append((url, first_party))
+    return corpus
+
+
+def list_adblocker(cache_dir, lists):
+    adblocker = Adblocker(cache_dir)
+    adblocker._urls.clear()
+    for path in lists:
+        adblocker.register_filter_url("file://" + os.path.abspath(path))
+    return adblocker
+
+
+def load(adblocker):
+    """
+    Load the compiled lists, returns the ad-blocker and the load report.
+    """
+    before = read_rss()
+    start = time.perf_counter()
+    adblock = adblocker.local_adblock()
+    elapsed = time.perf_counter() - start
+    after = read_rss()
+    return adblock, {
+        "lists": len(adblock),
+        "load_time": elapsed,
+        "rss": {k: after[k] - before.get(k, 0) for k in after},
+    }
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+
+    def percentile(p):
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    return {"p50": percentile(50), "p99": percentile(99),
+            "max": samples[-1]}
+
+
+def bench_matches(adblock, corpus, repeat):
+    pairs = [(url, urlsplit(first_party).hostname or "")
+             for url, first_party in corpus]
+    latencies = []
+    clock = time.perf_counter
+    for _ in range(repeat):
+        for url, domain in pairs:
+            start = clock()
+            adblock.matches(url, domain)
+            latencies.append(clock() - start)
+
+    # throughput without the timing overhead
+    start = clock()
+    for _ in range(repeat):
+        blocked = sum(adblock.matches(url, domain) for url, domain in pairs)
+    elapsed = clock() - start
+
+    by_domain = defaultdict(list)
+    for url, domain in pairs:
+        by_domain[domain].append(url)
+    start = clock()
+    for _ in range(repeat):
+        for domain, urls in by_domain.items():
+            adblock.matches_many(urls, domain)
+    elapsed_many = clock() - start
+
+    count = len(pairs) * repeat
+    return {
+        "blocked": blocked,
+        "latency": percentiles(latencies),
+        "throughput": count / elapsed,
+        "matches_many_throughput": count / elapsed_many,
+    }
+
+
+class FakeRequest(object):
+    """
+    Mimics the QWebEngineUrlRequestInfo given to UrlInterceptor.
+    """
+
+    __slots__ = ("url", "first_party", "blocked")
+
+    def __init__(self, url, first_party):
+        self.url = url
+        self.first_party = first_party
+        self.blocked = False
+
+    def requestUrl(self):
+        return self.url
+
+    def firstPartyUrl(self):
+        return self.first_party
+
+    def resourceType(self):
+        return 0
+
+    def block(self, blocked):
+        self.blocked = blocked
+
+
+def bench_interceptor(adblock, corpus, repeat):
+    from PyQt5.QtCore import QUrl
+    from webmacs.application import UrlInterceptor
+
+    requests = [FakeRequest(QUrl(url), QUrl(first_party))
+                for url, first_party in corpus]
+    interceptor = UrlInterceptor(adblock)
+    clock = time.perf_counter
+
+    def replay():
+        latencies = []
+        for request in requests:
+            request.blocked = False
+            start = clock()
+            interceptor.interceptRequest(request)
+            latencies.append(clock() - start)
+        return latencies
+
+    # the first replay fills the verdict cache, later ones use it
+    cold = replay()
+    warm = []
+    start = clock()
+    for _ in range(repeat):
+        warm.extend(replay())
+    elapsed = clock() - start
+
+    return {
+        "blocked": sum(r.blocked for r in requests),
+        "cold_latency": percentiles(cold),
+        "warm_latency": percentiles(warm),
+        "warm_throughput": len(warm) / elapsed,
+        "verdict_cache": interceptor.verdict_cache_stats(),
+        "stages": interceptor.stages_stats(),
+    }
+
+
+def format_latency(latency):
+    return "p50 {:.2f}, p99 {:.2f}, max {:.2f}".format(
+        *(latency[k] * 1e6 for k in ("p50", "p99", "max")))
+
+
+def report(results):
+    load = results["load"]
+    print("corpus: {} requests, replayed {} times".format(
+        results["corpus"], results["repeat"]))
+    print("load: {} lists in {:.2f} ms".format(
+        load["lists"], load["load_time"] * 1000))
+    for key in ("VmRSS", "RssAnon", "RssFile"):
+        if key in load["rss"]:
+            print("  {:<8} (kB): {}".format(key, load["rss"][key]))
+
+    matches = results["matches"]
+    print("matches(): {} blocked".format(matches["blocked"]))
+    print("  latency (us): " + format_latency(matches["latency"]))
+    print("  throughput: {:.0f} requests/s, {:.0f} with matches_many()".format(
+        matches["throughput"], matches["matches_many_throughput"]))
+
+    interceptor = results.get("interceptor")
+    if interceptor:
+        print("UrlInterceptor: {} blocked".format(interceptor["blocked"]))
+        print("  cold latency (us): "
+              + format_latency(interceptor["cold_latency"]))
+        print("  warm latency (us): "
+              + format_latency(interceptor["warm_latency"]))
+        print("  warm throughput: {:.0f} requests/s".format(
+            interceptor["warm_throughput"]))
+        for stage in interceptor["stages"]:
+            print("  stage {:<16} calls {:>7}, decided {:>7}, {:.2f} ms"
+                  .format(stage["name"], stage["calls"],
+                          stage["blocked"] + stage["allowed"],
+                          stage["time"] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS,
+                        help="requests to replay, defaults to %(default)s")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="webmacs adblock cache directory, defaults to"
+                        " %(default)s")
+    parser.add_argument("--lists", nargs="+",
+                        help="filter list files to compile and use instead"
+                        " of the webmacs cache directory")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="number of replays of the corpus")
+    parser.add_argument("--no-interceptor", action="store_true",
+                        help="do not benchmark UrlInterceptor, which"
+                        " requires PyQt5 with QtWebEngine")
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as json")
+    opts = parser.parse_args()
+
+    tmp_dir = None
+    try:
+        lists = opts.lists
+        if not lists:
+            if os.path.isdir(opts.cache_dir):
+                adblocker = Adblocker(opts.cache_dir)
+            if not (os.path.isdir(opts.cache_dir)
+                    and adblocker.load_manifest()):
+                lists = DEFAULT_LISTS
+        if lists:
+            tmp_dir = tempfile.mkdtemp()
+            list_adblocker(tmp_dir, lists).maybe_update_adblock()
+            adblocker = list_adblocker(tmp_dir, lists)
+
+        adblock, load_report = load(adblocker)
+        if not adblock:
+            sys.exit("No compiled filter list could be loaded.")
+
+        corpus = read_corpus(opts.corpus)
+        results = {
+            "corpus": len(corpus),
+            "repeat": opts.repeat,
+            "load": load_report,
+            "matches": bench_matches(adblock, corpus, opts.repeat),
+        }
+        if not opts.no_interceptor:
+            results["interceptor"] = bench_interceptor(adblock, corpus,
+                                                       opts.repeat)
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir)
+
+    if opts.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,29 +13,65 @@
 // You should have received a copy of the GNU General Public License
 // along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
 
-#include <Python.h>
+#include "adblock.h"
 #include "structmember.h"
 
 #include <iostream>
 #include <fstream>
 
-#include "ad_block_client.h"
+#include <vector>
+
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 
 using namespace std;
 
-typedef struct {
-  PyObject_HEAD
 
-  AdBlockClient * client;
-  char * data;
-} AdBlock;
+AdBlockEngine::AdBlockEngine()
+  : client(new AdBlockClient), data(NULL), mapped(NULL), mapped_size(0)
+{
+  pthread_rwlock_init(&lock, NULL);
+}
+
+AdBlockEngine::~AdBlockEngine()
+{
+  /* the client borrows the deserialized buffer, so delete it first */
+  delete client;
+  release_data();
+  pthread_rwlock_destroy(&lock);
+}
+
+void
+AdBlockEngine::release_data()
+{
+  if (data) {
+    delete[] data;
+    data = NULL;
+  }
+  if (mapped) {
+    munmap(mapped, mapped_size);
+    mapped = NULL;
+    mapped_size = 0;
+  }
+}
+
+bool
+AdBlockEngine::matches(const char *url, const char *domain)
+{
+  pthread_rwlock_rdlock(&lock);
+  bool result = client->matches(url, FONoFilterOption, domain);
+  pthread_rwlock_unlock(&lock);
+  return result;
+}
 
 
 static void
 AdBlock_dealloc(AdBlock* self)
 {
-  delete self->client;
-  if (self->data) delete[] self->data;
+  /* the engine is freed once the native interceptor does not use it */
+  delete self->engine;
   Py_TYPE(self)->tp_free((PyObject*)self);
 }
 
@@ -52,8 +88,8 @@ AdBlock_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
 static int
 AdBlock_init(AdBlock *self, PyObject *args, PyObject *kwds)
 {
-  self->client = new AdBlockClient;
-  self->data = NULL;
+  delete self->engine;
+  self->engine = new shared_ptr<AdBlockEngine>(new AdBlockEngine);
   return 0;
 }
 
@@ -65,8 +101,11 @@ AdBlock_parse(AdBlock* self, PyObject *args)
   if (!PyArg_ParseTuple(args, "s", &data))
     return NULL;
 
+  AdBlockEngine *engine = self->engine->get();
   Py_BEGIN_ALLOW_THREADS
-  self->client->parse(data);
+  pthread_rwlock_wrlock(&engine->lock);
+  engine->client->parse(data);
+  pthread_rwlock_unlock(&engine->lock);
   Py_END_ALLOW_THREADS
 
   Py_RETURN_NONE;
@@ -81,11 +120,12 @@ AdBlock_matches(AdBlock* self, PyObject *args)
   if (!PyArg_ParseTuple(args, "ss", &url, &domain))
     return NULL;
 
-  /* I suspect that allowing threads here does create deadlocks,
-   but anyway I am not sure it would be useful to allow them. */
-  /* Py_BEGIN_ALLOW_THREADS */
-  result = self->client->matches(url, FONoFilterOption, domain);
-  /* Py_END_ALLOW_THREADS */
+  /* No lock is acquired while holding another one, so releasing the GIL
+   can not deadlock. */
+  AdBlockEngine *engine = self->engine->get();
+  Py_BEGIN_ALLOW_THREADS
+  result = engine->matches(url, domain);
+  Py_END_ALLOW_THREADS
 
   if (result) {
     Py_RETURN_TRUE;
@@ -94,6 +134,51 @@ AdBlock_matches(AdBlock* self, PyObject *args)
   }
 }
 
+static PyObject *
+AdBlock_matches_many(AdBlock* self, PyObject *args)
+{
+  PyObject *urls, *items, *result;
+  const char *domain;
+
+  if (!PyArg_ParseTuple(args, "Os", &urls, &domain))
+    return NULL;
+
+  /* a tuple copy keeps the strings alive while the GIL is released */
+  items = PySequence_Tuple(urls);
+  if (items == NULL)
+    return NULL;
+
+  Py_ssize_t size = PyTuple_GET_SIZE(items);
+  vector<const char *> c_urls(size);
+  for (Py_ssize_t i = 0; i < size; i++) {
+    c_urls[i] = PyUnicode_AsUTF8(PyTuple_GET_ITEM(items, i));
+    if (c_urls[i] == NULL) {
+      Py_DECREF(items);
+      return NULL;
+    }
+  }
+
+  result = PyBytes_FromStringAndSize(NULL, size);
+  if (result == NULL) {
+    Py_DECREF(items);
+    return NULL;
+  }
+  char *verdicts = PyBytes_AS_STRING(result);
+
+  AdBlockEngine *engine = self->engine->get();
+  Py_BEGIN_ALLOW_THREADS
+  pthread_rwlock_rdlock(&engine->lock);
+  for (Py_ssize_t i = 0; i < size; i++) {
+    verdicts[i] = engine->client->matches(c_urls[i], FONoFilterOption,
+                                          domain);
+  }
+  pthread_rwlock_unlock(&engine->lock);
+  Py_END_ALLOW_THREADS
+
+  Py_DECREF(items);
+  return result;
+}
+
 static PyObject *
 AdBlock_save(AdBlock* self, PyObject *args)
 {
@@ -108,8 +193,11 @@ AdBlock_save(AdBlock* self, PyObject *args)
     Py_RETURN_FALSE;
   }
 
+  AdBlockEngine *engine = self->engine->get();
   Py_BEGIN_ALLOW_THREADS
-  char * buffer = self->client->serialize(&size);
+  pthread_rwlock_rdlock(&engine->lock);
+  char * buffer = engine->client->serialize(&size);
+  pthread_rwlock_unlock(&engine->lock);
   outFile.write(buffer, size);
   outFile.close();
   Py_END_ALLOW_THREADS
@@ -131,16 +219,19 @@ AdBlock_load(AdBlock* self, PyObject *args)
     Py_RETURN_FALSE;
   }
 
+  AdBlockEngine *engine = self->engine->get();
   Py_BEGIN_ALLOW_THREADS
   streamsize size = file.tellg();
   file.seekg(0, ios::beg);
 
-  if (self->data) {delete[] self->data;}
-  self->data = new char[size];
-  if (file.read(self->data, size)) {
-    self->client->deserialize(self->data);
+  pthread_rwlock_wrlock(&engine->lock);
+  engine->release_data();
+  engine->data = new char[size];
+  if (file.read(engine->data, size)) {
+    engine->client->deserialize(engine->data);
     result = true;
   }
+  pthread_rwlock_unlock(&engine->lock);
   Py_END_ALLOW_THREADS
 
   if (result) {
@@ -150,6 +241,48 @@ AdBlock_load(AdBlock* self, PyObject *args)
   }
 }
 
+static PyObject *
+AdBlock_load_mmap(AdBlock* self, PyObject *args)
+{
+  const char *path;
+  bool result = false;
+
+  if (!PyArg_ParseTuple(args, "s", &path))
+    return NULL;
+
+  AdBlockEngine *engine = self->engine->get();
+  Py_BEGIN_ALLOW_THREADS
+  int fd = open(path, O_RDONLY);
+  if (fd != -1) {
+    struct stat st;
+    if (fstat(fd, &st) == 0 && st.st_size > 0) {
+      /* A private mapping stays backed by the page cache, so every webmacs
+       instance loading the same cache file shares the same physical pages.
+       The client only reads the buffer, but deserialize() takes a non-const
+       pointer: in case it ever writes, only the touched pages are copied. */
+      void * addr = mmap(NULL, st.st_size, PROT_READ | PROT_WRITE,
+                         MAP_PRIVATE, fd, 0);
+      if (addr != MAP_FAILED) {
+        pthread_rwlock_wrlock(&engine->lock);
+        engine->release_data();
+        engine->mapped = (char *)addr;
+        engine->mapped_size = st.st_size;
+        engine->client->deserialize(engine->mapped);
+        pthread_rwlock_unlock(&engine->lock);
+        result = true;
+      }
+    }
+    close(fd);
+  }
+  Py_END_ALLOW_THREADS
+
+  if (result) {
+    Py_RETURN_TRUE;
+  }
+  /* mapping the file failed, fall back to reading it in memory */
+  return AdBlock_load(self, args);
+}
+
 
 static PyMethodDef AdBlock_methods[] = {
   {"parse", (PyCFunction)AdBlock_parse, METH_VARARGS,
@@ -158,16 +291,24 @@ static PyMethodDef AdBlock_methods[] = {
   {"matches", (PyCFunction)AdBlock_matches, METH_VARARGS,
    "matches an url, returns True if it should be filtered."
   },
+  {"matches_many", (PyCFunction)AdBlock_matches_many, METH_VARARGS,
+   "matches a sequence of urls for the same first party domain. Returns"
+   " bytes with one value per url, 1 if it should be filtered, else 0."
+  },
   {"save", (PyCFunction)AdBlock_save, METH_VARARGS,
    "Save serialized data into a file."
   },
   {"load", (PyCFunction)AdBlock_load, METH_VARARGS,
    "Load serialized data from a file."
   },
+  {"load_mmap", (PyCFunction)AdBlock_load_mmap, METH_VARARGS,
+   "Load serialized data from a memory mapped file, sharing its pages"
+   " between processes. Falls back to load() if the mapping fails."
+  },
   {NULL}  /* Sentinel */
 };
 
-static PyTypeObject AdBlockType = {
+PyTypeObject AdBlockType = {
     PyVarObject_HEAD_INIT(NULL, 0)
     "adblock.AdBlock",             /* tp_name */
     sizeof(AdBlock),             /* tp_basicsize */
@@ -233,5 +374,10 @@ PyInit__adblock(void)
 
   Py_INCREF(&AdBlockType);
   PyModule_AddObject(m, "AdBlock", (PyObject *)&AdBlockType);
+
+#ifdef WEBMACS_NATIVE_INTERCEPTOR
+  if (add_interceptor_type(m) < 0)
+    return NULL;
+#endif
   return m;
 }
@@ -0,0 +1,65 @@
+// This file is part of webmacs.
+//
+// webmacs is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// webmacs is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
+
+#ifndef WEBMACS_ADBLOCK_H
+#define WEBMACS_ADBLOCK_H
+
+#include <Python.h>
+
+#include <memory>
+#include <pthread.h>
+
+#include "ad_block_client.h"
+
+/* The ad-block client and the buffer it was deserialized from.
+
+ An engine is shared (through a shared_ptr) by its python AdBlock object and
+ the native interceptor, so it can outlive the python object while a request
+ is being matched on the network IO thread. */
+class AdBlockEngine {
+ public:
+  AdBlockEngine();
+  ~AdBlockEngine();
+
+  /* Release the deserialized buffer. Requires the write lock. */
+  void release_data();
+
+  /* Thread safe, can be called without the GIL. */
+  bool matches(const char *url, const char *domain);
+
+  AdBlockClient * client;
+  /* matching only takes the read lock. Any change to the client (parse,
+   load) takes the write lock. */
+  pthread_rwlock_t lock;
+  char * data;
+  /* memory mapped cache file, see AdBlock_load_mmap */
+  char * mapped;
+  size_t mapped_size;
+};
+
+typedef struct {
+  PyObject_HEAD
+
+  std::shared_ptr<AdBlockEngine> * engine;
+} AdBlock;
+
+extern PyTypeObject AdBlockType;
+
+#ifdef WEBMACS_NATIVE_INTERCEPTOR
+/* Defined in interceptor.cpp, adds the Interceptor type to the module. */
+int add_interceptor_type(PyObject *module);
+#endif
+
+#endif
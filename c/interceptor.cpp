@@ -0,0 +1,444 @@
+// This file is part of webmacs.
+//
+// webmacs is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// webmacs is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
+
+// A QWebEngineUrlRequestInterceptor matching requests against the ad-block
+// engines without calling back into python, so the network IO thread never
+// waits for the GIL. Only built when the Qt WebEngine development files are
+// available, see setup.py.
+
+// Python.h must come first, and Qt keywords (slots, ...) clash with it.
+#define QT_NO_KEYWORDS
+#include "adblock.h"
+
+#include <atomic>
+#include <map>
+#include <mutex>
+#include <string>
+#include <unordered_map>
+#include <vector>
+
+#include <QtWebEngineCore/QWebEngineUrlRequestInterceptor>
+#include <QtWebEngineCore/QWebEngineUrlRequestInfo>
+
+using namespace std;
+
+typedef atomic<unsigned long> Counter;
+
+struct NamedEngine {
+  shared_ptr<AdBlockEngine> engine;
+  string name;
+  /* requests blocked by this list, kept when the engines are replaced */
+  shared_ptr<Counter> blocked;
+};
+
+struct Engines {
+  vector<NamedEngine> lists;
+  /* The exception rules of every list, matching every request unless an
+   exception applies, see AdBlockSet.set_exceptions. May be null. */
+  shared_ptr<AdBlockEngine> exceptions;
+};
+
+typedef unordered_map<string, unsigned long> NameCounts;
+typedef map<int, unsigned long> TypeCounts;
+
+/* Blocked requests are counted by site for this number of sites, the
+ requests of the other ones are counted under OTHER_SITES. */
+static const size_t MAX_BLOCKED_SITES = 1000;
+static const char OTHER_SITES[] = "(other sites)";
+/* QWebEngineUrlRequestInfo::ResourceType values, up to
+ ResourceTypeUnknown (255) */
+static const int RESOURCE_TYPES = 256;
+
+
+class NativeInterceptor : public QWebEngineUrlRequestInterceptor {
+ public:
+  NativeInterceptor()
+    : enabled(true), requests(0), blocked(0),
+      engines(make_shared<const Engines>()), other_sites(0) {
+    for (int i = 0; i < RESOURCE_TYPES; i++)
+      blocked_types[i] = 0;
+  }
+
+  void interceptRequest(QWebEngineUrlRequestInfo &info) override;
+
+  /* Called from the GUI thread, requests being intercepted keep using the
+   previous engines until they are done. */
+  void set_engines(shared_ptr<Engines> new_engines) {
+    shared_ptr<const Engines> old = atomic_load(&engines);
+    for (NamedEngine &engine : new_engines->lists) {
+      for (const NamedEngine &old_engine : old->lists) {
+        if (old_engine.name == engine.name) {
+          engine.blocked = old_engine.blocked;
+          break;
+        }
+      }
+      if (!engine.blocked)
+        engine.blocked = make_shared<Counter>(0);
+    }
+    atomic_store(&engines, shared_ptr<const Engines>(new_engines));
+  }
+
+  /* Copy the counters of blocked requests. */
+  void blocked_counts(NameCounts &sites, NameCounts &lists,
+                      TypeCounts &types) {
+    {
+      lock_guard<mutex> guard(sites_lock);
+      sites = blocked_sites;
+    }
+    unsigned long others = other_sites.load(memory_order_relaxed);
+    if (others)
+      sites[OTHER_SITES] += others;
+
+    shared_ptr<const Engines> current = atomic_load(&engines);
+    for (const NamedEngine &engine : current->lists)
+      lists[engine.name] = engine.blocked->load(memory_order_relaxed);
+
+    for (int i = 0; i < RESOURCE_TYPES; i++) {
+      unsigned long count = blocked_types[i].load(memory_order_relaxed);
+      if (count)
+        types[i] = count;
+    }
+  }
+
+  atomic<bool> enabled;
+  Counter requests;
+  Counter blocked;
+
+ private:
+  void count_site(const char *site);
+
+  shared_ptr<const Engines> engines;
+  /* The IO thread never waits for it, see count_site() */
+  mutex sites_lock;
+  NameCounts blocked_sites;
+  /* requests of the sites not in blocked_sites */
+  Counter other_sites;
+  Counter blocked_types[RESOURCE_TYPES];
+};
+
+
+void
+NativeInterceptor::count_site(const char *site)
+{
+  unique_lock<mutex> guard(sites_lock, try_to_lock);
+  /* while the GUI thread copies the counts, the request is counted with
+   the other sites. */
+  if (guard.owns_lock()) {
+    auto it = blocked_sites.find(site);
+    if (it != blocked_sites.end()) {
+      it->second++;
+      return;
+    }
+    if (blocked_sites.size() < MAX_BLOCKED_SITES) {
+      blocked_sites.emplace(site, 1);
+      return;
+    }
+  }
+  other_sites.fetch_add(1, memory_order_relaxed);
+}
+
+
+void
+NativeInterceptor::interceptRequest(QWebEngineUrlRequestInfo &info)
+{
+  if (!enabled)
+    return;
+
+  shared_ptr<const Engines> current = atomic_load(&engines);
+  if (current->lists.empty())
+    return;
+
+  const QUrl url = info.requestUrl();
+  const QString scheme = url.scheme();
+  if (scheme == QLatin1String("webmacs") || scheme == QLatin1String("data")
+      || scheme == QLatin1String("blob") || scheme == QLatin1String("file"))
+    return;
+
+  requests++;
+  const QByteArray url_s = url.toString().toUtf8();
+  const QByteArray domain = info.firstPartyUrl().host().toUtf8();
+  for (const NamedEngine &engine : current->lists) {
+    if (engine.engine->matches(url_s.constData(), domain.constData())) {
+      /* an exception rule of any list allows the request */
+      if (current->exceptions
+          && !current->exceptions->matches(url_s.constData(),
+                                           domain.constData()))
+        return;
+      blocked++;
+      info.block(true);
+      engine.blocked->fetch_add(1, memory_order_relaxed);
+      blocked_types[static_cast<int>(info.resourceType()) % RESOURCE_TYPES]
+        .fetch_add(1, memory_order_relaxed);
+      count_site(domain.constData());
+      return;
+    }
+  }
+}
+
+
+typedef struct {
+  PyObject_HEAD
+
+  NativeInterceptor * interceptor;
+} Interceptor;
+
+
+static void
+Interceptor_dealloc(Interceptor* self)
+{
+  delete self->interceptor;
+  Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static int
+Interceptor_init(Interceptor *self, PyObject *args, PyObject *kwds)
+{
+  delete self->interceptor;
+  self->interceptor = new NativeInterceptor;
+  return 0;
+}
+
+static PyObject *
+Interceptor_address(Interceptor* self, PyObject *Py_UNUSED(ignored))
+{
+  return PyLong_FromVoidPtr(
+    static_cast<QWebEngineUrlRequestInterceptor *>(self->interceptor));
+}
+
+static PyObject *
+Interceptor_set_enabled(Interceptor* self, PyObject *args)
+{
+  int enabled;
+
+  if (!PyArg_ParseTuple(args, "p", &enabled))
+    return NULL;
+
+  self->interceptor->enabled = enabled;
+  Py_RETURN_NONE;
+}
+
+static PyObject *
+Interceptor_enabled(Interceptor* self, PyObject *Py_UNUSED(ignored))
+{
+  if (self->interceptor->enabled) {
+    Py_RETURN_TRUE;
+  } else {
+    Py_RETURN_FALSE;
+  }
+}
+
+static PyObject *
+Interceptor_set_engines(Interceptor* self, PyObject *args)
+{
+  PyObject *adblocks, *items, *names = NULL, *name_items = NULL;
+  PyObject *exceptions = NULL;
+
+  if (!PyArg_ParseTuple(args, "O|OO", &adblocks, &names, &exceptions))
+    return NULL;
+  if (exceptions == Py_None) {
+    exceptions = NULL;
+  } else if (exceptions != NULL
+             && !PyObject_TypeCheck(exceptions, &AdBlockType)) {
+    PyErr_SetString(PyExc_TypeError, "exceptions must be an AdBlock");
+    return NULL;
+  }
+
+  items = PySequence_Fast(adblocks, "a sequence of AdBlock is required");
+  if (items == NULL)
+    return NULL;
+
+  Py_ssize_t size = PySequence_Fast_GET_SIZE(items);
+  if (names != NULL && names != Py_None) {
+    name_items = PySequence_Fast(names, "a sequence of str is required");
+    if (name_items == NULL) {
+      Py_DECREF(items);
+      return NULL;
+    }
+    if (PySequence_Fast_GET_SIZE(name_items) != size) {
+      PyErr_SetString(PyExc_ValueError,
+                      "there must be one name per AdBlock");
+      goto error;
+    }
+  }
+
+  {
+    shared_ptr<Engines> engines = make_shared<Engines>();
+    engines->lists.reserve(size);
+    if (exceptions)
+      engines->exceptions = *((AdBlock *)exceptions)->engine;
+    for (Py_ssize_t i = 0; i < size; i++) {
+      PyObject *item = PySequence_Fast_GET_ITEM(items, i);
+      if (!PyObject_TypeCheck(item, &AdBlockType)) {
+        PyErr_SetString(PyExc_TypeError, "a sequence of AdBlock is required");
+        goto error;
+      }
+      NamedEngine engine;
+      engine.engine = *((AdBlock *)item)->engine;
+      if (name_items) {
+        const char *name = PyUnicode_AsUTF8(
+          PySequence_Fast_GET_ITEM(name_items, i));
+        if (name == NULL)
+          goto error;
+        engine.name = name;
+      } else {
+        engine.name = to_string(i);
+      }
+      engines->lists.push_back(engine);
+    }
+    self->interceptor->set_engines(engines);
+  }
+
+  Py_DECREF(items);
+  Py_XDECREF(name_items);
+  Py_RETURN_NONE;
+
+ error:
+  Py_DECREF(items);
+  Py_XDECREF(name_items);
+  return NULL;
+}
+
+template <typename Counts, typename KeyBuilder>
+static PyObject *
+counts_to_dict(const Counts &counts, KeyBuilder build_key)
+{
+  PyObject *dict = PyDict_New();
+  if (dict == NULL)
+    return NULL;
+
+  for (const auto &item : counts) {
+    PyObject *key = build_key(item.first);
+    PyObject *value = PyLong_FromUnsignedLong(item.second);
+    if (key == NULL || value == NULL || PyDict_SetItem(dict, key, value) < 0) {
+      Py_XDECREF(key);
+      Py_XDECREF(value);
+      Py_DECREF(dict);
+      return NULL;
+    }
+    Py_DECREF(key);
+    Py_DECREF(value);
+  }
+  return dict;
+}
+
+static PyObject *
+Interceptor_stats(Interceptor* self, PyObject *Py_UNUSED(ignored))
+{
+  NameCounts sites, lists;
+  TypeCounts types;
+  PyObject *py_sites, *py_lists, *py_types;
+
+  self->interceptor->blocked_counts(sites, lists, types);
+
+  auto str_key = [](const string &key) {
+    return PyUnicode_DecodeUTF8(key.data(), key.size(), "replace");
+  };
+  py_sites = counts_to_dict(sites, str_key);
+  py_lists = counts_to_dict(lists, str_key);
+  py_types = counts_to_dict(types, [](int key) {
+    return PyLong_FromLong(key);
+  });
+  if (py_sites == NULL || py_lists == NULL || py_types == NULL) {
+    Py_XDECREF(py_sites);
+    Py_XDECREF(py_lists);
+    Py_XDECREF(py_types);
+    return NULL;
+  }
+
+  return Py_BuildValue("{s:k,s:k,s:N,s:N,s:N}",
+                       "requests", self->interceptor->requests.load(),
+                       "blocked", self->interceptor->blocked.load(),
+                       "sites", py_sites,
+                       "lists", py_lists,
+                       "types", py_types);
+}
+
+
+static PyMethodDef Interceptor_methods[] = {
+  {"address", (PyCFunction)Interceptor_address, METH_NOARGS,
+   "Address of the QWebEngineUrlRequestInterceptor, to be wrapped with"
+   " sip.wrapinstance()."
+  },
+  {"set_enabled", (PyCFunction)Interceptor_set_enabled, METH_VARARGS,
+   "Enable or disable the ad-blocking."
+  },
+  {"enabled", (PyCFunction)Interceptor_enabled, METH_NOARGS,
+   "Returns True if the ad-blocking is enabled."
+  },
+  {"set_engines", (PyCFunction)Interceptor_set_engines, METH_VARARGS,
+   "Replace the AdBlock objects used to match the requests. An optional"
+   " sequence gives the name of each filter list, used in stats(). An"
+   " optional AdBlock holds the exception rules of all the lists, a request"
+   " it does not match is never blocked."
+  },
+  {"stats", (PyCFunction)Interceptor_stats, METH_NOARGS,
+   "Returns the number of matched and blocked requests, and the blocked"
+   " requests by first party site, filter list and resource type."
+  },
+  {NULL}  /* Sentinel */
+};
+
+static PyTypeObject InterceptorType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "adblock.Interceptor",     /* tp_name */
+    sizeof(Interceptor),       /* tp_basicsize */
+    0,                         /* tp_itemsize */
+    (destructor)Interceptor_dealloc, /* tp_dealloc */
+    0,                         /* tp_print */
+    0,                         /* tp_getattr */
+    0,                         /* tp_setattr */
+    0,                         /* tp_reserved */
+    0,                         /* tp_repr */
+    0,                         /* tp_as_number */
+    0,                         /* tp_as_sequence */
+    0,                         /* tp_as_mapping */
+    0,                         /* tp_hash  */
+    0,                         /* tp_call */
+    0,                         /* tp_str */
+    0,                         /* tp_getattro */
+    0,                         /* tp_setattro */
+    0,                         /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,        /* tp_flags */
+    "Native url request interceptor", /* tp_doc */
+    0,                         /* tp_traverse */
+    0,                         /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    Interceptor_methods,       /* tp_methods */
+    0,                         /* tp_members */
+    0,                         /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    (initproc)Interceptor_init, /* tp_init */
+    0,                         /* tp_alloc */
+    PyType_GenericNew,         /* tp_new */
+};
+
+
+int
+add_interceptor_type(PyObject *module)
+{
+  if (PyType_Ready(&InterceptorType) < 0)
+    return -1;
+
+  Py_INCREF(&InterceptorType);
+  return PyModule_AddObject(module, "Interceptor",
+                            (PyObject *)&InterceptorType);
+}
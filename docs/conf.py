@@ -27,7 +27,7 @@ sys.path.insert(0, os.path.abspath('..'))
 # to mock everything.
 if True or "READTHEDOCS" in os.environ:
     # We can not install webmacs on readthedocs, as it requires to
-    # buid some C extensions (from dateparser, PyQt5, ...). The
+    # buid some C extensions (from PyQt5, ...). The
     # alternative is to mock any dependency used by webmacs.
 
     class Mock(object):
@@ -50,7 +50,7 @@ if True or "READTHEDOCS" in os.environ:
                     "PyQt5.QtWidgets", "PyQt5.QtWebEngineWidgets",
                     "PyQt5.QtWebEngineCore", "PyQt5.QtWebChannel",
                     "PyQt5.QtNetwork", "PyQt5.QtPrintSupport",
-                    "_adblock", "dateparser"]
+                    "_adblock"]
     sys.modules.update((mod_name, Mock()) for mod_name in MOCK_MODULES)
     # the version number is not important, though it must be an int.
     sys.modules["PyQt5.QtCore"].QT_VERSION \
@@ -33,6 +33,28 @@ if "CC" not in os.environ:
     # compile...
     os.environ["CC"] = "g++"
 
+
+def qt_webengine_flags():
+    """
+    Returns the (compile, link) flags to build the native url interceptor,
+    or None if the Qt WebEngine development files are not available.
+    """
+    if os.environ.get("WEBMACS_NO_NATIVE_INTERCEPTOR"):
+        return None
+    try:
+        cflags, libs = (
+            subprocess.check_output(
+                ["pkg-config", opt, "Qt5WebEngineCore"],
+                stderr=subprocess.DEVNULL,
+            ).decode("utf-8").split()
+            for opt in ("--cflags", "--libs")
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    # Qt requires position independent code
+    return cflags + ["-fPIC"], libs
+
+
 adblocker = Extension(
     '_adblock',
     define_macros=[],
@@ -52,6 +74,13 @@ adblocker = Extension(
         os.path.join(THIS_DIR, "c", "adblock.c"),
     ])
 
+qt_flags = qt_webengine_flags()
+if qt_flags:
+    adblocker.sources.append(os.path.join(THIS_DIR, "c", "interceptor.cpp"))
+    adblocker.define_macros.append(("WEBMACS_NATIVE_INTERCEPTOR", None))
+    adblocker.extra_compile_args.extend(qt_flags[0])
+    adblocker.extra_link_args.extend(qt_flags[1])
+
 
 def get_version():
     with open(os.path.join(THIS_DIR, "webmacs", "__init__.py")) as f:
@@ -116,7 +145,7 @@ Some of the features are:
 
 ''',
     packages=find_packages(),
-    install_requires=["dateparser", "jinja2", "pygments"],
+    install_requires=["jinja2", "pygments"],
     entry_points={"console_scripts": ["webmacs = webmacs.main:main"]},
     package_data={"webmacs": [
         "scripts/*.js",
@@ -0,0 +1,297 @@
+import os
+import gzip
+import threading
+import pytest
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+pytest.importorskip("_adblock")
+
+from webmacs.adblock import VerdictCache  # noqa: E402
+
+
+def test_verdict_cache_lru():
+    cache = VerdictCache(2)
+    gen = cache.generation
+    cache.put("a", True, gen)
+    cache.put("b", False, gen)
+    assert cache.get("a") is True  # "b" is now the least recently used
+    cache.put("c", True, gen)
+
+    assert cache.get("b") is None
+    assert cache.get("c") is True
+    assert cache.stats() == {"size": 2, "hits": 2, "misses": 1,
+                             "evictions": 1}
+
+
+def test_verdict_cache_clear_discards_older_generations():
+    cache = VerdictCache(10)
+    gen = cache.generation
+    cache.put("a", True, gen)
+    cache.clear()
+    assert len(cache) == 0
+
+    # a verdict computed with the previous ad-blocker is not stored
+    cache.put("b", True, gen)
+    assert cache.get("b") is None
+
+    cache.put("b", False, cache.generation)
+    assert cache.get("b") is False
+
+
+def test_verdict_cache_disabled():
+    cache = VerdictCache(0)
+    cache.put("a", True, cache.generation)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_matches_many():
+    from _adblock import AdBlock
+
+    adblock = AdBlock()
+    adblock.parse("||ads.example.com^\n/banner/*\n")
+    urls = [
+        "https://ads.example.com/script.js",
+        "https://example.com/index.html",
+        "https://cdn.example.org/banner/top.png",
+    ]
+    verdicts = adblock.matches_many(urls, "example.com")
+
+    assert isinstance(verdicts, bytes)
+    assert list(verdicts) == [adblock.matches(url, "example.com")
+                              for url in urls]
+    assert list(verdicts) == [1, 0, 1]
+    assert adblock.matches_many([], "example.com") == b""
+
+
+def _adblocker(tmpdir, *lists):
+    from webmacs.adblock import Adblocker
+
+    adblocker = Adblocker(str(tmpdir.join("cache")))
+    adblocker._urls.clear()
+    for name in lists:
+        adblocker.register_filter_url("file://" + str(tmpdir.join(name)))
+    return adblocker
+
+
+def test_incremental_update(tmpdir, mocker):
+    tmpdir.join("list1.txt").write("||ads.example.com^\n")
+    tmpdir.join("list2.txt").write("/banner/*\n")
+
+    adblocker = _adblocker(tmpdir, "list1.txt", "list2.txt")
+    compile_list = mocker.spy(adblocker, "_compile_list")
+    adblock = adblocker.maybe_update_adblock()
+    assert compile_list.call_count == 2
+    assert adblock.matches("https://ads.example.com/a.js", "example.com")
+    assert adblock.matches("https://example.org/banner/a.png", "example.org")
+
+    # nothing changed
+    assert adblocker.maybe_update_adblock() is None
+    assert compile_list.call_count == 2
+
+    # only the modified list is compiled again
+    tmpdir.join("list2.txt").write("/popup/*\n")
+    # force the download, as downloaded files are kept for an hour
+    os.utime(adblocker._urls["file://" + str(tmpdir.join("list2.txt"))],
+             (0, 0))
+    adblock = adblocker.maybe_update_adblock()
+    assert compile_list.call_count == 3
+    assert compile_list.call_args[0][0].endswith("list2.txt")
+    assert not adblock.matches("https://example.org/banner/a.png",
+                               "example.org")
+    assert adblock.matches("https://example.org/popup/a.html", "example.org")
+
+    # a new instance loads the compiled lists
+    adblock = _adblocker(tmpdir, "list1.txt", "list2.txt").local_adblock()
+    assert len(adblock) == 2
+    assert adblock.matches_many(["https://ads.example.com/a.js",
+                                 "https://example.org/index.html"],
+                                "example.org") == b"\x01\x00"
+    for _, info in adblock.infos():
+        assert info["size"] > 0
+        assert info["load_time"] >= 0
+
+
+def test_parallel_compilation(tmpdir, mocker):
+    # two urls with the same content share their compiled file
+    tmpdir.join("list1.txt").write("||ads.example.com^\n")
+    tmpdir.join("list2.txt").write("||ads.example.com^\n")
+    tmpdir.join("list3.txt").write("/banner/*\n")
+
+    adblocker = _adblocker(tmpdir, "list1.txt", "list2.txt", "list3.txt")
+    compile_list = mocker.spy(adblocker, "_compile_list")
+    adblock = adblocker.maybe_update_adblock()
+    assert compile_list.call_count == 2
+    assert len(adblock) == 3
+    assert adblock.matching_list("https://ads.example.com/a.js",
+                                 "example.com").endswith("list1.txt")
+    assert adblock.matching_list("https://example.org/banner/a.png",
+                                 "example.org").endswith("list3.txt")
+    # no temporary file is left
+    assert not [f for f in os.listdir(adblocker.compiled_dir())
+                if f.endswith(".tmp")]
+
+
+def test_exceptions_apply_to_every_list(tmpdir):
+    tmpdir.join("list1.txt").write("/banner/*\n")
+    tmpdir.join("list2.txt").write("@@||cdn.example.com/banner/\n")
+
+    adblock = _adblocker(tmpdir, "list1.txt", "list2.txt") \
+        .maybe_update_adblock()
+    assert adblock.matching_list("https://ads.example.com/banner/a.png",
+                                 "example.com").endswith("list1.txt")
+    assert adblock.matching_list("https://cdn.example.com/banner/a.png",
+                                 "example.com") is None
+    assert adblock.matches_many(["https://ads.example.com/banner/a.png",
+                                 "https://cdn.example.com/banner/a.png"],
+                                "example.com") == b"\x01\x00"
+
+    # the compiled exceptions are loaded by a new instance
+    adblocker = _adblocker(tmpdir, "list1.txt", "list2.txt")
+    adblock = adblocker.local_adblock()
+    assert not adblock.matches("https://cdn.example.com/banner/a.png",
+                               "example.com")
+
+    # a missing exceptions file is only compiled by the update
+    os.unlink(adblocker._compiled_file(
+        adblocker._exceptions_digest(adblocker.load_manifest())))
+    assert adblocker.local_adblock().exceptions is None
+    adblock = adblocker.maybe_update_adblock()
+    assert adblock is not None
+    assert not adblock.matches("https://cdn.example.com/banner/a.png",
+                               "example.com")
+
+
+class FilterListHandler(BaseHTTPRequestHandler):
+    content = b"||ads.example.com^\n"
+    etag = '"v1"'
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = self.content
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def filter_server():
+    server = HTTPServer(("127.0.0.1", 0), FilterListHandler)
+    FilterListHandler.requests = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield "http://127.0.0.1:%d/list.txt" % server.server_port
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_conditional_download(tmpdir, filter_server):
+    adblocker = _adblocker(tmpdir)
+    adblocker.register_filter_url(filter_server)
+    path = adblocker._urls[filter_server]
+
+    assert adblocker._fetch_urls()
+    with open(path, "rb") as f:
+        assert f.read() == FilterListHandler.content
+    assert FilterListHandler.requests[0]["Accept-Encoding"] == "gzip"
+    assert adblocker.load_validators()[filter_server]["etag"] == '"v1"'
+
+    # the server answers 304, the file is kept as is
+    os.utime(path, (0, 0))
+    assert not adblocker._fetch_urls()
+    assert FilterListHandler.requests[1]["If-None-Match"] == '"v1"'
+    with open(path, "rb") as f:
+        assert f.read() == FilterListHandler.content
+    assert os.path.getmtime(path) > 0
+    # no temporary file is left
+    assert sorted(os.listdir(str(tmpdir.join("cache")))) == [
+        "list.txt", "validators.json"]
+
+
+def test_host_trie():
+    from webmacs.adblock import HostTrie
+
+    trie = HostTrie(["example.com", "Sub.Example.ORG."])
+    assert len(trie) == 2
+    assert "example.com" in trie
+    assert "www.example.com" in trie
+    assert "notexample.com" not in trie
+    assert "com" not in trie
+    assert "sub.example.org" in trie
+    assert "a.sub.example.org" in trie
+    assert "example.org" not in trie
+    assert "" not in trie
+
+
+def test_read_hosts_file(tmpdir):
+    from webmacs.adblock import read_hosts_file
+
+    hosts = tmpdir.join("hosts")
+    hosts.write("# comment\n"
+                "127.0.0.1 localhost\n"
+                "0.0.0.0 ads.example.com tracker.example.com  # inline\n"
+                "\n"
+                "Bare.Example.org\n")
+    assert read_hosts_file(str(hosts)) == {
+        "ads.example.com", "tracker.example.com", "bare.example.org"}
+
+
+def test_filter_pipeline():
+    from PyQt5.QtCore import QUrl
+    from webmacs.adblock import FilterPipeline, SchemeStage, \
+        AllowedSitesStage, BlockedHostsStage, AdBlockStage, AdBlockSet
+    from _adblock import AdBlock
+
+    engine = AdBlock()
+    engine.parse("/banner/*\n")
+    adblock = AdBlockSet()
+    adblock.add("banners", engine)
+    stages = [SchemeStage(), AllowedSitesStage(["allowed.org"]),
+              BlockedHostsStage({"ads.example.com"}),
+              AdBlockStage(adblock, 10)]
+    pipeline = FilterPipeline(stages)
+
+    def blocks(url, first_party="https://example.com"):
+        return pipeline.blocks(QUrl(url), QUrl(first_party))
+
+    assert not blocks("data:text/plain,banner")
+    assert not blocks("https://ads.example.com/banner/a.png",
+                      "https://www.allowed.org/")
+    assert blocks("https://ads.example.com/index.html") == "hosts files"
+    assert blocks("https://cdn.example.com/banner/a.png") == "banners"
+    assert not blocks("https://cdn.example.com/index.html")
+
+    stats = {s["name"]: s for s in pipeline.stats()}
+    assert stats["scheme"]["calls"] == 5
+    assert stats["scheme"]["allowed"] == 1
+    assert stats["allowed sites"]["allowed"] == 1
+    assert stats["blocked hosts"]["blocked"] == 1
+    assert stats["adblock filters"]["calls"] == 2
+    assert stats["adblock filters"]["blocked"] == 1
+
+
+def test_blocked_sites_are_capped(monkeypatch):
+    from webmacs import adblock
+    monkeypatch.setattr(adblock, "MAX_BLOCKED_SITES", 2)
+
+    stats = adblock.AdBlockStats()
+    for site in ("a.com", "b.com", "c.com", "a.com", "d.com"):
+        stats.record(site, "list", 0)
+    assert stats.snapshot()["sites"] == {
+        "a.com": 2, "b.com": 1, adblock.OTHER_SITES: 2}
+    assert stats.snapshot()["blocked"] == 5
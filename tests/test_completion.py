@@ -0,0 +1,147 @@
+import random
+import sqlite3
+
+import pytest
+from PyQt5.QtCore import QSortFilterProxyModel, QRegExp, Qt, \
+    QStringListModel
+
+from webmacs.minibuffer.completion import CompletionFilterModel
+from webmacs.minibuffer.prompt import Prompt, PromptTableModel, \
+    PagedTableModel
+
+
+def rows(model):
+    return [tuple(model.data(model.index(row, col))
+                  for col in range(model.columnCount()))
+            for row in range(model.rowCount())]
+
+
+def regexp_filter(source, text, match):
+    # the filtering done before by the minibuffer input
+    proxy = QSortFilterProxyModel()
+    proxy.setFilterKeyColumn(-1)
+    proxy.setSourceModel(source)
+    if match == Prompt.SimpleMatch:
+        pattern = "^" + QRegExp.escape(text)
+    else:
+        pattern = ".*".join(QRegExp.escape(t) for t in text.split())
+    proxy.setFilterRegExp(QRegExp(pattern, Qt.CaseInsensitive))
+    return rows(proxy)
+
+
+@pytest.mark.parametrize("match", [Prompt.SimpleMatch, Prompt.FuzzyMatch])
+def test_same_rows_as_regexp_filter(qtbot, match):
+    rand = random.Random(0)
+    source = PromptTableModel([
+        ("".join(rand.choice("abcAB ") for _ in range(8)),
+         "".join(rand.choice("abc. ") for _ in range(5)))
+        for _ in range(300)
+    ])
+    model = CompletionFilterModel()
+    model.setSourceModel(source)
+
+    # typed, then deleted
+    for text in ("", "a", "ab", "ab ", "ab c", "abC", "a", "b.", "", "c"):
+        model.set_filter(text, match)
+        assert rows(model) == regexp_filter(source, text, match), text
+
+
+def test_narrowing_only_tests_matching_rows(qtbot):
+    source = QStringListModel(["abc", "abd", "bcd", "xyz"])
+    model = CompletionFilterModel()
+    model.setSourceModel(source)
+    model.set_filter("a", Prompt.SimpleMatch)
+    assert rows(model) == [("abc",), ("abd",)]
+
+    tested = []
+    keys = model._row_keys
+
+    def row_keys(row):
+        tested.append(row)
+        return keys(row)
+
+    model._row_keys = row_keys
+    model.set_filter("abd", Prompt.SimpleMatch)
+    assert rows(model) == [("abd",)]
+    assert tested == [0, 1]
+
+    del tested[:]
+    model.set_filter("b", Prompt.SimpleMatch)
+    assert rows(model) == [("bcd",)]
+    assert tested == [0, 1, 2, 3]
+
+    model.set_filter("b", None)
+    assert len(rows(model)) == 4
+    assert model.mapToSource(model.index(2, 0)).row() == 2
+
+
+def test_match_columns(qtbot):
+    source = PromptTableModel([("quit", "C-x C-c"), ("copy", "M-w"),
+                               ("cut", "C-w")])
+    model = CompletionFilterModel()
+    model.setSourceModel(source)
+    model.set_filter("c", Prompt.FuzzyMatch)
+    assert len(rows(model)) == 3
+
+    model.set_match_columns(1)
+    assert rows(model) == [("copy", "M-w"), ("cut", "C-w")]
+    model.set_filter("w", Prompt.FuzzyMatch)
+    assert rows(model) == []
+    model.set_match_columns(None)
+    assert rows(model) == [("copy", "M-w"), ("cut", "C-w")]
+
+
+def test_source_changes(qtbot):
+    source = QStringListModel(["abc", "xyz", "abd"])
+    model = CompletionFilterModel()
+    model.setSourceModel(source)
+    model.set_filter("ab", Prompt.FuzzyMatch)
+    assert rows(model) == [("abc",), ("abd",)]
+
+    source.insertRows(1, 2)
+    source.setData(source.index(1), "zab")
+    source.setData(source.index(2), "nope")
+    assert rows(model) == [("abc",), ("zab",), ("abd",)]
+    assert model.mapToSource(model.index(2, 0)).row() == 4
+    assert model.mapFromSource(source.index(4)).row() == 2
+    assert not model.mapFromSource(source.index(2)).isValid()
+
+    source.setData(source.index(0), "changed")
+    source.setData(source.index(2), "abnope")
+    assert rows(model) == [("zab",), ("abnope",), ("abd",)]
+
+    source.removeRows(1, 2)
+    assert rows(model) == [("abd",)]
+
+    source.setStringList(["ab", "cd"])
+    assert rows(model) == [("ab",)]
+
+    model.setSourceModel(None)
+    assert model.rowCount() == 0
+
+
+def test_fetch_more(qtbot):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t (url TEXT, title TEXT)")
+    conn.executemany("INSERT INTO t VALUES (?, ?)",
+                     (("url%d" % i, "title%d" % i) for i in range(25)))
+    source = PagedTableModel(
+        lambda text, limit, offset: conn.execute(
+            "SELECT url, title FROM t ORDER BY rowid LIMIT ? OFFSET ?",
+            (limit, offset)))
+    source.page_size = 10
+    source.text_changed("")
+
+    model = CompletionFilterModel()
+    model.setSourceModel(source)
+    model.set_filter("title1", Prompt.FuzzyMatch)
+    assert rows(model) == [("url1", "title1")]
+
+    assert model.canFetchMore()
+    with qtbot.waitSignal(model.rowsInserted):
+        model.fetchMore()
+    # title1, then title10 to title19
+    assert len(rows(model)) == 11
+    model.fetchMore()
+    assert not model.canFetchMore()
+    assert len(rows(model)) == 11
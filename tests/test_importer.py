@@ -0,0 +1,126 @@
+import json
+import sqlite3
+from datetime import datetime
+
+from webmacs.bookmarks import Bookmarks, insert_bookmarks
+from webmacs.importer import ImportRunner, read_bookmarks, read_history
+from webmacs.storage import Storage
+from webmacs.visited_links import VisitedLinks, has_fts_index, insert_links
+
+
+NETSCAPE_BOOKMARKS = """<!DOCTYPE NETSCAPE-Bookmark-file-1>
+<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">
+<TITLE>Bookmarks</TITLE>
+<H1>Bookmarks Menu</H1>
+<DL><p>
+    <DT><H3>Python</H3>
+    <DL><p>
+        <DT><A HREF="https://www.python.org/" ADD_DATE="1">Python &amp; co</A>
+        <DT><A HREF="place:sort=8&maxResults=10">Recent Tags</A>
+    </DL><p>
+    <DT><A HREF="https://github.com/parkouss/webmacs"></A>
+</DL>
+"""
+
+
+def test_read_netscape_bookmarks(tmpdir):
+    path = tmpdir.join("bookmarks.html")
+    path.write(NETSCAPE_BOOKMARKS)
+    assert list(read_bookmarks(str(path))) == [
+        ("https://www.python.org/", "Python & co"),
+        ("https://github.com/parkouss/webmacs",
+         "https://github.com/parkouss/webmacs"),
+    ]
+
+
+def test_read_chrome_bookmarks(tmpdir):
+    path = tmpdir.join("Bookmarks")
+    path.write(json.dumps({"version": 1, "roots": {
+        "bookmark_bar": {"type": "folder", "children": [
+            {"type": "url", "name": "a", "url": "https://a.com/"},
+            {"type": "folder", "children": [
+                {"type": "url", "name": "b", "url": "https://b.com/"},
+            ]},
+        ]},
+        "other": {"type": "folder", "children": []},
+        "sync_transaction_version": "1",
+    }}))
+    assert list(read_bookmarks(str(path))) == [("https://a.com/", "a"),
+                                               ("https://b.com/", "b")]
+
+
+def test_read_firefox_places(tmpdir):
+    path = str(tmpdir.join("places.sqlite"))
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+    CREATE TABLE moz_places (id INTEGER PRIMARY KEY, url TEXT, title TEXT,
+                             visit_count INTEGER, last_visit_date INTEGER);
+    CREATE TABLE moz_bookmarks (id INTEGER PRIMARY KEY, type INTEGER,
+                                fk INTEGER, title TEXT);
+    INSERT INTO moz_places VALUES (1, 'https://a.com/', 'a', 3,
+                                   1546300800000000);
+    INSERT INTO moz_places VALUES (2, 'https://b.com/', NULL, 0, NULL);
+    INSERT INTO moz_places VALUES (3, 'place:sort=8', NULL, 0, NULL);
+    INSERT INTO moz_bookmarks VALUES (1, 1, 2, 'b');
+    INSERT INTO moz_bookmarks VALUES (2, 1, 3, 'recent');
+    INSERT INTO moz_bookmarks VALUES (3, 2, NULL, 'folder');
+    """)
+    conn.close()
+
+    assert list(read_history(path)) == [
+        ("https://a.com/", "a", datetime.fromtimestamp(1546300800), 3)]
+    assert list(read_bookmarks(path)) == [("https://b.com/", "b")]
+
+
+def test_import_history(tmpdir, qtbot):
+    source = str(tmpdir.join("History"))
+    conn = sqlite3.connect(source)
+    conn.execute("CREATE TABLE urls (id INTEGER PRIMARY KEY, url TEXT,"
+                 " title TEXT, visit_count INTEGER, last_visit_time INTEGER)")
+    # microseconds since 1601-01-01
+    conn.executemany(
+        "INSERT INTO urls (url, title, visit_count, last_visit_time)"
+        " VALUES (?, ?, ?, ?)",
+        (("https://%d.com/" % i, "page %d" % i, 1,
+          13200000000000000 + i) for i in range(25)))
+    conn.commit()
+    conn.close()
+
+    path = str(tmpdir.join("visitedlinks.db"))
+    visitedlinks = VisitedLinks(Storage(str(tmpdir)))
+    visitedlinks.visit("https://3.com/", "mine")
+    visitedlinks.flush()
+
+    runner = ImportRunner(path, read_history(source), lambda conn, links:
+                          insert_links(conn, links, has_fts_index(conn)))
+    runner.batch_size = 10
+    with qtbot.waitSignals([runner.progress] * 3):
+        assert runner.run_in_thread() == 25
+
+    assert visitedlinks.stats()["rows"] == 25
+    assert list(visitedlinks.search("page 12")) == [("https://12.com/",
+                                                     "page 12")]
+    # existing links keep their title, and count the imported visits
+    assert list(visitedlinks.search("mine")) == [("https://3.com/", "mine")]
+    assert visitedlinks._conn.execute(
+        "SELECT visits FROM visitedlinks WHERE url = 'https://3.com/'"
+    ).fetchone()[0] == 2
+
+
+def test_import_bookmarks(tmpdir, qtbot):
+    source = tmpdir.join("bookmarks.html")
+    source.write(NETSCAPE_BOOKMARKS)
+    path = str(tmpdir.join("bookmarks.db"))
+    bookmarks = Bookmarks(Storage(str(tmpdir)))
+    bookmarks.set("https://www.python.org/", "python")
+    assert bookmarks.list()
+
+    runner = ImportRunner(path, read_bookmarks(str(source)),
+                          insert_bookmarks)
+    assert runner.run_in_thread() == 2
+    assert bookmarks.check_changes()
+    assert bookmarks.list() == [
+        ("https://github.com/parkouss/webmacs",
+         "https://github.com/parkouss/webmacs"),
+        ("https://www.python.org/", "python"),
+    ]
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+from PyQt5.QtCore import QEvent
+
+from webmacs import variables
+from webmacs.key_latency import KEY_LATENCIES, KeyLatencies, \
+    LatencyHistogram
+from webmacs.keymaps import Keymap, KeyPress
+from webmacs.keyboardhandler import KeyEater
+
+
+def test_latency_histogram():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) == 0.0
+    for i in range(1, 101):
+        histogram.add(i / 1000)
+    stats = histogram.stats()
+    assert stats["count"] == 100
+    assert stats["max"] == 0.1
+    # percentiles are the upper bound of their bucket, within 19%
+    assert 0.050 <= stats["p50"] <= 0.050 * 1.19
+    assert 0.099 <= stats["p99"] <= 0.1
+    assert stats["mean"] == pytest.approx(0.0505)
+
+
+def test_slowest_calls():
+    latencies = KeyLatencies(slowest_size=2)
+    keys = [KeyPress.from_str("C-x"), KeyPress.from_str("b")]
+    for latency in (0.01, 0.03, 0.02, 0.03):
+        latencies.record("switch-buffer", keys, latency)
+    assert [(call["latency"], call["chord"])
+            for call in latencies.slowest()] == [(0.03, "C-x b"),
+                                                 (0.03, "C-x b")]
+    assert latencies.stats()[0]["count"] == 4
+
+
+def test_key_eater_records_latencies():
+    keymap = Keymap("test-key-latency")
+
+    @keymap.define_key("C-M-S-l")
+    def command(ctx):
+        pass
+
+    eater = KeyEater()
+    eater.set_local_key_map(keymap)
+    keypress = KeyPress.from_str("C-M-S-l")
+    event = keypress.to_qevent(QEvent.KeyPress)
+
+    KEY_LATENCIES.reset()
+    assert eater.event_filter(None, event)
+    assert KEY_LATENCIES.commands == {}
+
+    variables.set("key-latency-stats", True)
+    try:
+        assert eater.event_filter(None, event)
+    finally:
+        variables.set("key-latency-stats", False)
+    assert list(KEY_LATENCIES.commands) == [
+        "test_key_latency:command"]
+    assert KEY_LATENCIES.slowest()[0]["chord"] == "C-M-S-l"
+    KEY_LATENCIES.reset()
+
+
+def test_time_waiting_in_prompts_is_not_measured():
+    keymap = Keymap("test-key-latency-prompt")
+    eater = KeyEater()
+    eater.set_local_key_map(keymap)
+    inner = KeyPress.from_str("C-M-S-i").to_qevent(QEvent.KeyPress)
+
+    @keymap.define_key("C-M-S-i")
+    def inner_command(ctx):
+        pass
+
+    @keymap.define_key("C-M-S-o")
+    def outer_command(ctx):
+        # like a blocking prompt, where keys are typed
+        with KEY_LATENCIES.waiting():
+            time.sleep(0.05)
+            assert eater.event_filter(None, inner)
+
+    KEY_LATENCIES.reset()
+    variables.set("key-latency-stats", True)
+    try:
+        assert eater.event_filter(
+            None, KeyPress.from_str("C-M-S-o").to_qevent(QEvent.KeyPress))
+    finally:
+        variables.set("key-latency-stats", False)
+    stats = {s["command"]: s for s in KEY_LATENCIES.stats()}
+    assert stats["test_key_latency:outer_command"]["max"] < 0.05
+    assert stats["test_key_latency:inner_command"]["count"] == 1
+    KEY_LATENCIES.reset()
@@ -0,0 +1,154 @@
+import pytest
+from PyQt5.QtCore import Qt, QEvent
+from PyQt5.QtGui import QKeyEvent
+
+from webmacs.keymaps import Keymap, KeyPress, GLOBAL_KEYMAP, dispatch_table
+from webmacs.keyboardhandler import KeyEater, CallHandler
+
+
+def test_keypresses_are_interned():
+    keypress = KeyPress.from_str("C-M-x")
+    event = QKeyEvent(QEvent.KeyPress, Qt.Key_X,
+                      Qt.ControlModifier | Qt.AltModifier, "x")
+    assert KeyPress.from_qevent(event) is keypress
+    assert KeyPress.from_qevent(event) is keypress
+    assert KeyPress(*keypress) is keypress
+    assert hash(keypress) == hash(tuple(keypress))
+    assert str(keypress) == "C-M-x"
+    assert str(KeyPress.from_qevent(
+        QKeyEvent(QEvent.KeyPress, Qt.Key_A, Qt.ShiftModifier, "A"))) == "A"
+    assert KeyPress.from_qevent(
+        QKeyEvent(QEvent.KeyPress, Qt.Key_Shift, Qt.ShiftModifier)) is None
+
+
+def keys(chord):
+    return [KeyPress.from_str(k) for k in chord.split()]
+
+
+def cmd(name):
+    def command(ctx):
+        pass
+    command.__name__ = name
+    return command
+
+
+@pytest.fixture(scope="module")
+def keymaps():
+    parent = Keymap("test-dispatch-parent")
+    child = Keymap("test-dispatch-child", parent=parent)
+    parent.define_key("C-M-S-a", cmd("parent-a"))
+    parent.define_key("C-M-S-b", cmd("parent-b"))
+    parent.define_key("C-M-S-c x", cmd("parent-c-x"))
+    child.define_key("C-M-S-a", cmd("child-a"))
+    child.define_key("C-M-S-c y", cmd("child-c-y"))
+    GLOBAL_KEYMAP.define_key("C-M-S-b", cmd("global-b"))
+    GLOBAL_KEYMAP.define_key("C-M-S-c z", cmd("global-c-z"))
+    GLOBAL_KEYMAP.define_key("C-M-S-d", cmd("global-d"))
+    yield parent, child
+    for key in ("C-M-S-b", "C-M-S-c z", "C-M-S-d"):
+        GLOBAL_KEYMAP.undefine_key(key)
+
+
+def lookup(table, chord):
+    node = table.follow(keys(chord)[:-1])
+    result = node.get(keys(chord)[-1]) if node is not None else None
+    if result is not None and result.complete:
+        return result.command.__name__, result.keymap.name
+    return result
+
+
+def test_dispatch_table(keymaps):
+    parent, child = keymaps
+    table = dispatch_table(child)
+    assert dispatch_table(child) is table
+
+    assert lookup(table, "C-M-S-a") == ("child-a", "test-dispatch-child")
+    assert lookup(table, "C-M-S-b") == ("parent-b", "test-dispatch-child")
+    assert lookup(table, "C-M-S-d") == ("global-d", "global")
+    # parents are only searched at the top level, but the global keymap is
+    # merged at every level
+    assert lookup(table, "C-M-S-c x") is None
+    assert lookup(table, "C-M-S-c y") == ("child-c-y", "test-dispatch-child")
+    assert lookup(table, "C-M-S-c z") == ("global-c-z", "global")
+    assert not lookup(table, "C-M-S-c").complete
+
+    assert lookup(dispatch_table(child, False), "C-M-S-d") is None
+    assert lookup(dispatch_table(parent), "C-M-S-c x") == (
+        "parent-c-x", "test-dispatch-parent")
+
+    # the tables are rebuilt when a binding changes
+    child.define_key("C-M-S-e", cmd("child-e"))
+    assert dispatch_table(child) is not table
+    assert lookup(dispatch_table(child), "C-M-S-e") == (
+        "child-e", "test-dispatch-child")
+    child.undefine_key("C-M-S-e")
+    assert lookup(dispatch_table(child), "C-M-S-e") is None
+
+
+class RecordCallHandler(CallHandler):
+    def __init__(self):
+        CallHandler.__init__(self)
+        self.calls = []
+
+    def call(self, ctx, keymap, keypress, command):
+        self.calls.append((command.__name__, keymap.name))
+
+    def no_call(self, sender, keymap, keypress):
+        self.calls.append(None)
+
+
+def test_key_eater(keymaps):
+    parent, child = keymaps
+    eater = KeyEater()
+    handler = RecordCallHandler()
+    eater.set_call_handler(handler)
+    eater.set_local_key_map(child)
+
+    for chord in ("C-M-S-a", "C-M-S-c z", "C-M-S-c x", "C-M-S-d"):
+        for keypress in keys(chord):
+            eater._handle_keypress(None, keypress)
+    assert handler.calls == [("child-a", "test-dispatch-child"),
+                             ("global-c-z", "global"),
+                             None,
+                             ("global-d", "global")]
+
+    # the local keymap changes during a key chord
+    del handler.calls[:]
+    eater._handle_keypress(None, KeyPress.from_str("C-M-S-c"))
+    eater.set_local_key_map(parent)
+    eater._handle_keypress(None, KeyPress.from_str("x"))
+    assert handler.calls == [("parent-c-x", "test-dispatch-parent")]
+
+
+def test_reverse_index():
+    parent = Keymap("test-index-parent")
+    child = Keymap("test-index-child", parent=parent)
+    a, b = cmd("a"), cmd("b")
+    parent.define_key("C-c a", a)
+    parent.define_key("C-x a", a)
+    parent.define_key("C-x b", b)
+    child.define_key("C-c b", b)
+    child.define_key("M-a", a)
+
+    assert parent.bindings_for(a) == ["C-c a", "C-x a"]
+    # C-c a is shadowed by the C-c prefix of the child
+    assert child.bindings_for(a) == ["M-a", "C-x a"]
+    assert child.bindings_for(a, with_parent=False) == ["M-a"]
+    assert sorted(child.iter_bindings(),
+                  key=lambda binding: binding[0]) == [
+        ("C-c b", b, None), ("C-x a", a, parent), ("C-x b", b, parent),
+        ("M-a", a, None)]
+
+    # redefining a prefix removes the bindings under it
+    parent.define_key("C-x", b)
+    assert parent.bindings_for(a) == ["C-c a"]
+    assert parent.bindings_for(b) == ["C-x"]
+    parent.define_key("C-x", a)
+    assert parent.bindings_for(b) == []
+
+    # undefining from a child removes the binding from its parent
+    child.undefine_key("C-x")
+    assert parent.bindings_for(a) == ["C-c a"]
+    child.undefine_key("M-a")
+    assert child.bindings_for(a) == []
+    assert child.all_bindings(raw_fn=True) == [("C-c b", "b")]
@@ -0,0 +1,61 @@
+import sqlite3
+
+from webmacs.minibuffer.prompt import PagedTableModel
+
+
+def make_model(nb_rows, page_size=10):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t (url TEXT, title TEXT)")
+    conn.executemany("INSERT INTO t VALUES (?, ?)",
+                     (("url%d" % i, "title%d" % i) for i in range(nb_rows)))
+
+    def query(text, limit, offset):
+        return conn.execute("SELECT url, title FROM t WHERE url LIKE ?"
+                            " ORDER BY rowid LIMIT ? OFFSET ?",
+                            (text + "%", limit, offset))
+
+    model = PagedTableModel(query)
+    model.page_size = page_size
+    return model
+
+
+def test_rows_are_fetched_by_pages(qtbot):
+    model = make_model(25)
+    model.text_changed("url")
+    assert model.rowCount() == 10
+    assert model.columnCount() == 2
+    assert model.data(model.index(3, 1)) == "title3"
+    assert model.canFetchMore()
+
+    with qtbot.waitSignal(model.rowsInserted):
+        model.fetchMore()
+    assert model.rowCount() == 20
+    model.fetchMore()
+    assert model.rowCount() == 25
+    assert not model.canFetchMore()
+    assert not model.index(25, 0).isValid()
+
+
+def test_text_changed_resets_the_rows(qtbot):
+    model = make_model(25)
+    model.text_changed("url")
+    with qtbot.waitSignal(model.modelReset):
+        model.text_changed("url1")
+    # url1, url10 to url19
+    assert model.rowCount() == 10
+    assert model.canFetchMore()
+    model.fetchMore()
+    assert model.rowCount() == 11
+    assert not model.canFetchMore()
+
+    model.text_changed("nothing")
+    assert model.rowCount() == 0
+    assert not model.canFetchMore()
+
+
+def test_remove_row(qtbot):
+    model = make_model(3)
+    model.text_changed("")
+    assert model.remove_row(1) == ("url1", "title1")
+    assert [model.data(model.index(i, 0)) for i in range(2)] == ["url0",
+                                                                 "url2"]
@@ -0,0 +1,63 @@
+from webmacs.bookmarks import Bookmarks
+from webmacs.prefix_index import PrefixIndex
+from webmacs.storage import Storage
+
+
+def test_prefix_index():
+    index = PrefixIndex([("google", 1), ("github", 2), ("duckduckgo", 3)])
+    index["gitlab"] = 4
+    assert list(index) == ["duckduckgo", "github", "gitlab", "google"]
+    assert list(index.starting_with("git")) == ["github", "gitlab"]
+    assert list(index.starting_with("h")) == []
+    assert list(index.starting_with("")) == list(index)
+
+    assert index.unique_key("git") is None
+    assert index.unique_key("gith") == "github"
+    assert index.unique_key("goo") == "google"
+    assert index.unique_key("google") == "google"
+    assert index.unique_key("googles") is None
+    assert index.unique_key("zz") is None
+
+    del index["github"]
+    assert index.unique_key("git") == "gitlab"
+    index["gitlab"] = 5
+    assert len(index) == 3
+    assert list(index.items()) == [("duckduckgo", 3), ("gitlab", 5),
+                                   ("google", 1)]
+    assert "gitlab" in index and "github" not in index
+    assert index.get("github") is None
+
+
+def test_bookmarks_index(tmpdir, qtbot):
+    bookmarks = Bookmarks(Storage(str(tmpdir)))
+    bookmarks.set("https://a.com/", "a")
+    index = bookmarks.index()
+    assert list(index.items()) == [("a", "https://a.com/")]
+
+    # updated in place by this instance
+    bookmarks.set("https://b.com/", "b")
+    bookmarks.set("https://a2.com/", "a")
+    assert bookmarks.index() is index
+    assert list(index.items()) == [("a", "https://a2.com/"),
+                                   ("b", "https://b.com/")]
+    bookmarks.remove("https://a2.com/")
+    assert index["a"] == "https://a.com/"
+    bookmarks.set("https://b.com/", "c")
+    assert list(index.items()) == [("a", "https://a.com/"),
+                                   ("c", "https://b.com/")]
+
+    # rebuilt when another instance changes the bookmarks
+    Bookmarks(Storage(str(tmpdir))).remove("https://a.com/")
+    assert bookmarks._watcher.check()
+    assert list(bookmarks.index().items()) == [("c", "https://b.com/")]
+
+
+def test_bookmarks_urls_starting_with(tmpdir, qtbot):
+    bookmarks = Bookmarks(Storage(str(tmpdir)))
+    bookmarks.set("https://a.com/", "a")
+    bookmarks.set("https://ab.com/", "ab")
+    bookmarks.set("https://b.com/", "b")
+    assert list(bookmarks.urls_starting_with("https://a")) == [
+        ("https://a.com/", "a"), ("https://ab.com/", "ab")]
+    assert list(bookmarks.urls_starting_with("a")) == []
+    assert len(list(bookmarks.urls_starting_with(""))) == 3
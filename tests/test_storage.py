@@ -0,0 +1,202 @@
+import sqlite3
+
+import pytest
+
+from webmacs.bookmarks import Bookmarks
+from webmacs.storage import Storage, connect, retry_on_busy
+from webmacs.visited_links import VisitedLinks
+
+
+def lock(path):
+    """
+    Returns a connection holding the write lock of the database at path.
+    """
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("BEGIN IMMEDIATE")
+    return conn
+
+
+def test_databases_use_wal(tmpdir, qtbot):
+    path = str(tmpdir.join("bookmarks.db"))
+    Bookmarks(Storage(str(tmpdir)))
+    assert connect(path).execute(
+        "PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_bookmarks_changes_are_seen_by_other_instances(tmpdir, qtbot):
+    # each instance has its own storage
+    bookmarks1 = Bookmarks(Storage(str(tmpdir)))
+    bookmarks2 = Bookmarks(Storage(str(tmpdir)))
+    changes = []
+    bookmarks1.changed.add(lambda: changes.append(bookmarks1.list()))
+    assert bookmarks1.list() == []
+
+    bookmarks2.set("https://a.com/", "a")
+    # the list is cached until the change is detected
+    assert bookmarks1.list() == []
+    assert bookmarks1._watcher.check()
+    assert changes == [[("https://a.com/", "a")]]
+    assert not bookmarks1._watcher.check()
+
+    # the changes of an instance are not polled by itself
+    bookmarks1.remove("https://a.com/")
+    assert changes[-1] == []
+    assert not bookmarks1._watcher.check()
+    assert bookmarks2._watcher.check()
+    assert bookmarks2.list() == []
+
+
+def test_visits_are_kept_while_the_database_is_locked(tmpdir, qtbot):
+    path = str(tmpdir.join("visitedlinks.db"))
+    visitedlinks = VisitedLinks(Storage(str(tmpdir)))
+    other = VisitedLinks(Storage(str(tmpdir)))
+    visitedlinks.visit("https://a.com/", "a")
+
+    locker = lock(path)
+    assert not visitedlinks.flush()
+    assert visitedlinks._flush_timer.isActive()
+    # readers are not blocked by the writer
+    assert list(other.visited_urls()) == []
+    locker.rollback()
+
+    assert visitedlinks.flush()
+    assert other._watcher.check()
+    assert list(other.visited_urls()) == [("https://a.com/", "a")]
+
+
+def test_writes_are_retried_later_when_locked(tmpdir, qtbot):
+    storage = Storage(str(tmpdir))
+    bookmarks = Bookmarks(storage)
+    visitedlinks = VisitedLinks(storage)
+    visitedlinks.visit("https://a.com/", "a")
+    assert visitedlinks.flush()
+
+    locker = lock(str(tmpdir.join("bookmarks.db")))
+    bookmarks.set("https://a.com/", "a")
+    bookmarks.set("https://a.com/", "b")
+    assert bookmarks.index().get("a") is None
+    locker.rollback()
+    # the writes are done later, in order
+    qtbot.waitUntil(lambda: bookmarks.index().get("b") == "https://a.com/")
+    assert bookmarks.list() == [("https://a.com/", "b")]
+
+    from webmacs.ignore_certificates import IgnoredCertificates
+    certs = IgnoredCertificates(storage)
+    certs.ignore("a.com:443")
+    locker = lock(str(tmpdir.join("ignoredcerts.db")))
+    certs.remove("a.com:443")
+    assert certs.is_ignored("a.com:443")
+    locker.rollback()
+    qtbot.waitUntil(lambda: not certs.is_ignored("a.com:443"))
+
+    # the writes still waiting when the storage is closed are done by the
+    # storage worker
+    locker = lock(str(tmpdir.join("visitedlinks.db")))
+    visitedlinks.remove("https://a.com/")
+    visitedlinks.visit("https://b.com/", "b")
+    locker.rollback()
+    visitedlinks._flush_on_quit()
+    storage.close()
+    assert list(VisitedLinks(Storage(str(tmpdir))).visited_urls()) == [
+        ("https://b.com/", "b")]
+
+
+def test_retry_on_busy(tmpdir, qtbot):
+    path = str(tmpdir.join("test.db"))
+    conn = connect(path, timeout=0)
+    conn.execute("CREATE TABLE t (x)")
+    locker = lock(path)
+    with pytest.raises(sqlite3.OperationalError):
+        retry_on_busy(conn.execute, "INSERT INTO t VALUES (1)", attempts=2,
+                      delay=0)
+
+    calls = []
+
+    def insert():
+        calls.append(1)
+        if len(calls) == 2:
+            locker.rollback()
+        conn.execute("INSERT INTO t VALUES (1)")
+        conn.commit()
+
+    retry_on_busy(insert, delay=0)
+    assert len(calls) == 2
+    assert conn.execute("SELECT x FROM t").fetchall() == [(1,)]
+
+
+def test_storage_connections(tmpdir):
+    storage = Storage(str(tmpdir))
+    migrations = []
+
+    def create(conn):
+        migrations.append("create")
+        conn.execute("CREATE TABLE t (x)")
+
+    conn = storage.connection("test.db", [create])
+    assert storage.connection("test.db", [create]) is conn
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    storage.close()
+
+    def add_column(conn):
+        migrations.append("add column")
+        conn.execute("ALTER TABLE t ADD COLUMN y")
+
+    # the migrations are run once, by the first instance to open it
+    Storage(str(tmpdir)).connection("test.db", [create, add_column])
+    conn = Storage(str(tmpdir)).connection("test.db", [create, add_column])
+    assert migrations == ["create", "add column"]
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 2
+
+
+def test_failed_migrations_are_rolled_back(tmpdir):
+    def migration(conn):
+        conn.execute("CREATE TABLE t (x)")
+        raise sqlite3.OperationalError("oops")
+
+    with pytest.raises(sqlite3.OperationalError):
+        Storage(str(tmpdir)).connection("test.db", [migration])
+    conn = sqlite3.connect(str(tmpdir.join("test.db")))
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 0
+    assert conn.execute("SELECT name FROM sqlite_master").fetchall() == []
+
+
+def test_storage_worker(tmpdir, qtbot):
+    from webmacs.ignore_certificates import IgnoredCertificates
+
+    storage = Storage(str(tmpdir))
+    certs = IgnoredCertificates(storage)
+    certs.ignore("example.com:443")
+
+    results = []
+    future = certs.is_ignored_async("example.com:443")
+    future.then(lambda error, result: results.append((error, result)))
+    certs.is_ignored_async("other.com:443").then(
+        lambda error, result: results.append((error, result)))
+    qtbot.waitUntil(lambda: len(results) == 2)
+    # results are delivered in the GUI thread, in order
+    assert results == [(False, True), (False, False)]
+    assert future.done()
+    # a callback added later is called right away
+    future.then(lambda error, result: results.append(result))
+    assert results[-1] is True
+
+    def fail(conn):
+        conn.execute("SELECT * FROM nothing")
+
+    future = storage.submit("ignoredcerts.db", fail)
+    qtbot.waitUntil(future.done)
+    assert future.error and future.result is None
+    storage.close()
+
+
+def test_storage_worker_opens_the_databases(tmpdir, qtbot):
+    from webmacs.ignore_certificates import IgnoredCertificates
+
+    storage = Storage(str(tmpdir))
+    future = IgnoredCertificates(storage).is_ignored_async("example.com:443")
+    qtbot.waitUntil(future.done)
+    assert not future.error and future.result is False
+    # migrated in the storage thread only
+    assert storage._connections == {}
+    storage.close()
@@ -0,0 +1,210 @@
+from webmacs.storage import Storage
+from webmacs.visited_links import VisitedLinks, visited_links_flush_delay
+
+
+def rows(visitedlinks):
+    return list(visitedlinks._conn.execute(
+        "select url, title from visitedlinks order by url"))
+
+
+def test_visits_are_coalesced(tmpdir, qtbot):
+    visitedlinks = VisitedLinks(Storage(str(tmpdir)))
+    visitedlinks.visit("https://a.com/", "a")
+    visitedlinks.visit("https://b.com/", "b")
+    visitedlinks.visit("https://a.com/", "a again")
+    assert rows(visitedlinks) == []
+
+    visitedlinks.flush()
+    assert rows(visitedlinks) == [("https://a.com/", "a again"),
+                                  ("https://b.com/", "b")]
+    # most recent first
+    assert list(visitedlinks.visited_urls()) == [
+        ("https://a.com/", "a again"), ("https://b.com/", "b")]
+
+
+def test_visits_are_flushed_after_a_delay(tmpdir, qtbot, mocker):
+    mocker.patch.object(visited_links_flush_delay, "value", 10)
+    visitedlinks = VisitedLinks(Storage(str(tmpdir)))
+    visitedlinks.visit("https://a.com/", "a")
+    qtbot.waitUntil(lambda: rows(visitedlinks) == [("https://a.com/", "a")])
+
+
+def test_reads_and_removals_see_pending_visits(tmpdir, qtbot):
+    visitedlinks = VisitedLinks(Storage(str(tmpdir)))
+    visitedlinks.visit("https://a.com/", "a")
+    assert list(visitedlinks.visited_urls()) == [("https://a.com/", "a")]
+
+    visitedlinks.visit("https://b.com/", "b")
+    visitedlinks.remove("https://b.com/")
+    visitedlinks.remove("https://a.com/")
+    visitedlinks.flush()
+    assert rows(visitedlinks) == []
+
+
+def test_search(tmpdir, qtbot):
+    visitedlinks = VisitedLinks(Storage(str(tmpdir)))
+    visitedlinks.visit("https://github.com/parkouss/webmacs", "webmacs")
+    visitedlinks.visit("https://docs.python.org/3/library/sqlite3.html",
+                       "sqlite3 - DB-API 2.0 interface")
+    visitedlinks.visit("https://www.python.org/", "Welcome to Python.org")
+
+    def urls(text):
+        return sorted(url for url, _ in visitedlinks.search(text))
+
+    assert urls("githu webm") == ["https://github.com/parkouss/webmacs"]
+    assert urls("python") == ["https://docs.python.org/3/library/sqlite3.html",
+                              "https://www.python.org/"]
+    assert urls("sqlite interface") == [
+        "https://docs.python.org/3/library/sqlite3.html"]
+    assert urls('"python') == urls("python")
+    assert urls("nothing") == []
+    assert len(urls("")) == 3
+
+    # the index follows title changes and removals
+    visitedlinks.visit("https://www.python.org/", "Python home")
+    assert urls("welcome") == []
+    assert urls("home") == ["https://www.python.org/"]
+    visitedlinks.remove("https://www.python.org/")
+    assert urls("python") == ["https://docs.python.org/3/library/sqlite3.html"]
+
+
+def test_search_without_fts(tmpdir, qtbot, mocker):
+    mocker.patch.object(VisitedLinks, "_create_fts_index", return_value=False)
+    visitedlinks = VisitedLinks(Storage(str(tmpdir)))
+    visitedlinks.visit("https://github.com/parkouss/webmacs", "webmacs")
+    visitedlinks.visit("https://example.com/100%_sure", "example")
+
+    assert list(visitedlinks.search("github webm")) == [
+        ("https://github.com/parkouss/webmacs", "webmacs")]
+    assert list(visitedlinks.search("0%_")) == [
+        ("https://example.com/100%_sure", "example")]
+    assert list(visitedlinks.search("%")) == [
+        ("https://example.com/100%_sure", "example")]
+    assert list(visitedlinks.search("a_b")) == []
+
+
+def test_existing_history_is_indexed(tmpdir, qtbot):
+    import sqlite3
+
+    path = str(tmpdir.join("visitedlinks.db"))
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE visitedlinks"
+                 " (url TEXT PRIMARY KEY, title TEXT, lastseen DATE)")
+    conn.execute("INSERT INTO visitedlinks VALUES"
+                 " ('https://a.com/', 'old page', '2019-01-01 10:00:00')")
+    conn.execute("INSERT INTO visitedlinks VALUES"
+                 " ('https://b.com/', 'older page', '2018-01-01 10:00:00')")
+    conn.commit()
+    conn.close()
+
+    visitedlinks = VisitedLinks(Storage(str(tmpdir)))
+    assert list(visitedlinks.search("older")) == [("https://b.com/",
+                                                   "older page")]
+    # the frecency is initialized from the last visit
+    assert [url for url, _ in visitedlinks.search("")] == [
+        "https://a.com/", "https://b.com/"]
+    assert visitedlinks._conn.execute("PRAGMA user_version").fetchone()[0] == 1
+
+
+def test_cursor_survives_writes(tmpdir, qtbot):
+    visitedlinks = VisitedLinks(Storage(str(tmpdir)))
+    for i in range(5):
+        visitedlinks.visit("https://%d.com/" % i, str(i))
+    cursor = visitedlinks.search("")
+    assert next(cursor)[0] == "https://4.com/"
+
+    # a prompt removes an entry, or a page is loaded, while rows are fetched
+    visitedlinks.remove("https://4.com/")
+    visitedlinks.visit("https://5.com/", "5")
+    visitedlinks.flush()
+    assert len(list(cursor)) == 4
+
+
+def test_frecency(tmpdir, qtbot):
+    from datetime import datetime, timedelta
+    from webmacs.visited_links import FRECENCY_HALF_LIFE
+
+    visitedlinks = VisitedLinks(Storage(str(tmpdir)))
+    now = datetime.now()
+    half_life = timedelta(seconds=FRECENCY_HALF_LIFE)
+    with visitedlinks._conn:
+        # visited 3 times two half-lives ago, it weights 0.75 now
+        visitedlinks._write_visit("https://old.com/", "old",
+                                  now - half_life * 2, count=3)
+        visitedlinks._write_visit("https://new.com/", "new", now)
+    assert [url for url, _ in visitedlinks.search("")] == [
+        "https://new.com/", "https://old.com/"]
+
+    # coalesced visits are all counted
+    visitedlinks.visit("https://old.com/", "old")
+    visitedlinks.visit("https://old.com/", "old")
+    visitedlinks.flush()
+    assert [url for url, _ in visitedlinks.search("")] == [
+        "https://old.com/", "https://new.com/"]
+    assert visitedlinks._conn.execute(
+        "SELECT visits FROM visitedlinks WHERE url = 'https://old.com/'"
+    ).fetchone()[0] == 5
+
+    plan = " ".join(row[-1] for row in visitedlinks._conn.execute(
+        "EXPLAIN QUERY PLAN SELECT url, title FROM visitedlinks"
+        " ORDER BY frecency DESC"))
+    assert "visitedlinks_frecency" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_compaction(tmpdir, qtbot):
+    from datetime import datetime, timedelta
+    from webmacs.visited_links import VisitedLinksCompactRunner
+
+    path = str(tmpdir.join("visitedlinks.db"))
+    visitedlinks = VisitedLinks(Storage(str(tmpdir)))
+    now = datetime.now()
+    with visitedlinks._conn:
+        for i in range(30):
+            visitedlinks._write_visit("https://old%d.com/" % i, "old",
+                                      now - timedelta(days=40))
+        for i in range(20):
+            visitedlinks._write_visit("https://new%d.com/" % i, "new",
+                                      now - timedelta(minutes=i))
+
+    runner = VisitedLinksCompactRunner(path, 30, 15)
+    runner.batch_size = 7
+    assert runner.run_in_thread() == 35
+    assert visitedlinks.stats()["rows"] == 15
+    # the least recently visited links were removed
+    assert sorted(url for url, _ in visitedlinks.search("new")) == sorted(
+        "https://new%d.com/" % i for i in range(15))
+    assert list(visitedlinks.search("old")) == []
+    assert visitedlinks._conn.execute(
+        "PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def test_compaction_of_a_legacy_database(tmpdir, qtbot):
+    import sqlite3
+    from webmacs.visited_links import VisitedLinksCompactRunner
+
+    path = str(tmpdir.join("visitedlinks.db"))
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE visitedlinks"
+                 " (url TEXT PRIMARY KEY, title TEXT, lastseen DATE)")
+    conn.executemany("INSERT INTO visitedlinks VALUES (?, ?, ?)",
+                     (("https://%d.com/" % i, "page %d" % i,
+                       "2019-01-01 10:00:%02d" % i) for i in range(50)))
+    conn.commit()
+    conn.close()
+
+    visitedlinks = VisitedLinks(Storage(str(tmpdir)))
+    visitedlinks.remove("https://3.com/")
+    assert VisitedLinksCompactRunner(path, 0, 0).run_in_thread() == 0
+    stats = visitedlinks.stats()
+    assert stats["rows"] == 49
+    assert stats["free"] == 0
+    assert visitedlinks._conn.execute(
+        "PRAGMA auto_vacuum").fetchone()[0] == 2
+    # the full text index was rebuilt after the vacuum
+    assert list(visitedlinks.search("page 49")) == [("https://49.com/",
+                                                     "page 49")]
+    visitedlinks.visit("https://49.com/", "renamed")
+    visitedlinks.flush()
+    assert list(visitedlinks.search("renamed")) == [("https://49.com/",
+                                                     "renamed")]
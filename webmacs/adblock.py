@@ -17,12 +17,22 @@ import os
 import logging
 import time
 import json
+import gzip
+import shutil
+import hashlib
+import tempfile
+import threading
 
-from datetime import datetime, timezone
-import dateparser
+from collections import OrderedDict, Counter
 
 from _adblock import AdBlock
+try:
+    from _adblock import Interceptor
+except ImportError:
+    # the extension was built without the Qt WebEngine development files
+    Interceptor = None
 from concurrent.futures import ThreadPoolExecutor, as_completed
+import urllib.error
 import urllib.request
 from . import variables
 from .runnable import Runner
@@ -43,6 +53,380 @@ adblock_urls_rules = variables.define_variable(
     type=variables.List(variables.String()),
 )
 
+adblock_verdict_cache_size = variables.define_variable(
+    "adblock-verdict-cache-size",
+    "Number of ad-blocking decisions kept in memory, so that requests"
+    " already seen for a site are not evaluated by the filters again."
+    " Setting it to 0 disables the cache.",
+    4096,
+    type=variables.Int(min=0),
+)
+
+adblock_native_interceptor = variables.define_variable(
+    "adblock-native-interceptor",
+    "If True, requests are matched against the ad-blocking filters in"
+    " native code, without calling python. Only available when the"
+    " webmacs extension was built with the Qt WebEngine development files,"
+    " and when adblock-allowed-sites and adblock-hosts-files are empty.",
+    True,
+    type=variables.Bool(),
+)
+
+adblock_allowed_sites = variables.define_variable(
+    "adblock-allowed-sites",
+    "A list of domain names of sites on which ad-blocking is disabled,"
+    " including their sub-domains. Note that requests are then filtered in"
+    " python, see adblock-native-interceptor.",
+    [],
+    type=variables.List(variables.String()),
+)
+
+adblock_hosts_files = variables.define_variable(
+    "adblock-hosts-files",
+    "A list of paths to hosts files (in the /etc/hosts format) listing host"
+    " names to block. Requests to these hosts are blocked without"
+    " evaluating the adblock filters. Note that requests are then filtered"
+    " in python, see adblock-native-interceptor.",
+    [],
+    type=variables.List(variables.String()),
+)
+
+# names commonly found in hosts files that must not be blocked
+HOSTS_FILE_IGNORED = frozenset((
+    "localhost", "localhost.localdomain", "local", "broadcasthost",
+    "ip6-localhost", "ip6-loopback", "0.0.0.0",
+))
+
+# requests with these schemes never reach the network
+UNFILTERED_SCHEMES = frozenset(("webmacs", "data", "blob", "file"))
+
+# blocked requests are counted by site for this number of sites, the
+# requests of the other ones are counted under OTHER_SITES
+MAX_BLOCKED_SITES = 1000
+OTHER_SITES = "(other sites)"
+
+# filters matching every other request, see AdBlockSet.set_exceptions
+MATCH_ALL_FILTERS = "|http\n|ws\n|ftp\n"
+
+
+class VerdictCache(object):
+    """
+    A bounded LRU cache of ad-blocking verdicts.
+
+    It is filled from the network IO thread and cleared from the GUI thread
+    when the ad-blocker changes. Each clear starts a new generation, and
+    verdicts computed during a previous generation are not stored.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._verdicts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._verdicts)
+
+    def get(self, key):
+        """
+        Returns the cached verdict for the key, or None.
+        """
+        with self._lock:
+            try:
+                verdict = self._verdicts[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._verdicts.move_to_end(key)
+            self.hits += 1
+            return verdict
+
+    def put(self, key, verdict, generation):
+        """
+        Store a verdict computed during the given generation.
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._verdicts[key] = verdict
+            self._verdicts.move_to_end(key)
+            if len(self._verdicts) > self.maxsize:
+                self._verdicts.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._verdicts.clear()
+            self.generation += 1
+
+    def stats(self):
+        return {
+            "size": len(self._verdicts),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class HostTrie(object):
+    """
+    A set of domain names, matching their sub-domains too.
+
+    Domains are stored by their reversed labels, so looking up a host only
+    walks its own labels, whatever the number of domains.
+    """
+
+    def __init__(self, domains=()):
+        self._root = {}
+        self._size = 0
+        for domain in domains:
+            self.add(domain)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, domain):
+        node = self._root
+        for label in reversed(domain.lower().strip(".").split(".")):
+            node = node.setdefault(label, {})
+        if None not in node:
+            node[None] = True
+            self._size += 1
+
+    def __contains__(self, host):
+        node = self._root
+        for label in reversed(host.split(".")):
+            node = node.get(label)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+
+def read_hosts_file(path):
+    """
+    Returns the set of host names listed in a hosts file.
+
+    Both "0.0.0.0 ads.example.com" lines and bare host names are accepted.
+    """
+    hosts = set()
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            fields = line.split("#", 1)[0].split()
+            if len(fields) > 1:
+                # the first field is the address
+                fields = fields[1:]
+            for host in fields:
+                host = host.lower()
+                if host not in HOSTS_FILE_IGNORED:
+                    hosts.add(host)
+    return hosts
+
+
+class FilterStage(object):
+    """
+    A stage of a FilterPipeline.
+
+    The decide() method returns the name of the filter list blocking a
+    request, False to let it go, or None to let the next stage decide.
+    Counters are only updated from the network IO thread.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.calls = 0
+        self.blocked = 0
+        self.allowed = 0
+        self.time = 0.0
+
+    def decide(self, url, first_party):
+        # no decision, subclasses override this
+        return None
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "calls": self.calls,
+            "blocked": self.blocked,
+            "allowed": self.allowed,
+            "time": self.time,
+        }
+
+
+class SchemeStage(FilterStage):
+    """Let go requests for local resources."""
+
+    name = "scheme"
+
+    def __init__(self, schemes=UNFILTERED_SCHEMES):
+        FilterStage.__init__(self)
+        self.schemes = schemes
+
+    def decide(self, url, first_party):
+        if url.scheme() in self.schemes:
+            return False
+
+
+class AllowedSitesStage(FilterStage):
+    """Let go every request made from an allowed site."""
+
+    name = "allowed sites"
+
+    def __init__(self, sites):
+        FilterStage.__init__(self)
+        self.sites = HostTrie(sites)
+
+    def decide(self, url, first_party):
+        if first_party.host() in self.sites:
+            return False
+
+
+class BlockedHostsStage(FilterStage):
+    """Block the requests to the hosts listed in hosts files."""
+
+    name = "blocked hosts"
+
+    def __init__(self, hosts):
+        FilterStage.__init__(self)
+        self.hosts = hosts
+
+    def decide(self, url, first_party):
+        if url.host() in self.hosts:
+            return "hosts files"
+
+
+class AdBlockStage(FilterStage):
+    """
+    Match the requests against the adblock filters, remembering the
+    verdicts in a VerdictCache.
+    """
+
+    name = "adblock filters"
+
+    def __init__(self, adblock, cache_size):
+        FilterStage.__init__(self)
+        self.adblock = adblock
+        self.verdicts = VerdictCache(cache_size)
+
+    def update_adblock(self, adblock):
+        self.adblock = adblock
+        self.verdicts.clear()
+
+    def decide(self, url, first_party):
+        # The generation must be read before the ad-blocker, see
+        # VerdictCache.
+        generation = self.verdicts.generation
+        adblock = self.adblock
+        if not adblock:
+            return False
+
+        url_s = url.toString()
+        domain = first_party.host()
+        key = (url_s, domain)
+        blocked_by = self.verdicts.get(key)
+        if blocked_by is None:
+            blocked_by = adblock.matching_list(url_s, domain) or False
+            self.verdicts.put(key, blocked_by, generation)
+        return blocked_by
+
+
+class FilterPipeline(object):
+    """
+    Decides if a request must be blocked, asking each stage in order until
+    one of them decides. Cheap stages come first, so that most requests are
+    decided before the adblock filters are evaluated.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+
+    def blocks(self, url, first_party):
+        """
+        Returns the name of the filter list blocking the request, or False.
+        """
+        for stage in self.stages:
+            start = time.perf_counter()
+            verdict = stage.decide(url, first_party)
+            stage.time += time.perf_counter() - start
+            stage.calls += 1
+            if verdict is not None:
+                if verdict:
+                    stage.blocked += 1
+                else:
+                    stage.allowed += 1
+                return verdict
+        return False
+
+    def stats(self):
+        return [stage.stats() for stage in self.stages]
+
+
+class AdBlockStats(object):
+    """
+    Counters of the blocked requests, by first party site (up to
+    MAX_BLOCKED_SITES), by filter list and by resource type.
+
+    They are only updated from the network IO thread, so no lock is
+    required; snapshot() returns copies that the GUI thread can use.
+    """
+
+    def __init__(self):
+        self.blocked = 0
+        self.sites = Counter()
+        self.lists = Counter()
+        self.types = Counter()
+
+    def record(self, site, filter_list, resource_type):
+        self.blocked += 1
+        if site not in self.sites and len(self.sites) >= MAX_BLOCKED_SITES:
+            site = OTHER_SITES
+        self.sites[site] += 1
+        self.lists[filter_list] += 1
+        self.types[resource_type] += 1
+
+    def snapshot(self):
+        return {
+            "blocked": self.blocked,
+            "sites": dict(self.sites),
+            "lists": dict(self.lists),
+            "types": dict(self.types),
+        }
+
+
+def create_filter_pipeline(adblock_stage):
+    """
+    Create a FilterPipeline from the adblock variables, ending with the
+    given AdBlockStage.
+    """
+    stages = [SchemeStage()]
+    if adblock_allowed_sites.value:
+        stages.append(AllowedSitesStage(adblock_allowed_sites.value))
+    hosts = set()
+    for path in adblock_hosts_files.value:
+        try:
+            hosts.update(read_hosts_file(os.path.expanduser(path)))
+        except OSError as exc:
+            logging.error("Unable to read the hosts file %s: %s", path, exc)
+    if hosts:
+        stages.append(BlockedHostsStage(hosts))
+    stages.append(adblock_stage)
+    return FilterPipeline(stages)
+
+
+def uses_python_filters():
+    """
+    Returns True if some filters are only implemented by the python
+    pipeline, and not by the native interceptor.
+    """
+    return bool(adblock_allowed_sites.value or adblock_hosts_files.value)
+
 
 class Adblocker(object):
     def __init__(self, cache_path):
@@ -52,6 +436,8 @@ class Adblocker(object):
         self._urls = {}
         self.register_filter_urls()
         self.cached_urls_path = os.path.join(self._cache_path, "urls.json")
+        self.validators_path = os.path.join(self._cache_path,
+                                            "validators.json")
 
     def register_filter_urls(self):
         """
@@ -81,81 +467,384 @@ class Adblocker(object):
         with open(self.cached_urls_path, "w") as f:
             json.dump(cached_urls, f)
 
-    def _download_file(self, url, path):
-        headers = {'User-Agent': "Magic Browser"}
+    def load_validators(self):
+        """
+        Returns the HTTP cache validators (etag and last-modified headers)
+        of the downloaded filter lists.
+        """
+        if not os.path.isfile(self.validators_path):
+            return {}
+        try:
+            with open(self.validators_path) as f:
+                return json.load(f)
+        except Exception:
+            logging.exception("Could not load validators. Removing %s."
+                              % self.validators_path)
+            os.unlink(self.validators_path)
+            return {}
+
+    def save_validators(self, validators):
+        with open(self.validators_path, "w") as f:
+            json.dump(validators, f)
+
+    def _download_file(self, url, path, validators):
+        """
+        Download the url into path if it changed on the server.
+
+        Returns the new validators for the url, or None if the file was not
+        modified.
+        """
+        headers = {'User-Agent': "Magic Browser",
+                   'Accept-Encoding': "gzip"}
+        if os.path.isfile(path):
+            # let the server tell us if the file has not been modified
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last-modified"):
+                headers["If-Modified-Since"] = validators["last-modified"]
         req = urllib.request.Request(url, None, headers)
-        with urllib.request.urlopen(req, timeout=5) as conn:
-            if os.path.isfile(path):
-                # check if the file on the server is newer than what we have
-                file_time = datetime.fromtimestamp(os.path.getmtime(path),
-                                                   timezone.utc)
+        try:
+            conn = urllib.request.urlopen(req, timeout=5)
+        except urllib.error.HTTPError as exc:
+            if exc.code != 304:
+                raise
+            logging.info("no need to download adblock rule: %s", url)
+            # touch on the file
+            os.utime(path, None)
+            return None
+
+        with conn:
+            logging.info("downloading adblock rule: %s", url)
+            info = conn.info()
+            body = conn
+            if info.get("content-encoding") == "gzip":
+                body = gzip.GzipFile(fileobj=conn)
+            # stream the body into a temporary file, renamed once complete
+            with tempfile.NamedTemporaryFile(dir=self._cache_path,
+                                             delete=False) as f:
                 try:
-                    last_modified = dateparser.parse(
-                        conn.info()["last-modified"],
-                        languages=["en"])
+                    shutil.copyfileobj(body, f)
                 except Exception:
-                    logging.exception(
-                        "Unable to parse the last-modified header for %s",
-                        url)
-                else:
-                    if last_modified < file_time:
-                        logging.info("no need to download adblock rule: %s",
-                                     url)
-                        # touch on the file
-                        os.utime(path, None)
-                        return False
-            logging.info("downloading adblock rule: %s", url)
-            with open(path, "w") as f:
-                data = conn.read()
-                f.write(data.decode("utf-8"))
-            return True
+                    os.unlink(f.name)
+                    raise
+            os.replace(f.name, path)
+            return {"etag": info.get("etag"),
+                    "last-modified": info.get("last-modified")}
 
     def _fetch_urls(self):
         modified = False
-        # do not try to download if files are less than a day old
+        validators = self.load_validators()
+        # do not try to download if files are less than an hour old
         to_download = [(url, path) for url, path in self._urls.items()
                        if not os.path.isfile(path)
                        or (os.path.getmtime(path) + 3600) < time.time()]
         if to_download:
             with ThreadPoolExecutor(max_workers=5) as executor:
-                futures = [executor.submit(self._download_file, url, path)
-                           for url, path in to_download]
+                futures = {
+                    executor.submit(self._download_file, url, path,
+                                    validators.get(url, {})): url
+                    for url, path in to_download
+                }
 
                 for future in as_completed(futures):
-                    if future.result():
+                    try:
+                        result = future.result()
+                    except Exception:
+                        logging.exception("Unable to download adblock rule:"
+                                          " %s", futures[future])
+                        continue
+                    if result is not None:
+                        validators[futures[future]] = result
                         modified = True
 
+        if modified:
+            self.save_validators(validators)
         return modified
 
-    def cache_file(self):
-        return os.path.join(self._cache_path, "cache.dat")
+    def compiled_dir(self):
+        return os.path.join(self._cache_path, "compiled")
 
-    def local_adblock(self):
+    def _compiled_file(self, digest):
+        return os.path.join(self.compiled_dir(), digest + ".dat")
+
+    def _manifest_path(self):
+        return os.path.join(self.compiled_dir(), "manifest.json")
+
+    def load_manifest(self):
+        """
+        Returns the digest of the compiled content for each filter url.
+        """
+        path = self._manifest_path()
+        if not os.path.isfile(path):
+            return {}
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except Exception:
+            logging.exception("Could not load the adblock manifest. Removing"
+                              " %s." % path)
+            os.unlink(path)
+            return {}
+
+    def save_manifest(self, manifest):
+        with open(self._manifest_path(), "w") as f:
+            json.dump(manifest, f)
+
+    def _list_digest(self, path):
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _load_compiled(self, digest):
         adblock = AdBlock()
-        cache = self.cache_file()
-        if os.path.isfile(cache):
-            logging.info("loading adblock cached data: %s", cache)
-            adblock.load(cache)
+        # compiled files are memory mapped, so webmacs instances share them
+        adblock.load_mmap(self._compiled_file(digest))
         return adblock
 
-    def maybe_update_adblock(self):
+    def _compile_list(self, path, digest):
+        """
+        Compile a filter list, returns the engine and the parse time.
+        """
+        logging.info("parsing adblock file: %s", path)
         adblock = AdBlock()
-        cache = self.cache_file()
-        cached_urls = self.load_cached_urls()
-        if cached_urls != self._urls:
-            self._fetch_urls()
-            modified = True
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+        start = time.perf_counter()
+        adblock.parse(content)
+        parse_time = time.perf_counter() - start
+        self._save_compiled(adblock, digest)
+        return adblock, parse_time
+
+    def _save_compiled(self, adblock, digest):
+        # write the compiled file then rename it, so it is never seen
+        # partially written. The temporary file is unique as other threads
+        # or instances may compile the same list.
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp",
+                                        dir=self.compiled_dir())
+        os.close(fd)
+        try:
+            adblock.save(tmp_path)
+            os.replace(tmp_path, self._compiled_file(digest))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _compile_lists(self, to_compile):
+        """
+        Compile the given (url, digest) lists in parallel, returns the
+        result of _compile_list for each url. Lists with the same content
+        are compiled once.
+
+        Parsing is done without the GIL in the C extension, so threads are
+        enough to use every core.
+        """
+        urls_by_digest = {}
+        for url, digest in to_compile:
+            urls_by_digest.setdefault(digest, []).append(url)
+        if not urls_by_digest:
+            return {}
+        engines = {}
+        with ThreadPoolExecutor(
+                max_workers=min(len(urls_by_digest), os.cpu_count() or 1)
+        ) as executor:
+            futures = {
+                executor.submit(self._compile_list, self._urls[urls[0]],
+                                digest): urls
+                for digest, urls in urls_by_digest.items()
+            }
+            for future in as_completed(futures):
+                for url in futures[future]:
+                    engines[url] = future.result()
+        return engines
+
+    def _exceptions_digest(self, manifest):
+        digest = hashlib.sha1(b"exceptions")
+        for list_digest in sorted(manifest.values()):
+            digest.update(list_digest.encode("ascii"))
+        return digest.hexdigest()
+
+    def _compile_exceptions(self, manifest):
+        """
+        Compile the exception rules of every list in one engine, see
+        AdBlockSet.set_exceptions.
+        """
+        rules = [MATCH_ALL_FILTERS]
+        for url in manifest:
+            if not os.path.isfile(self._urls[url]):
+                continue
+            with open(self._urls[url], encoding="utf-8") as f:
+                rules.extend(line for line in f if line.startswith("@@"))
+        adblock = AdBlock()
+        adblock.parse("".join(rules))
+        self._save_compiled(adblock, self._exceptions_digest(manifest))
+        return adblock
+
+    def _add_exceptions(self, adblock, manifest, load_only=False):
+        """
+        Set the exceptions engine of the lists of manifest on the adblock
+        set, compiling it unless load_only is True. Compiling reads every
+        list, it must not be done in the GUI thread.
+        """
+        digest = self._exceptions_digest(manifest)
+        if os.path.isfile(self._compiled_file(digest)):
+            engine = self._load_compiled(digest)
+        elif load_only:
+            return
         else:
-            modified = self._fetch_urls()
-        if modified or not os.path.isfile(cache):
-            for path in self._urls.values():
-                logging.info("parsing adblock file: %s", path)
-                with open(path) as f:
-                    adblock.parse(f.read())
-            adblock.save(cache)
-            logging.info("updating adblock cache file %s." % cache)
-            self.save_cached_urls(self._urls)
-            return adblock
+            engine = self._compile_exceptions(manifest)
+        adblock.set_exceptions(engine)
+
+    def _remove_unused_compiled(self, manifest):
+        used = set(d + ".dat" for d in manifest.values())
+        used.add(self._exceptions_digest(manifest) + ".dat")
+        for fname in os.listdir(self.compiled_dir()):
+            if fname.endswith(".dat") and fname not in used:
+                os.unlink(os.path.join(self.compiled_dir(), fname))
+        # the single cache file used by previous versions
+        legacy_cache = os.path.join(self._cache_path, "cache.dat")
+        if os.path.isfile(legacy_cache):
+            os.unlink(legacy_cache)
+
+    def _add_compiled(self, adblock, url, digest, compiled=None):
+        """
+        Add the compiled list of url to the adblock set, loading it unless
+        it was just compiled (compiled is then the (engine, parse time)
+        pair returned by _compile_list).
+        """
+        if compiled is None:
+            start = time.perf_counter()
+            engine = self._load_compiled(digest)
+            info = {"load_time": time.perf_counter() - start}
+        else:
+            engine, parse_time = compiled
+            info = {"parse_time": parse_time}
+        info["size"] = os.path.getsize(self._compiled_file(digest))
+        adblock.add(url, engine, info)
+
+    def local_adblock(self):
+        adblock = AdBlockSet()
+        manifest = self.load_manifest()
+        loaded = {}
+        for url in self._urls:
+            digest = manifest.get(url)
+            if digest and os.path.isfile(self._compiled_file(digest)):
+                logging.info("loading adblock compiled list: %s", url)
+                self._add_compiled(adblock, url, digest)
+                loaded[url] = digest
+        if loaded:
+            # when it is missing, it is compiled by maybe_update_adblock
+            self._add_exceptions(adblock, loaded, load_only=True)
+        return adblock
+
+    def maybe_update_adblock(self):
+        """
+        Download the filter lists and compile the ones that changed.
+
+        Returns a new :class:`AdBlockSet` if any list changed, else None.
+        """
+        if not os.path.isdir(self.compiled_dir()):
+            os.makedirs(self.compiled_dir())
+        cached_urls = self.load_cached_urls()
+        self._fetch_urls()
+        manifest = self.load_manifest()
+        new_manifest = {url: self._list_digest(path)
+                        for url, path in self._urls.items()
+                        if os.path.isfile(path)}
+        compiled = list(manifest.values())
+        if manifest:
+            compiled.append(self._exceptions_digest(manifest))
+        if cached_urls == self._urls and new_manifest == manifest and all(
+                os.path.isfile(self._compiled_file(d)) for d in compiled):
+            return None
+
+        engines = self._compile_lists(
+            (url, digest) for url, digest in new_manifest.items()
+            if not os.path.isfile(self._compiled_file(digest))
+        )
+        adblock = AdBlockSet()
+        for url, digest in new_manifest.items():
+            self._add_compiled(adblock, url, digest, engines.get(url))
+        if new_manifest:
+            self._add_exceptions(adblock, new_manifest)
+
+        logging.info("updating adblock manifest %s." % self._manifest_path())
+        self.save_manifest(new_manifest)
+        self._remove_unused_compiled(new_manifest)
+        self.save_cached_urls(self._urls)
+        return adblock
+
+
+class AdBlockSet(object):
+    """
+    An ad-blocker composed of one compiled engine per filter list.
+
+    Lists are compiled independently, so the exception rules of every list
+    are also compiled together in a separate engine, checked when a list
+    blocks a request.
+    """
+
+    def __init__(self):
+        self._engines = []
+        self._infos = {}
+        self.exceptions = None
+
+    def __len__(self):
+        return len(self._engines)
+
+    def add(self, name, adblock, info=None):
+        """
+        Add the engine of a filter list. info is a dict describing how the
+        engine was created (load or parse time, compiled size).
+        """
+        self._engines.append((name, adblock))
+        self._infos[name] = info or {}
+
+    def names(self):
+        return [name for name, _ in self._engines]
+
+    def adblocks(self):
+        return [adblock for _, adblock in self._engines]
+
+    def infos(self):
+        return [(name, self._infos[name]) for name, _ in self._engines]
+
+    def set_exceptions(self, adblock):
+        """
+        Set the engine of the exception rules of all the lists. It also
+        contains MATCH_ALL_FILTERS, so it matches every request unless an
+        exception rule applies.
+        """
+        self.exceptions = adblock
+
+    def _excepted(self, url, domain):
+        return (self.exceptions is not None
+                and not self.exceptions.matches(url, domain))
+
+    def matching_list(self, url, domain):
+        """
+        Returns the name of the first filter list blocking the url, or None
+        if no list blocks it or an exception rule of any list allows it.
+        """
+        for name, adblock in self._engines:
+            if adblock.matches(url, domain):
+                return None if self._excepted(url, domain) else name
+        return None
+
+    def matches(self, url, domain):
+        return self.matching_list(url, domain) is not None
+
+    def matches_many(self, urls, domain):
+        urls = tuple(urls)
+        verdicts = 0
+        for _, adblock in self._engines:
+            verdicts |= int.from_bytes(adblock.matches_many(urls, domain),
+                                       "big")
+        if verdicts and self.exceptions is not None:
+            verdicts &= int.from_bytes(
+                self.exceptions.matches_many(urls, domain), "big")
+        return verdicts.to_bytes(len(urls), "big")
 
 
 class AdblockUpdateRunner(Runner):
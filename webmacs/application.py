@@ -24,9 +24,17 @@ from PyQt5.QtWebEngineCore import QWebEngineUrlRequestInterceptor
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtNetwork import QNetworkAccessManager
 
+try:
+    from PyQt5 import sip
+except ImportError:
+    import sip
+
 from . import require
 from . import version
-from .adblock import Adblocker, AdblockUpdateRunner, adblock_urls_rules
+from .adblock import Adblocker, AdblockUpdateRunner, AdBlockStage, \
+    AdBlockStats, Interceptor, adblock_urls_rules, \
+    adblock_verdict_cache_size, adblock_native_interceptor, \
+    create_filter_pipeline, uses_python_filters
 from .download_manager import DownloadManager
 from .profile import named_profile
 from .minibuffer.right_label import init_minibuffer_right_labels
@@ -34,6 +42,8 @@ from .keyboardhandler import LOCAL_KEYMAP_SETTER
 from .spell_checking import SpellCheckingUpdateRunner, \
     spell_checking_dictionaries
 from .runnable import run
+from .visited_links import VisitedLinksCompactRunner, visited_links_max_age, \
+    visited_links_max_rows
 from .scheme_handlers import register_schemes
 
 
@@ -49,34 +59,113 @@ THIS_DIR = os.path.dirname(os.path.realpath(__file__))
 
 
 class UrlInterceptor(QWebEngineUrlRequestInterceptor):
-    def __init__(self, app):
+    def __init__(self, adblock):
         QWebEngineUrlRequestInterceptor.__init__(self)
-        if not adblock_urls_rules.value:
-            # no adblock rules, just don't create any ad-blocker
-            self._adblock = None
-        else:
-            # else create an initial ad-blocker with the current cache
-            # it might be updated later on if the cache is not up to date
-            self._adblock = Adblocker(app.adblock_path()).local_adblock()
         self._use_adblock = True
+        self._adblock_stage = AdBlockStage(adblock,
+                                           adblock_verdict_cache_size.value)
+        self._pipeline = create_filter_pipeline(self._adblock_stage)
+        self._stats = AdBlockStats()
+
+    def request_interceptor(self):
+        return self
 
     @Slot(object)
     def update_adblock(self, adblock):
-        self._adblock = adblock
+        self._adblock_stage.update_adblock(adblock)
 
     def toggle_use_adblock(self):
         self._use_adblock = not self._use_adblock
+        self._adblock_stage.verdicts.clear()
+
+    def verdict_cache_stats(self):
+        return self._adblock_stage.verdicts.stats()
+
+    def stages_stats(self):
+        return self._pipeline.stats()
+
+    def adblock_stats(self):
+        stats = self._stats.snapshot()
+        stats.update(
+            enabled=self._use_adblock,
+            native=False,
+            requests=self._pipeline.stages[0].calls,
+            stages=self.stages_stats(),
+            verdict_cache=self.verdict_cache_stats(),
+            engines=self._adblock_stage.adblock.infos()
+            if self._adblock_stage.adblock else [],
+        )
+        return stats
 
     def interceptRequest(self, request):
-        url = request.requestUrl()
-        url_s = url.toString()
-        if (self._use_adblock
-            and self._adblock
-            and self._adblock.matches(
-                url_s,
-                request.firstPartyUrl().toString())):
-            logging.info("filtered: %s", url_s)
+        # this is called from the network IO thread.
+        if not self._use_adblock:
+            return
+
+        first_party = request.firstPartyUrl()
+        blocked_by = self._pipeline.blocks(request.requestUrl(), first_party)
+        if blocked_by:
             request.block(True)
+            self._stats.record(first_party.host(), blocked_by,
+                               int(request.resourceType()))
+
+
+class NativeUrlInterceptor(object):
+    """
+    Url interceptor matching the requests in the C++ extension.
+
+    Requests are never seen by python, so the network IO thread does not
+    have to wait for the GIL.
+    """
+
+    def __init__(self, adblock):
+        self._interceptor = Interceptor()
+        # the C++ object is owned by self._interceptor
+        self._q_interceptor = sip.wrapinstance(
+            self._interceptor.address(), QWebEngineUrlRequestInterceptor)
+        self._adblock = None
+        if adblock:
+            self.update_adblock(adblock)
+
+    def request_interceptor(self):
+        return self._q_interceptor
+
+    def update_adblock(self, adblock):
+        self._adblock = adblock
+        self._interceptor.set_engines(adblock.adblocks(), adblock.names(),
+                                      adblock.exceptions)
+
+    def toggle_use_adblock(self):
+        self._interceptor.set_enabled(not self._interceptor.enabled())
+
+    def stats(self):
+        return self._interceptor.stats()
+
+    def adblock_stats(self):
+        stats = self.stats()
+        stats.update(
+            enabled=self._interceptor.enabled(),
+            native=True,
+            stages=[],
+            verdict_cache=None,
+            engines=self._adblock.infos() if self._adblock else [],
+        )
+        return stats
+
+
+def create_url_interceptor(app):
+    if not adblock_urls_rules.value:
+        # no adblock rules, just don't create any ad-blocker
+        adblock = None
+    else:
+        # else create an initial ad-blocker with the current cache
+        # it might be updated later on if the cache is not up to date
+        adblock = Adblocker(app.adblock_path()).local_adblock()
+
+    if (adblock_native_interceptor.value and Interceptor is not None
+            and not uses_python_filters()):
+        return NativeUrlInterceptor(adblock)
+    return UrlInterceptor(adblock)
 
 
 class WithoutAppEventFilter(object):
@@ -143,7 +232,7 @@ class Application(QApplication):
         if not os.path.isdir(self.profiles_path()):
             os.makedirs(self.profiles_path())
 
-        self._interceptor = UrlInterceptor(self)
+        self._interceptor = create_url_interceptor(self)
 
         self._download_manager = DownloadManager(self)
 
@@ -217,6 +306,23 @@ class Application(QApplication):
                                      on_finished=adblock_thread_finished)
         run(runner)
 
+    def compact_visitedlinks(self):
+        # the history is only pruned, then vacuumed, if a limit is set
+        if visited_links_max_age.value <= 0 \
+           and visited_links_max_rows.value <= 0:
+            return
+
+        def compact_finished(error, removed):
+            if not error:
+                logging.info("%d visited links removed, history stats: %s",
+                             removed, self.visitedlinks().stats())
+
+        runner = VisitedLinksCompactRunner(self.visitedlinks().path,
+                                           visited_links_max_age.value,
+                                           visited_links_max_rows.value,
+                                           on_finished=compact_finished)
+        run(runner)
+
     def update_spell_checking(self):
         if not bool(spell_checking_dictionaries.value):
             return
@@ -233,5 +339,6 @@ class Application(QApplication):
 
     def post_init(self):
         self.adblock_update()
+        self.compact_visitedlinks()
         self.update_spell_checking()
         init_minibuffer_right_labels()
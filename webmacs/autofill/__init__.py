@@ -20,6 +20,11 @@ from PyQt5.QtWebEngineWidgets import QWebEngineScript
 
 from collections import namedtuple
 
+try:
+    from PyQt5 import sip
+except ImportError:
+    import sip
+
 from .db import PasswordEntry
 from .. import current_minibuffer
 from .prompt import SavePasswordPrompt
@@ -54,12 +59,13 @@ class Autofill(QObject):
         self._db = db
 
     def maybe_save_form_password(self, buffer, formdata):
-        passwords = self.form_passwords_for_url(
-            buffer.url()
-        )
-        if not passwords:
-            prompt = SavePasswordPrompt(self, buffer, formdata)
-            current_minibuffer().do_prompt(prompt, sync=False, flash=True)
+        def got_passwords(error, passwords):
+            if not error and not passwords and not sip.isdeleted(buffer):
+                prompt = SavePasswordPrompt(self, buffer, formdata)
+                current_minibuffer().do_prompt(prompt, sync=False,
+                                               flash=True)
+
+        self.form_passwords_for_url_async(buffer.url()).then(got_passwords)
 
     def add_form_entry(self, url, formdata):
         host = create_host(url)
@@ -79,16 +85,25 @@ class Autofill(QObject):
     def form_passwords_for_url(self, url):
         return self._db.get_form_entries(create_host(url))
 
+    def form_passwords_for_url_async(self, url):
+        return self._db.get_form_entries_async(create_host(url))
+
     def auth_passwords_for_url(self, url):
         return self._db.get_auth_entries(create_host(url))
 
+    def auth_passwords_for_url_async(self, url):
+        return self._db.get_auth_entries_async(create_host(url))
+
     def complete_buffer(self, buffer, url):
         host = create_host(url)
         logging.info("checking autofill for %s", host)
-        passwords = self.form_passwords_for_url(url)
 
-        if passwords:
-            logging.info("autofilling for %s", host)
-            buffer.runJavaScript("complete_form_data('%s')"
-                                 % passwords[0].data.replace("'", "\\'"),
-                                 QWebEngineScript.ApplicationWorld)
+        def got_passwords(error, passwords):
+            if passwords and not sip.isdeleted(buffer):
+                logging.info("autofilling for %s", host)
+                buffer.runJavaScript(
+                    "complete_form_data('%s')"
+                    % passwords[0].data.replace("'", "\\'"),
+                    QWebEngineScript.ApplicationWorld)
+
+        self.form_passwords_for_url_async(url).then(got_passwords)
@@ -13,9 +13,23 @@
 # You should have received a copy of the GNU General Public License
 # along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
 
-import sqlite3
 from datetime import datetime
 
+from ..storage import execute_write, sql_migration
+
+
+MIGRATIONS = [
+    sql_migration("""
+    CREATE TABLE IF NOT EXISTS autofill
+    (id INTEGER PRIMARY KEY AUTOINCREMENT, host TEXT,
+     username TEXT, password TEXT,  data TEXT, updated DATE)
+    """),
+    # the credentials of a site are looked up on every navigation
+    sql_migration("""
+    CREATE INDEX IF NOT EXISTS autofill_host ON autofill (host)
+    """),
+]
+
 
 class PasswordEntry(object):
     __slots__ = ("id", "host", "username", "password", "data", "updated")
@@ -30,33 +44,49 @@ class PasswordEntry(object):
         self.updated = updated
 
 
+def _get_entries(conn, host, where):
+    return [
+        PasswordEntry(*row)
+        for row in conn.execute("""
+    SELECT id, host, username, password, data, updated FROM autofill
+    WHERE host=? %s ORDER BY updated DESC
+    """ % where, (host,))
+    ]
+
+
+FORM_ENTRIES = "AND data IS NOT NULL"
+AUTH_ENTRIES = "AND data IS NULL"
+
+
 class PasswordDb(object):
-    def __init__(self, dbpath):
-        self._conn = sqlite3.connect(dbpath)
-        self._conn.execute("""
-        CREATE TABLE IF NOT EXISTS autofill
-        (id INTEGER PRIMARY KEY AUTOINCREMENT, host TEXT,
-         username TEXT, password TEXT,  data TEXT, updated DATE)
-        """)
+    def __init__(self, storage):
+        self._storage = storage
+
+    def _connection(self):
+        # opened on first use rather than on startup
+        return self._storage.connection("autofill.db", MIGRATIONS)
+
+    def _write(self, query, args):
+        # retried later if another instance is writing
+        self._storage.write("autofill.db", execute_write, query, args,
+                            migrations=MIGRATIONS)
 
     def add_entry(self, pe):
-        self._conn.execute("""
+        self._write("""
         INSERT INTO autofill (host, username, password, data, updated)
         VALUES (?, ?, ?, ?, ?)
         """, (pe.host, pe.username, pe.password, pe.data, datetime.now()))
-        self._conn.commit()
-
-    def _get_entries(self, host, where):
-        return [
-            PasswordEntry(*row)
-            for row in self._conn.execute("""
-        SELECT id, host, username, password, data, updated FROM autofill
-        WHERE host=? %s ORDER BY updated DESC
-        """ % where, (host,))
-        ]
 
     def get_form_entries(self, host):
-        return self._get_entries(host, where="AND data IS NOT NULL")
+        return _get_entries(self._connection(), host, FORM_ENTRIES)
+
+    def get_form_entries_async(self, host):
+        return self._storage.submit("autofill.db", _get_entries, host,
+                                    FORM_ENTRIES, migrations=MIGRATIONS)
 
     def get_auth_entries(self, host):
-        return self._get_entries(host, where="AND data IS NULL")
+        return _get_entries(self._connection(), host, AUTH_ENTRIES)
+
+    def get_auth_entries_async(self, host):
+        return self._storage.submit("autofill.db", _get_entries, host,
+                                    AUTH_ENTRIES, migrations=MIGRATIONS)
@@ -13,31 +13,162 @@
 # You should have received a copy of the GNU General Public License
 # along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
 
-import sqlite3
+from .hooks import Hook
+from .prefix_index import PrefixIndex
+from .storage import ChangeWatcher, immediate_transaction, sql_migration
+from .visited_links import like_pattern
+
+
+MIGRATIONS = [
+    sql_migration("""
+    CREATE TABLE IF NOT EXISTS bookmarks
+    (url TEXT PRIMARY KEY, name TEXT);
+    """, """
+    CREATE INDEX IF NOT EXISTS bookmarks_name ON bookmarks (name);
+    """),
+]
+
+
+def insert_bookmarks(conn, bookmarks):
+    """
+    Add the given (url, name) bookmarks, keeping the name of the urls
+    already bookmarked.
+    """
+    conn.executemany("""
+    INSERT OR IGNORE INTO bookmarks (url, name) VALUES (?, ?)
+    """, bookmarks)
+
+
+def _named_url(conn, name):
+    row = conn.execute(
+        "SELECT url FROM bookmarks WHERE name = ?"
+        " ORDER BY rowid DESC LIMIT 1", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def write_bookmark(conn, url, name):
+    """
+    Set the name of the bookmark of url, or remove it if name is None.
+    Returns the new url of the names which bookmark may have changed.
+    """
+    with immediate_transaction(conn):
+        names = {name}
+        row = conn.execute(
+            "SELECT name FROM bookmarks WHERE url = ?", (url,)
+        ).fetchone()
+        if row:
+            names.add(row[0])
+        if name is None:
+            conn.execute("""
+            DELETE from bookmarks WHERE url = ?
+            """, (url,))
+        else:
+            conn.execute("""
+            INSERT OR REPLACE INTO bookmarks (url, name)
+            VALUES (?, ?)
+            """, (url, name))
+        return {n: _named_url(conn, n) for n in names if n is not None}
 
 
 class Bookmarks(object):
-    def __init__(self, dbbath):
-        self._conn = sqlite3.connect(dbbath)
-        self._conn.execute("""
-        CREATE TABLE IF NOT EXISTS bookmarks
-        (url TEXT PRIMARY KEY, name TEXT);
-        """)
+    """
+    The bookmarks, possibly shared with other webmacs instances.
+
+    The bookmarks are indexed by name in memory, to resolve a name or a
+    name prefix without querying the database. When several bookmarks have
+    the same name, the most recently set is indexed.
+
+    The changed hook is called when the bookmarks are modified, by this
+    instance or by another one.
+    """
+
+    def __init__(self, storage):
+        self.path = storage.db_path("bookmarks.db")
+        self._storage = storage
+        self._conn = storage.connection("bookmarks.db", MIGRATIONS)
+        self._list = None
+        self._index = None
+        self.changed = Hook()
+        self._watcher = ChangeWatcher(self._conn)
+        self._watcher.changed.add(self._on_other_instance_change)
+
+    def _on_other_instance_change(self):
+        self._list = None
+        self._index = None
+        self.changed()
+
+    def check_changes(self):
+        """
+        Call the changed hook now if another connection wrote to the
+        database.
+        """
+        return self._watcher.check()
+
+    def _update(self, url, name):
+        # retried later if another instance is writing
+        self._storage.write("bookmarks.db", write_bookmark, url, name,
+                            callback=self._updated)
+
+    def _updated(self, urls):
+        self._list = None
+        if self._index is not None:
+            for name, url in urls.items():
+                if url is not None:
+                    self._index[name] = url
+                elif name in self._index:
+                    del self._index[name]
+        self.changed()
 
     def set(self, url, name):
-        self._conn.execute("""
-        INSERT OR REPLACE INTO bookmarks (url, name)
-        VALUES (?, ?)
-        """, (url, name))
-        self._conn.commit()
+        self._update(url, name)
+
+    def remove(self, url):
+        self._update(url, None)
 
     def list(self):
-        return [r for r in self._conn.execute(
-            "select url, name from bookmarks order by name"
-        )]
+        if self._list is None:
+            self._list = [r for r in self._conn.execute(
+                "select url, name from bookmarks order by name"
+            )]
+        return self._list
 
-    def remove(self, url):
-        self._conn.execute("""
-        DELETE from bookmarks WHERE url = ?
-        """, (url,))
-        self._conn.commit()
+    def index(self):
+        """
+        Returns the PrefixIndex of the bookmark urls by name.
+        """
+        if self._index is None:
+            # the most recently set bookmarks come last and win
+            self._index = PrefixIndex(self._conn.execute(
+                "SELECT name, url FROM bookmarks WHERE name IS NOT NULL"
+                " ORDER BY rowid"))
+        return self._index
+
+    def urls_starting_with(self, prefix):
+        """
+        Returns a cursor on the (url, name) of the bookmarks which url
+        starts with prefix, walking the index of the urls.
+        """
+        if not prefix:
+            return self._conn.execute("SELECT url, name FROM bookmarks"
+                                      " ORDER BY url")
+        end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return self._conn.execute(
+            "SELECT url, name FROM bookmarks WHERE url >= ? AND url < ?"
+            " ORDER BY url", (prefix, end))
+
+    def search(self, text, limit=-1, offset=0):
+        """
+        Returns a cursor on the (url, name) of the bookmarks containing every
+        word of text in their url or name, at most limit of them after the
+        offset first ones. A negative limit returns them all.
+        """
+        words = text.split()
+        where = " AND ".join(
+            "(url LIKE ? ESCAPE '\\' OR name LIKE ? ESCAPE '\\')"
+            for _ in words) or "1"
+        args = []
+        for word in words:
+            args.extend((like_pattern(word),) * 2)
+        return self._conn.execute(
+            "SELECT url, name FROM bookmarks WHERE " + where
+            + " ORDER BY name LIMIT ? OFFSET ?", args + [limit, offset])
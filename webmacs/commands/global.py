@@ -15,14 +15,20 @@
 
 import itertools
 import os
-from PyQt5.QtCore import QStringListModel, QModelIndex
+from PyQt5.QtCore import QStringListModel
 
 from . import define_command, COMMANDS, register_prompt_opener_commands
 from ..minibuffer import Prompt
-from ..minibuffer.prompt import PromptTableModel, PromptHistory
+from ..minibuffer.prompt import PromptTableModel, PagedTableModel, \
+    PromptHistory, FSModel
 from ..application import app
+from ..bookmarks import insert_bookmarks
+from ..importer import ImportRunner, read_bookmarks, read_history
+from ..runnable import run
+from ..visited_links import has_fts_index, insert_links
 from ..webbuffer import create_buffer
-from ..keymaps import KeyPress, VISITEDLINKS_KEYMAP, BOOKMARKS_KEYMAP, KEYMAPS
+from ..keymaps import KeyPress, VISITEDLINKS_KEYMAP, BOOKMARKS_KEYMAP, \
+    KEYMAPS, GLOBAL_KEYMAP
 from ..keyboardhandler import send_key_event, local_keymap, KEY_EATER, \
     CallHandler
 from .. import BUFFERS, windows, variables
@@ -37,14 +43,21 @@ class CommandsListPrompt(Prompt):
     complete_options = {
         "match": Prompt.FuzzyMatch,
         "complete-empty": True,
+        # the bindings are not matched
+        "match-columns": 1,
     }
     history = PromptHistory()
 
     def completer_model(self):
-        model = QStringListModel(self)
-        model.setStringList(sorted(k for k, v in COMMANDS.items()
-                                   if v.visible))
-        return model
+        # annotate the commands with their bindings in the current buffer
+        keymaps = [GLOBAL_KEYMAP]
+        if self.ctx.buffer:
+            keymaps.insert(0, self.ctx.buffer.active_keymap())
+        return PromptTableModel([
+            (name, ", ".join(chord for km in keymaps
+                             for chord in km.bindings_for(name)))
+            for name in sorted(k for k, v in COMMANDS.items() if v.visible)
+        ], self)
 
 
 @define_command("quit")
@@ -237,23 +250,25 @@ def toggle_toolbar(ctx):
     ctx.window.toggle_toolbar()
 
 
-class VisitedLinksModel(PromptTableModel):
+class VisitedLinksModel(PagedTableModel):
+    """
+    The visited links matching the text of the minibuffer input, searched
+    in the history database.
+    """
 
     def __init__(self, parent):
-        visitedlinks = app().visitedlinks()
-        PromptTableModel.__init__(self, visitedlinks.visited_urls())
-        self.visitedlinks = visitedlinks
+        self.visitedlinks = app().visitedlinks()
+        PagedTableModel.__init__(self, self.visitedlinks.search)
 
     def remove_history_entry(self, index):
-        self.beginRemoveRows(QModelIndex(), index.row(), index.row())
-        self.visitedlinks.remove(self._data.pop(index.row())[0])
-        self.endRemoveRows()
+        self.visitedlinks.remove(self.remove_row(index.row())[0])
 
 
 class VisitedLinksPrompt(Prompt):
     label = "Find url from visited links:"
     complete_options = {
-        "match": Prompt.FuzzyMatch,
+        # the model already contains the matching links only
+        "match": None,
         "complete-empty": True,
     }
     keymap = VISITEDLINKS_KEYMAP
@@ -289,7 +304,7 @@ class BookmarksModel(VisitedLinksModel):
 
     def __init__(self, parent):
         bookmarks = app().bookmarks()
-        PromptTableModel.__init__(self, bookmarks.list())
+        PagedTableModel.__init__(self, bookmarks.search)
         # this makes the remove_history_entry method works
         self.visitedlinks = bookmarks
 
@@ -359,6 +374,71 @@ def bookmark_add(ctx):
         ctx.minibuffer.show_info("Bookmark {} created.".format(name))
 
 
+class ImportFilePrompt(Prompt):
+    complete_options = {
+        "autocomplete": True
+    }
+
+    def __init__(self, ctx, label):
+        Prompt.__init__(self, ctx)
+        self.label = label
+
+    def completer_model(self):
+        return FSModel(self)
+
+
+def _import(ctx, what, db, read, insert):
+    prompt = ImportFilePrompt(ctx, "Import {} from:".format(what))
+    path = ctx.minibuffer.do_prompt(prompt)
+    if not path:
+        return
+    path = os.path.expanduser(path)
+    if not os.path.isfile(path):
+        ctx.minibuffer.show_info("No such file: {}".format(path))
+        return
+
+    minibuffer = ctx.minibuffer
+
+    def import_finished(error, count):
+        db.check_changes()
+        if error:
+            minibuffer.show_info("Unable to import the {} of {}, see the"
+                                 " logs.".format(what, path))
+        else:
+            minibuffer.show_info("{} {} imported.".format(count, what))
+
+    runner = ImportRunner(db.path, read(path), insert,
+                          on_finished=import_finished)
+    runner.progress.connect(lambda count: minibuffer.show_info(
+        "Importing the {}... {}".format(what, count)))
+    run(runner)
+
+
+@define_command("import-bookmarks")
+def import_bookmarks(ctx):
+    """
+    Import the bookmarks of another browser.
+
+    The file can be a bookmark HTML export, a Firefox places.sqlite or a
+    Chrome Bookmarks file. The urls already bookmarked keep their name.
+    """
+    _import(ctx, "bookmarks", app().bookmarks(), read_bookmarks,
+            insert_bookmarks)
+
+
+@define_command("import-history")
+def import_history(ctx):
+    """
+    Import the visited links of another browser.
+
+    The file can be a Firefox places.sqlite or a Chrome History database.
+    """
+    def insert(conn, links):
+        insert_links(conn, links, has_fts_index(conn))
+
+    _import(ctx, "visited links", app().visitedlinks(), read_history, insert)
+
+
 class ModesPrompt(Prompt):
     label = "switch to mode:"
     complete_options = {
@@ -594,7 +674,7 @@ def where_is(ctx):
         return
     bindings_str = ", ".join("{} (keymap: {})".format(k, kmapname)
                              for kmapname, kmap in KEYMAPS.items()
-                             for k, v in kmap.all_bindings() if v == command)
+                             for k in kmap.bindings_for(command))
     if bindings_str:
         ctx.minibuffer.show_info("{} is on: {}".format(command, bindings_str))
     else:
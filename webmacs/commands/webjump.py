@@ -18,7 +18,7 @@ import logging
 from collections import namedtuple
 
 from PyQt5.QtCore import QUrl, pyqtSlot as Slot, \
-    pyqtSignal as Signal, QStringListModel, QObject, QEvent, Qt
+    pyqtSignal as Signal, QStringListModel, QObject, QEvent, Qt, QModelIndex
 from PyQt5.QtNetwork import QNetworkRequest
 
 from ..commands import define_command
@@ -29,11 +29,14 @@ from .. import current_buffer
 from ..application import app
 from .. import variables
 from .. import version
+from ..prefix_index import PrefixIndex
 
 
 WebJump = namedtuple(
     "WebJump", ("name", "url", "doc", "allow_args", "complete_fn", "protocol"))
 WEBJUMPS = {}
+# the webjump names, to resolve a prefix
+WEBJUMP_NAMES = PrefixIndex()
 
 
 webjump_default = variables.define_variable(
@@ -64,8 +67,9 @@ def define_webjump(name, url, doc="", complete_fn=None, protocol=False):
 
     """
     allow_args = "%s" in url
-    WEBJUMPS[name.strip()] = WebJump(
-        name.strip(), url,
+    name = name.strip()
+    WEBJUMPS[name] = WEBJUMP_NAMES[name] = WebJump(
+        name, url,
         doc,
         allow_args,
         complete_fn or empty_completer,
@@ -208,6 +212,39 @@ class WebJumpRequestCompleter(WebJumpCompleter):
         self.reply = None
 
 
+class WebJumpModel(PromptTableModel):
+    """
+    The webjumps and bookmarks which name starts with the text of the
+    minibuffer input, and the bookmarks which url starts with it. They are
+    found in the prefix indexes, instead of listing every one.
+    """
+
+    def __init__(self, parent=None):
+        PromptTableModel.__init__(self, [], parent)
+        self._text = None
+
+    def columnCount(self, index=QModelIndex()):
+        return 2
+
+    def text_changed(self, text):
+        if text == self._text:
+            return
+        self._text = text
+        data = [(name, WEBJUMPS[name].doc)
+                for name in WEBJUMP_NAMES.starting_with(text)]
+        bookmarks = app().bookmarks()
+        index = bookmarks.index()
+        data.extend((name, index[name]) for name in index.starting_with(text))
+        if text:
+            seen = set(data)
+            data.extend((name, url)
+                        for url, name in bookmarks.urls_starting_with(text)
+                        if (name, url) not in seen)
+        self.beginResetModel()
+        self._data = data
+        self.endResetModel()
+
+
 @define_command("webjump-complete")
 def wb_complete(ctx):
     """
@@ -231,17 +268,9 @@ class WebJumpPrompt(Prompt):
     default_input = "alternate"
 
     def completer_model(self):
-        data = []
-        for name, w in WEBJUMPS.items():
-            data.append((name, w.doc))
-
-        for url, name in self.bookmarks:
-            data.append((name, url))
-
-        return PromptTableModel(data)
+        return WebJumpModel(self)
 
     def enable(self, minibuffer):
-        self.bookmarks = app().bookmarks().list()
         Prompt.enable(self, minibuffer)
         minibuffer.input().textEdited.connect(self._text_edited)
         minibuffer.input().installEventFilter(self)
@@ -318,7 +347,7 @@ class WebJumpPrompt(Prompt):
     def _text_edited(self, text):
         # search for a matching webjump
         first_word = text.split(" ")[0].split("://")[0]
-        if first_word in [w for w in WEBJUMPS if len(w) < len(text)]:
+        if first_word in WEBJUMPS and len(first_word) < len(text):
             self._set_active_webjump(WEBJUMPS[first_word])
             self.start_completion(self._active_webjump)
         else:
@@ -383,15 +412,13 @@ class WebJumpPrompt(Prompt):
         command = args[0]
 
         # Look for webjumps
-        webjump = None
-        if command in WEBJUMPS:
-            webjump = WEBJUMPS[command]
-        else:
+        webjump = WEBJUMPS.get(command)
+        if webjump is None:
             # Look for a incomplete webjump, accepting a candidate
             # if there is a single option
-            candidates = [wj for wj in WEBJUMPS if wj.startswith(command)]
-            if len(candidates) == 1:
-                webjump = WEBJUMPS[candidates[0]]
+            name = WEBJUMP_NAMES.unique_key(command)
+            if name is not None:
+                webjump = WEBJUMPS[name]
 
         if webjump:
             if not webjump.allow_args:
@@ -412,16 +439,15 @@ class WebJumpPrompt(Prompt):
                     )
 
         # Look for a bookmark
-        bookmarks = {name: url
-                     for url, name in self.bookmarks}
+        bookmarks = app().bookmarks().index()
         if value in bookmarks:
             return bookmarks[value]
 
         # Look for a incomplete bookmarks, accepting a candidate
         # if there is a single option
-        candidates = [bm for bm in bookmarks if bm.startswith(command)]
-        if len(candidates) == 1:
-            return bookmarks[candidates[0]]
+        name = bookmarks.unique_key(command)
+        if name is not None:
+            return bookmarks[name]
 
         # No webjump, no bookmark, look for a url
         if "://" not in value:
@@ -13,34 +13,55 @@
 # You should have received a copy of the GNU General Public License
 # along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
 
-import sqlite3
 from PyQt5.QtWebEngineWidgets import QWebEnginePage
 
+from .storage import execute_write, sql_migration
+
+
+MIGRATIONS = [
+    sql_migration("""
+    CREATE TABLE IF NOT EXISTS features
+    (url TEXT,
+    feature NUMBER,
+    permission NUMBER,
+    PRIMARY KEY(url, feature));
+    """),
+]
+
+
+def _get_permission(conn, url, feature):
+    permission = conn.execute(
+        "SELECT permission FROM features WHERE url = ? AND feature = ?",
+        (url, feature)).fetchone()
+
+    if permission:
+        return permission[0]
+    else:
+        return QWebEnginePage.PermissionUnknown
+
 
 class Features(object):
-    def __init__(self, db_path):
-        self._conn = sqlite3.connect(db_path)
-        self._conn.execute("""
-        CREATE TABLE IF NOT EXISTS features
-        (url TEXT,
-        feature NUMBER,
-        permission NUMBER,
-        PRIMARY KEY(url, feature));
-        """)
+    def __init__(self, storage):
+        self._storage = storage
+
+    def _connection(self):
+        # opened on first use, few sites request a feature
+        return self._storage.connection("features.db", MIGRATIONS)
+
+    def _write(self, query, args):
+        # retried later if another instance is writing
+        self._storage.write("features.db", execute_write, query, args,
+                            migrations=MIGRATIONS)
 
     def set_permission(self, url, feature, permission):
-        self._conn.execute("""
+        self._write("""
         INSERT OR REPLACE INTO features (url, feature, permission)
         VALUES (?, ?, ?)
         """, (url, feature, permission))
-        self._conn.commit()
 
     def get_permission(self, url, feature):
-        permission = self._conn.execute(
-            "SELECT permission FROM features WHERE url = ? AND feature = ?",
-            (url, feature)).fetchone()
-
-        if permission:
-            return permission[0]
-        else:
-            return QWebEnginePage.PermissionUnknown
+        return _get_permission(self._connection(), url, feature)
+
+    def get_permission_async(self, url, feature):
+        return self._storage.submit("features.db", _get_permission, url,
+                                    feature, migrations=MIGRATIONS)
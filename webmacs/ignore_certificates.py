@@ -13,30 +13,57 @@
 # You should have received a copy of the GNU General Public License
 # along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
 
-import sqlite3
+from .storage import execute_write, sql_migration
+
+
+MIGRATIONS = [
+    sql_migration("""
+    CREATE TABLE IF NOT EXISTS ignorecerts
+    (url TEXT PRIMARY KEY);
+    """),
+]
+
+
+def certificate_key(url):
+    """
+    The key of the certificates of the QUrl url in the database.
+    """
+    return "{}:{}".format(url.host(), url.port(80))
+
+
+def _is_ignored(conn, url):
+    return conn.execute("""
+    SELECT url from ignorecerts WHERE url = ?
+    """, (url,)).fetchone() is not None
 
 
 class IgnoredCertificates(object):
-    def __init__(self, dbbath):
-        self._conn = sqlite3.connect(dbbath)
-        self._conn.execute("""
-        CREATE TABLE IF NOT EXISTS ignorecerts
-        (url TEXT PRIMARY KEY);
-        """)
+    def __init__(self, storage):
+        self._storage = storage
+
+    def _connection(self):
+        # opened on the first navigation rather than on startup
+        return self._storage.connection("ignoredcerts.db", MIGRATIONS)
+
+    def _write(self, query, args):
+        # retried later if another instance is writing
+        self._storage.write("ignoredcerts.db", execute_write, query, args,
+                            migrations=MIGRATIONS)
 
     def is_ignored(self, url):
-        return self._conn.execute("""
-        SELECT url from ignorecerts WHERE url = ?
-        """, (url,)).fetchone() is not None
+        return _is_ignored(self._connection(), url)
+
+    def is_ignored_async(self, url):
+        return self._storage.submit("ignoredcerts.db", _is_ignored, url,
+                                    migrations=MIGRATIONS)
 
     def ignore(self, url):
-        self._conn.execute("""
+        self._write("""
         INSERT OR REPLACE INTO ignorecerts (url)
         VALUES (?)
         """, (url,))
-        self._conn.commit()
 
     def remove(self, url):
-        self._conn.execute("""
+        self._write("""
         DELETE from ignorecerts WHERE url = ?
         """, (url,))
@@ -0,0 +1,210 @@
+# This file is part of webmacs.
+#
+# webmacs is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# webmacs is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Import the history and the bookmarks of other browsers.
+
+The readers are generators, the sources are never loaded in memory at
+once, and ImportRunner writes what they yield in batches.
+"""
+
+import os
+import json
+import shutil
+import sqlite3
+import tempfile
+import itertools
+from datetime import datetime
+from html.parser import HTMLParser
+from contextlib import contextmanager
+
+from PyQt5.QtCore import pyqtSignal as Signal
+
+from .runnable import Runner
+from .storage import THREAD_BUSY_TIMEOUT, connect, immediate_transaction
+
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+# microseconds between the Chrome epoch (1601-01-01) and the unix one
+CHROME_EPOCH_OFFSET = 11644473600 * 1000000
+
+
+@contextmanager
+def sqlite_copy(path):
+    """
+    Open a copy of the sqlite database at path, which may be locked by the
+    browser using it.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        copy = os.path.join(tmp_dir, "copy.sqlite")
+        for suffix in ("", "-wal"):
+            if os.path.isfile(path + suffix):
+                shutil.copyfile(path + suffix, copy + suffix)
+        conn = sqlite3.connect(copy)
+        try:
+            yield conn
+        finally:
+            conn.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def read_history(path):
+    """
+    Iterate over the (url, title, lastseen, visits) of a Firefox
+    places.sqlite or Chrome History database.
+    """
+    with sqlite_copy(path) as conn:
+        tables = {row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if "moz_places" in tables:
+            query = """
+            SELECT url, title, last_visit_date, visit_count FROM moz_places
+            WHERE last_visit_date IS NOT NULL
+            """
+            offset = 0
+        elif "urls" in tables:
+            query = """
+            SELECT url, title, last_visit_time, visit_count FROM urls
+            WHERE last_visit_time > 0
+            """
+            offset = CHROME_EPOCH_OFFSET
+        else:
+            raise ValueError("{} is not a Firefox or Chrome history"
+                             .format(path))
+
+        for url, title, last_visit, visits in conn.execute(query):
+            # both store microseconds in UTC, visits are stored local
+            lastseen = datetime.fromtimestamp((last_visit - offset) / 1e6)
+            yield url, title or "", lastseen, max(visits, 1)
+
+
+class NetscapeBookmarksParser(HTMLParser):
+    """
+    Parse the Netscape bookmark file format, which all browsers export.
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.bookmarks = []
+        self._href = None
+        self._name = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            self._href = dict(attrs).get("href")
+            self._name = []
+
+    def handle_data(self, data):
+        if self._href is not None:
+            self._name.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self._href is not None:
+            # place: urls are Firefox queries, like the recent bookmarks
+            if not self._href.startswith("place:"):
+                name = "".join(self._name).strip()
+                self.bookmarks.append((self._href, name or self._href))
+            self._href = None
+
+
+def read_netscape_bookmarks(path, chunk_size=65536):
+    parser = NetscapeBookmarksParser()
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for chunk in iter(lambda: f.read(chunk_size), ""):
+            parser.feed(chunk)
+            yield from parser.bookmarks
+            del parser.bookmarks[:]
+    parser.close()
+    yield from parser.bookmarks
+
+
+def read_chrome_bookmarks(path):
+    with open(path, encoding="utf-8") as f:
+        roots = json.load(f)["roots"]
+
+    def walk(node):
+        if node.get("type") == "url":
+            yield node["url"], node.get("name") or node["url"]
+        for child in node.get("children", ()):
+            yield from walk(child)
+
+    for root in roots.values():
+        # there are other values than folders, like a version
+        if isinstance(root, dict):
+            yield from walk(root)
+
+
+def read_firefox_bookmarks(path):
+    with sqlite_copy(path) as conn:
+        for url, name in conn.execute("""
+        SELECT p.url, b.title FROM moz_bookmarks b
+        JOIN moz_places p ON p.id = b.fk
+        WHERE b.type = 1 AND p.url NOT LIKE 'place:%'
+        """):
+            yield url, name or url
+
+
+def read_bookmarks(path):
+    """
+    Iterate over the (url, name) of a Netscape bookmark HTML file, a
+    Firefox places.sqlite database or a Chrome Bookmarks file.
+    """
+    with open(path, "rb") as f:
+        header = f.read(len(SQLITE_HEADER))
+    if header == SQLITE_HEADER:
+        return read_firefox_bookmarks(path)
+    elif header.lstrip().startswith(b"{"):
+        return read_chrome_bookmarks(path)
+    return read_netscape_bookmarks(path)
+
+
+class ImportRunner(Runner):
+    """
+    Write the rows read from another browser to a webmacs database.
+
+    The rows are inserted by batches of batch_size, each one in a
+    transaction, with insert(conn, rows). progress is emitted with the
+    number of rows written after each batch, and the total is the result.
+    """
+
+    description = "import"
+    batch_size = 20000
+    progress = Signal(int)
+
+    def __init__(self, dbpath, rows, insert, **kwargs):
+        Runner.__init__(self, **kwargs)
+        self.dbpath = dbpath
+        self.rows = rows
+        self.insert = insert
+
+    def run_in_thread(self):
+        conn = connect(self.dbpath, timeout=THREAD_BUSY_TIMEOUT,
+                       isolation_level=None)
+        try:
+            count = 0
+            rows = iter(self.rows)
+            while True:
+                batch = list(itertools.islice(rows, self.batch_size))
+                if not batch:
+                    return count
+                with immediate_transaction(conn):
+                    self.insert(conn, batch)
+                count += len(batch)
+                self.progress.emit(count)
+        finally:
+            conn.close()
@@ -0,0 +1,173 @@
+# This file is part of webmacs.
+#
+# webmacs is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# webmacs is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measure the time from a key press to the end of the command it calls, to
+find the commands which make typing stall.
+"""
+
+import math
+import time
+import heapq
+import itertools
+from contextlib import contextmanager
+
+from . import variables
+
+
+# number of buckets per power of two of a LatencyHistogram, which gives
+# percentiles within 19% of the real value.
+BUCKETS_PER_OCTAVE = 4
+
+
+class LatencyHistogram(object):
+    """
+    Count latencies in logarithmic buckets, from one microsecond.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._buckets = {}
+
+    def add(self, latency):
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+        bucket = (int(math.log2(latency * 1e6) * BUCKETS_PER_OCTAVE)
+                  if latency > 1e-6 else 0)
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+
+    def percentile(self, p):
+        """
+        Returns the upper bound of the bucket of the p-th percentile (p in
+        [0, 100]), in seconds.
+        """
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * p / 100) or 1
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                break
+        upper = 2 ** ((bucket + 1) / BUCKETS_PER_OCTAVE) / 1e6
+        return min(upper, self.max)
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+def command_name(command):
+    if isinstance(command, str):
+        return command
+    return "{}:{}".format(command.__module__, command.__name__)
+
+
+class KeyLatencies(object):
+    """
+    The latencies of the commands called by key chords, in a histogram per
+    command, and the slowest calls with their key chord.
+
+    Nothing is measured unless enabled is True.
+    """
+
+    def __init__(self, slowest_size=20):
+        self.enabled = False
+        self.slowest_size = slowest_size
+        # total time spent in waiting(), never reset
+        self.waiting_time = 0.0
+        self.reset()
+
+    @contextmanager
+    def waiting(self):
+        """
+        A context manager for the time spent waiting for the user, in a
+        blocking prompt for example. The commands running it subtract
+        it from their latency.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.waiting_time += time.perf_counter() - start
+
+    def reset(self):
+        self.commands = {}
+        self._slowest = []
+        self._counter = itertools.count()
+
+    def record(self, command, keypresses, latency):
+        name = command_name(command)
+        histogram = self.commands.get(name)
+        if histogram is None:
+            histogram = self.commands[name] = LatencyHistogram()
+        histogram.add(latency)
+
+        if (len(self._slowest) >= self.slowest_size
+                and latency <= self._slowest[0][0]):
+            return
+        # the counter keeps the entries comparable for equal latencies
+        entry = (latency, next(self._counter), name,
+                 " ".join(str(k) for k in keypresses), time.time())
+        if len(self._slowest) < self.slowest_size:
+            heapq.heappush(self._slowest, entry)
+        else:
+            heapq.heapreplace(self._slowest, entry)
+
+    def slowest(self):
+        """
+        Returns the slowest calls, slowest first, as dicts.
+        """
+        return [{"latency": latency, "command": name, "chord": chord,
+                 "time": timestamp}
+                for latency, _, name, chord, timestamp
+                in sorted(self._slowest, reverse=True)]
+
+    def stats(self):
+        """
+        Returns the stats of each command, slowest first by p99.
+        """
+        stats = [dict(histogram.stats(), command=name)
+                 for name, histogram in self.commands.items()]
+        return sorted(stats, key=lambda s: s["p99"], reverse=True)
+
+
+KEY_LATENCIES = KeyLatencies()
+
+
+def _enable_from_var(v):
+    KEY_LATENCIES.enabled = v.value
+
+
+key_latency_stats = variables.define_variable(
+    "key-latency-stats",
+    "If True, the time from a key press to the end of the command it calls"
+    " is measured, without the time spent waiting in prompts. The"
+    " latencies are shown on the webmacs://perf/keys page.",
+    False,
+    type=variables.Bool(),
+    callbacks=(_enable_from_var,)
+)
+
+_enable_from_var(key_latency_stats)
@@ -14,15 +14,17 @@
 # along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+from time import perf_counter
 
 from PyQt5.QtCore import QObject, QEvent
 from PyQt5.QtGui import QWindow
 
-from .keymaps import KeyPress, GLOBAL_KEYMAP, CHAR2KEY
+from .keymaps import KeyPress, GLOBAL_KEYMAP, CHAR2KEY, dispatch_table
 from . import hooks
 from . import COMMANDS, minibuffer_show_info, current_minibuffer, \
     current_window
 from .mode import Mode
+from .key_latency import KEY_LATENCIES
 
 
 class CommandContext(object):
@@ -142,6 +144,10 @@ class KeyEater(object):
         self._keypresses = []
         self._local_key_map = None
         self._use_global_keymap = True
+        # the dispatch table of the active keymaps, and the node of the
+        # current key chord in it
+        self._table = None
+        self._node = None
         self.universal_key = KeyPress.from_str("C-u")
         self._prefix_arg = None
         self._prefix_arg_keys = []
@@ -166,10 +172,11 @@ class KeyEater(object):
         self._use_global_keymap = enable
 
     def event_filter(self, obj, event):
+        event_time = perf_counter() if KEY_LATENCIES.enabled else None
         key = KeyPress.from_qevent(event)
         if key is None:
             return False
-        if self._handle_keypress(obj, key):
+        if self._handle_keypress(obj, key, event_time):
             return True
         return False
 
@@ -181,7 +188,7 @@ class KeyEater(object):
 
     def _add_keypress(self, keypress):
         self._keypresses.append(keypress)
-        logging.debug("keychord: %s" % self._keypresses)
+        logging.debug("keychord: %s", self._keypresses)
 
     def _num_update_prefix_arg(self, numstr):
         if not isinstance(self._prefix_arg, int):
@@ -195,7 +202,11 @@ class KeyEater(object):
             " ".join((str(k) for k in all_presses)) + extra
         )
 
-    def _handle_keypress(self, sender, keypress):
+    def _handle_keypress(self, sender, keypress, event_time=None):
+        """
+        Handle a key press, event_time being the perf_counter() time of its
+        event if the latencies are measured.
+        """
         if keypress == self.universal_key and not self._keypresses:
             if isinstance(self._prefix_arg, tuple):
                 self._prefix_arg = (self._prefix_arg[0] * 4,)
@@ -216,39 +227,54 @@ class KeyEater(object):
                     self._show_info_kbd()
                     return True
 
-        result = None
         self._add_keypress(keypress)
 
-        for keymap in self.active_keymaps():
-            result = keymap.lookup(self._keypresses)
-            if result:
-                break
+        table = dispatch_table(self._local_key_map, self._use_global_keymap)
+        if table is not self._table:
+            # the active keymaps or the bindings changed, possibly during
+            # a key chord
+            self._table = table
+            self._node = table.follow(self._keypresses[:-1])
+        node = self._node
+        result = node.get(keypress) if node is not None else None
 
-        if not result:
+        if result is None:
             if len(self._keypresses) > 1:
                 self._show_info_kbd(" is undefined.")
             else:
                 minibuffer_show_info("")
             self._keypresses = []
-            self.call_handler.no_call(sender, keymap, keypress)
+            self._node = table
+            self.call_handler.no_call(sender, table.keymap, keypress)
             self._prefix_arg = None
             self._prefix_arg_keys = []
             return False
 
         if result.complete:
             self._show_info_kbd()
+            keypresses = self._keypresses
             self._keypresses = []
+            self._node = table
             ctx = CommandContext()
             self._prefix_arg = None
             self._prefix_arg_keys = []
+            # the command may wait for the user in a prompt, which is not
+            # part of its latency. Keys handled in the prompt are measured
+            # on their own.
+            waiting_time = KEY_LATENCIES.waiting_time
             try:
-                self.call_handler.call(ctx, keymap, keypress,
+                self.call_handler.call(ctx, result.keymap, keypress,
                                        result.command)
             except Exception:
                 logging.exception("Error calling command:")
+            if event_time is not None:
+                waited = KEY_LATENCIES.waiting_time - waiting_time
+                KEY_LATENCIES.record(result.command, keypresses,
+                                     perf_counter() - event_time - waited)
         else:
+            self._node = result
             self._show_info_kbd(" -")
-            self.call_handler.partial_call(sender, keymap, keypress)
+            self.call_handler.partial_call(sender, result.keymap, keypress)
 
         return result is not None
 
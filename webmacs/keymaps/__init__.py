@@ -26,6 +26,11 @@ KEY2CHAR = {}
 CHAR2KEY = {}
 KEYMAPS = {}
 
+# bumped when a binding is defined or undefined in any keymap, which
+# invalidates the dispatch tables.
+_generation = 0
+_DISPATCH_TABLES = {}
+
 
 def _set_key(key, char, *chars):
     KEY2CHAR[key] = char
@@ -217,11 +222,46 @@ def is_one_letter_upcase(char):
 _KeyPress = namedtuple("_KeyPress", ("key", "control_modifier", "alt_modifier",
                                      "super_modifier", "is_upper_case"))
 
+# the interned KeyPress instances, and the ones created from Qt key events
+# by (text, key, modifiers)
+_KEYPRESSES = {}
+_QEVENT_KEYPRESSES = {}
+
 
 class KeyPress(_KeyPress):
+    """
+    A key with its modifiers.
+
+    Instances are interned: there is one per combination of key, modifiers
+    and case, with its hash and string form computed once.
+    """
+
+    def __new__(cls, key, control_modifier, alt_modifier, super_modifier,
+                is_upper_case):
+        fields = (key, control_modifier, alt_modifier, super_modifier,
+                  is_upper_case)
+        try:
+            return _KEYPRESSES[fields]
+        except KeyError:
+            pass
+        self = _KeyPress.__new__(cls, *fields)
+        self._hash = hash(fields)
+        self._str = self._to_str()
+        _KEYPRESSES[fields] = self
+        return self
+
+    def __hash__(self):
+        return self._hash
+
     @classmethod
     def from_qevent(cls, event):
         text = event.text()
+        qkey = event.key()
+        modifiers = int(event.modifiers())
+        try:
+            return _QEVENT_KEYPRESSES[(text, qkey, modifiers)]
+        except KeyError:
+            pass
 
         # Try to get the key value depending on the text. Despite what the qt
         # doc says, it seems more reliable to get the good value this way. For
@@ -230,19 +270,19 @@ class KeyPress(_KeyPress):
         # DOWN.
         key = CHAR2KEY.get(text)
         if key is None:
-            key = event.key()
-            if key not in KEY2CHAR:
-                return None
-
-        modifiers = event.modifiers()
-
-        return cls(
-            key,
-            bool(modifiers & Qt.ControlModifier),
-            bool(modifiers & Qt.AltModifier),
-            bool(modifiers & Qt.MetaModifier),
-            is_one_letter_upcase(text)
-        )
+            key = qkey
+        if key not in KEY2CHAR:
+            keypress = None
+        else:
+            keypress = cls(
+                key,
+                bool(modifiers & Qt.ControlModifier),
+                bool(modifiers & Qt.AltModifier),
+                bool(modifiers & Qt.MetaModifier),
+                is_one_letter_upcase(text)
+            )
+        _QEVENT_KEYPRESSES[(text, qkey, modifiers)] = keypress
+        return keypress
 
     @classmethod
     def from_str(cls, string):
@@ -305,6 +345,9 @@ class KeyPress(_KeyPress):
         return char
 
     def __str__(self):
+        return self._str
+
+    def _to_str(self):
         keyrepr = []
 
         if self.control_modifier:
@@ -327,11 +370,14 @@ KeymapLookupResult = namedtuple("KeymapLookupResult",
 
 
 class InternalKeymap(object):
-    __slots__ = ("bindings", "parent")
+    __slots__ = ("bindings", "parent", "_commands")
 
     def __init__(self, parent=None):
         self.bindings = {}
         self.parent = parent
+        # reverse index of the bindings defined with this keymap,
+        # {command: {keypresses tuple: key chord string}}
+        self._commands = {}
 
     def _traverse_commands(self, prefix, acc_fn, parent=None):
         for keypress, cmd in self.bindings.items():
@@ -352,22 +398,66 @@ class InternalKeymap(object):
     def traverse_commands(self, acc_fn):
         self._traverse_commands([], acc_fn)
 
+    def iter_bindings(self, command=None, with_parent=True):
+        """
+        Iterate over the bindings as (keychord, command, parent) tuples,
+        parent being the parent keymap defining the binding or None. The
+        bindings of the parents are shadowed by the ones of their children.
+
+        This uses the reverse index of the keymaps, and if command is given,
+        only its bindings are looked up.
+        """
+        children = []
+        keymap = self
+        while keymap is not None:
+            if command is None:
+                commands = keymap._commands.items()
+            else:
+                commands = ((command, keymap._commands.get(command, {})),)
+            parent = keymap if children else None
+            for cmd, chords in commands:
+                for keys, chord in chords.items():
+                    if not any(keys[0] in km.bindings for km in children):
+                        yield chord, cmd, parent
+            if not with_parent:
+                break
+            children.append(keymap)
+            keymap = keymap.parent
+
+    def bindings_for(self, command, with_parent=True):
+        """
+        Returns the list of the key chords bound to a command.
+        """
+        return [chord for chord, _, _ in self.iter_bindings(command,
+                                                            with_parent)]
+
     def all_bindings(self, raw_fn=False, with_parent=True):
         """
         Returns the list of bindings as (keychord, command-name) tuples.
         """
         acc = []
-
-        def add(prefix, cmd, parent):
-            if not with_parent and parent is not None:
-                return
+        for chord, cmd, _ in self.iter_bindings(with_parent=with_parent):
             if isinstance(cmd, str):
-                acc.append((" ".join(str(k) for k in prefix), cmd))
+                acc.append((chord, cmd))
             elif raw_fn:
-                acc.append((" ".join(str(k) for k in prefix), cmd.__name__))
-        self.traverse_commands(add)
+                acc.append((chord, cmd.__name__))
         return acc
 
+    def _index_binding(self, keys, binding):
+        self._commands.setdefault(binding, {})[tuple(keys)] = \
+            " ".join(str(k) for k in keys)
+
+    def _unindex_binding(self, keys, binding):
+        if isinstance(binding, InternalKeymap):
+            for keypress, sub_binding in binding.bindings.items():
+                self._unindex_binding(keys + [keypress], sub_binding)
+            return
+        chords = self._commands.get(binding)
+        if chords is not None:
+            chords.pop(tuple(keys), None)
+            if not chords:
+                del self._commands[binding]
+
     def _define_key(self, key, binding):
         keys = [KeyPress.from_str(k) for k in key.split()]
         assert keys, "key should not be empty"
@@ -375,17 +465,23 @@ class InternalKeymap(object):
             "binding should be callable or a command name"
 
         kmap = self
-        for keypress in keys[:-1]:
+        for i, keypress in enumerate(keys[:-1]):
             if keypress in kmap.bindings:
                 othermap = kmap.bindings[keypress]
                 if not isinstance(othermap, InternalKeymap):
+                    self._unindex_binding(keys[:i + 1], othermap)
                     othermap = InternalKeymap()
             else:
                 othermap = InternalKeymap()
             kmap.bindings[keypress] = othermap
             kmap = othermap
 
+        previous = kmap.bindings.get(keys[-1])
+        if previous is not None:
+            self._unindex_binding(keys, previous)
         kmap.bindings[keys[-1]] = binding
+        self._index_binding(keys, binding)
+        _keymaps_changed()
 
     def define_key(self, key, binding=None):
         """
@@ -417,7 +513,13 @@ class InternalKeymap(object):
             return None
         res = self.lookup(keys)
         if res is not None and res.complete:
+            # the keymap, or the parent, defining the binding
+            owner = self
+            while keys[0] not in owner.bindings:
+                owner = owner.parent
             del res.keymap.bindings[keys[-1]]
+            owner._unindex_binding(keys, res.command)
+            _keymaps_changed()
             return res.keymap
         return None
 
@@ -473,6 +575,92 @@ class Keymap(InternalKeymap):
             return self.doc.split("\n", 1)[0]
 
 
+def _keymaps_changed():
+    global _generation
+    _generation += 1
+
+
+class DispatchTable(dict):
+    """
+    A node of the prefix tree built by :func:`dispatch_table`, mapping
+    keypresses to either a complete :class:`KeymapLookupResult` or another
+    DispatchTable for a key chord prefix.
+
+    Like a :class:`KeymapLookupResult`, it has the complete, command and
+    keymap attributes, keymap being the active keymap defining the prefix.
+    """
+    __slots__ = ("keymap", "generation")
+
+    complete = False
+    command = None
+
+    def __init__(self, keymap, generation=None):
+        dict.__init__(self)
+        self.keymap = keymap
+        self.generation = generation
+
+    def follow(self, keypresses):
+        """
+        Returns the DispatchTable of the key chord prefix keypresses, or
+        None.
+        """
+        node = self
+        for keypress in keypresses:
+            node = node.get(keypress)
+            if node is None or node.complete:
+                return None
+        return node
+
+
+def _flatten(keymap):
+    # the bindings of a keymap shadow the ones of its parents, only at the
+    # top level as lookup() does not search the parents for the keys after
+    # a prefix.
+    bindings = {}
+    while keymap is not None:
+        for keypress, binding in keymap.bindings.items():
+            bindings.setdefault(keypress, binding)
+        keymap = keymap.parent
+    return bindings
+
+
+def _merge(table, bindings, keymap):
+    for keypress, binding in bindings.items():
+        entry = table.get(keypress)
+        if isinstance(binding, InternalKeymap):
+            if entry is None:
+                entry = table[keypress] = DispatchTable(keymap)
+            if not entry.complete:
+                _merge(entry, binding.bindings, keymap)
+        elif entry is None:
+            table[keypress] = KeymapLookupResult(True, binding, keymap)
+
+
+def dispatch_table(local_keymap, use_global_keymap=True):
+    """
+    Returns the :class:`DispatchTable` of the given active keymaps.
+
+    The bindings of the local keymap and its parents are merged with the
+    ones of the global keymap, the local ones taking precedence, so that
+    resolving a key chord costs one dict lookup per keypress whatever the
+    depth of the keymaps inheritance. The tables are cached until a binding
+    changes.
+    """
+    key = (local_keymap, use_global_keymap)
+    table = _DISPATCH_TABLES.get(key)
+    if table is not None and table.generation == _generation:
+        return table
+
+    keymaps = [km for km in (local_keymap,
+                             GLOBAL_KEYMAP if use_global_keymap else None)
+               if km is not None]
+    table = DispatchTable(keymaps[0] if keymaps else None, _generation)
+    for keymap in keymaps:
+        _merge(table, _flatten(keymap), keymap)
+    _DISPATCH_TABLES[key] = table
+    return table
+
+
 EMPTY_KEYMAP = Keymap("empty")
 
 GLOBAL_KEYMAP = Keymap("global", doc="""\
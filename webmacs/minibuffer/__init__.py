@@ -17,11 +17,11 @@ from PyQt5.QtWidgets import QWidget, QLineEdit, QHBoxLayout, QLabel, \
     QTableView, QHeaderView, QApplication, QSizePolicy, QFrame
 from PyQt5.QtGui import QPainter
 from PyQt5.QtCore import pyqtSignal as Signal, \
-    QEvent, QSortFilterProxyModel, QRegExp, Qt, QModelIndex, \
-    pyqtProperty
+    QEvent, Qt, QModelIndex, pyqtProperty
 
 from ..keymaps import MINIBUFFER_KEYMAP as KEYMAP
 from .prompt import Prompt
+from .completion import CompletionFilterModel
 from .. import variables
 from .. import windows
 from ..keyboardhandler import LOCAL_KEYMAP_SETTER
@@ -96,8 +96,7 @@ class MinibufferInput(QLineEdit):
         self._popup.installEventFilter(self)
         self.installEventFilter(self)
         self._eat_focusout = False
-        self._proxy_model = QSortFilterProxyModel(self)
-        self._proxy_model.setFilterKeyColumn(-1)
+        self._proxy_model = CompletionFilterModel(self)
         self._popup.setModel(self._proxy_model)
         self._popup.activated.connect(self._on_completion_activated)
         self._popup.selectionModel().currentRowChanged.connect(
@@ -114,6 +113,7 @@ class MinibufferInput(QLineEdit):
         if self._autocomplete:
             self._autocomplete_single = False
         self._complete_empty = opts.get("complete-empty", False)
+        self._proxy_model.set_match_columns(opts.get("match-columns"))
 
     def keymap(self):
         prompt = self.parent()._prompt
@@ -175,15 +175,11 @@ class MinibufferInput(QLineEdit):
 
     def _show_completions(self, txt, force=False):
         force = force or self._complete_empty
-        if self._match is not None:
-            if self._match == self.SimpleMatch:
-                pattern = "^" + QRegExp.escape(txt)
-            elif self._match == self.FuzzyMatch:
-                pattern = ".*".join(QRegExp.escape(t) for t in txt.split())
-            self._proxy_model.setFilterRegExp(QRegExp(pattern,
-                                                      Qt.CaseInsensitive))
-        else:
-            self._proxy_model.setFilterRegExp(None)
+        # let the model update its rows first
+        completer_model = self.completer_model()
+        if hasattr(completer_model, "text_changed"):
+            completer_model.text_changed(txt)
+        self._proxy_model.set_filter(txt, self._match)
 
         if self._proxy_model.rowCount() == 0:
             self._popup.hide()
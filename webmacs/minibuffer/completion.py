@@ -0,0 +1,295 @@
+# This file is part of webmacs.
+#
+# webmacs is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# webmacs is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
+
+from bisect import bisect_left
+
+from PyQt5.QtCore import QAbstractProxyModel, QAbstractListModel, \
+    QModelIndex, Qt
+
+from .prompt import Prompt
+
+
+def _simple_matcher(query):
+    # one of the columns starts with the text
+    def match(keys):
+        for key in keys:
+            if key.startswith(query):
+                return True
+        return False
+    return match
+
+
+def _fuzzy_matcher(query):
+    # one of the columns contains the words of the text, in order
+    words = query.split()
+    if not words:
+        return None
+    if len(words) == 1:
+        word = words[0]
+
+        def match(keys):
+            for key in keys:
+                if word in key:
+                    return True
+            return False
+        return match
+
+    def match(keys):
+        for key in keys:
+            pos = 0
+            for word in words:
+                pos = key.find(word, pos)
+                if pos == -1:
+                    break
+                pos += len(word)
+            else:
+                return True
+        return False
+    return match
+
+
+def _column_count(model):
+    # columnCount() is private in QAbstractListModel
+    if isinstance(model, QAbstractListModel):
+        return 1
+    return model.columnCount()
+
+
+MATCHERS = {
+    Prompt.SimpleMatch: _simple_matcher,
+    Prompt.FuzzyMatch: _fuzzy_matcher,
+}
+
+
+class CompletionFilterModel(QAbstractProxyModel):
+    """
+    A proxy model keeping the rows of the source model which match the
+    text typed in the minibuffer input, in the source order.
+
+    The text of the rows is lowered once and kept. When the text typed
+    extends the previous one, only the rows matching the previous text are
+    tested again, the other rows are tested only when text is deleted.
+    """
+
+    def __init__(self, parent=None):
+        QAbstractProxyModel.__init__(self, parent)
+        # source rows matching the filter, sorted
+        self._rows = []
+        # lowered text of the matched columns of each source row, or None
+        self._keys = []
+        # number of leading columns matched, None for all
+        self._match_columns = None
+        self._query = ""
+        self._match = None
+        self._matcher = None
+
+    def setSourceModel(self, model):
+        old = self.sourceModel()
+        if old is not None:
+            for signal, slot in self._source_signals(old):
+                signal.disconnect(slot)
+        self.beginResetModel()
+        QAbstractProxyModel.setSourceModel(self, model)
+        if model is not None:
+            for signal, slot in self._source_signals(model):
+                signal.connect(slot)
+        # the filter of the previous completions does not apply
+        self._query = ""
+        self._match = self._matcher = None
+        self._refilter()
+        self.endResetModel()
+
+    def _source_signals(self, model):
+        return (
+            (model.modelAboutToBeReset, self.beginResetModel),
+            (model.modelReset, self._on_reset),
+            (model.layoutAboutToBeChanged, self.beginResetModel),
+            (model.layoutChanged, self._on_reset),
+            (model.rowsAboutToBeMoved, self.beginResetModel),
+            (model.rowsMoved, self._on_reset),
+            (model.columnsAboutToBeInserted, self.beginResetModel),
+            (model.columnsInserted, self._on_reset),
+            (model.columnsAboutToBeRemoved, self.beginResetModel),
+            (model.columnsRemoved, self._on_reset),
+            (model.rowsInserted, self._on_rows_inserted),
+            (model.rowsAboutToBeRemoved, self._on_rows_about_to_be_removed),
+            (model.rowsRemoved, self._on_rows_removed),
+            (model.dataChanged, self._on_data_changed),
+        )
+
+    def set_match_columns(self, count):
+        """
+        Only match the text against the count first columns, or against
+        every column if count is None. Other columns only annotate the rows.
+        """
+        if count == self._match_columns:
+            return
+        self._match_columns = count
+        self.beginResetModel()
+        self._refilter()
+        self.endResetModel()
+
+    def set_filter(self, text, match):
+        """
+        Keep the rows matching text, with the Prompt.SimpleMatch or
+        Prompt.FuzzyMatch method. All the rows are kept if match is None.
+        """
+        query = text.lower() if match is not None else ""
+        narrow = (match == self._match and query.startswith(self._query))
+        if narrow and query == self._query:
+            return
+        self._query = query
+        self._match = match
+        self._matcher = MATCHERS[match](query) if match is not None \
+            else None
+
+        self.beginResetModel()
+        self._rows = self._filter(self._rows if narrow
+                                  else range(len(self._keys)))
+        self.endResetModel()
+
+    def _row_keys(self, row):
+        keys = self._keys[row]
+        if keys is None:
+            source = self.sourceModel()
+            columns = _column_count(source)
+            if self._match_columns is not None:
+                columns = min(columns, self._match_columns)
+            keys = self._keys[row] = tuple(
+                str(source.data(source.index(row, col), Qt.DisplayRole)
+                    or "").lower()
+                for col in range(columns))
+        return keys
+
+    def _filter(self, rows):
+        match = self._matcher
+        if match is None:
+            return list(rows)
+        row_keys = self._row_keys
+        return [row for row in rows if match(row_keys(row))]
+
+    def _refilter(self):
+        # the source rows changed, forget their keys
+        source = self.sourceModel()
+        count = source.rowCount() if source is not None else 0
+        self._keys = [None] * count
+        self._rows = self._filter(range(count))
+
+    def _on_reset(self, *args):
+        self._refilter()
+        self.endResetModel()
+
+    def _on_rows_inserted(self, parent, first, last):
+        if parent.isValid():
+            return
+        count = last - first + 1
+        pos = bisect_left(self._rows, first)
+        self._keys[first:first] = [None] * count
+        for i in range(pos, len(self._rows)):
+            self._rows[i] += count
+        new_rows = self._filter(range(first, last + 1))
+        if new_rows:
+            self.beginInsertRows(QModelIndex(), pos, pos + len(new_rows) - 1)
+            self._rows[pos:pos] = new_rows
+            self.endInsertRows()
+
+    def _on_rows_about_to_be_removed(self, parent, first, last):
+        if parent.isValid():
+            return
+        start = bisect_left(self._rows, first)
+        end = bisect_left(self._rows, last + 1)
+        if start < end:
+            self.beginRemoveRows(QModelIndex(), start, end - 1)
+            del self._rows[start:end]
+            self.endRemoveRows()
+
+    def _on_rows_removed(self, parent, first, last):
+        if parent.isValid():
+            return
+        count = last - first + 1
+        del self._keys[first:last + 1]
+        for i in range(bisect_left(self._rows, first), len(self._rows)):
+            self._rows[i] -= count
+
+    def _on_data_changed(self, top_left, bottom_right, roles=()):
+        if roles and Qt.DisplayRole not in roles:
+            changed = list(range(top_left.row(), bottom_right.row() + 1))
+        else:
+            changed = []
+            for row in range(top_left.row(), bottom_right.row() + 1):
+                self._keys[row] = None
+                pos = bisect_left(self._rows, row)
+                present = pos < len(self._rows) and self._rows[pos] == row
+                matches = bool(self._filter((row,)))
+                if present and not matches:
+                    self.beginRemoveRows(QModelIndex(), pos, pos)
+                    del self._rows[pos]
+                    self.endRemoveRows()
+                elif matches and not present:
+                    self.beginInsertRows(QModelIndex(), pos, pos)
+                    self._rows.insert(pos, row)
+                    self.endInsertRows()
+                elif present:
+                    changed.append(row)
+        for row in changed:
+            pos = bisect_left(self._rows, row)
+            if pos < len(self._rows) and self._rows[pos] == row:
+                self.dataChanged.emit(
+                    self.index(pos, top_left.column()),
+                    self.index(pos, bottom_right.column()), roles)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        source = self.sourceModel()
+        if parent.isValid() or source is None:
+            return 0
+        return _column_count(source)
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or not (0 <= row < len(self._rows)) \
+           or not (0 <= column < self.columnCount()):
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=QModelIndex()):
+        return QModelIndex()
+
+    def mapToSource(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        return self.sourceModel().index(self._rows[index.row()],
+                                        index.column())
+
+    def mapFromSource(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        row = index.row()
+        pos = bisect_left(self._rows, row)
+        if pos == len(self._rows) or self._rows[pos] != row:
+            return QModelIndex()
+        return self.index(pos, index.column())
+
+    def canFetchMore(self, parent=QModelIndex()):
+        source = self.sourceModel()
+        return (not parent.isValid() and source is not None
+                and source.canFetchMore(QModelIndex()))
+
+    def fetchMore(self, parent=QModelIndex()):
+        if self.canFetchMore(parent):
+            self.sourceModel().fetchMore(QModelIndex())
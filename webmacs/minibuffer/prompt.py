@@ -24,6 +24,7 @@ from PyQt5.QtCore import QObject, QAbstractTableModel, QModelIndex, Qt, \
 from PyQt5.QtGui import QColor, QRegExpValidator
 
 from ..keyboardhandler import set_global_keymap_enabled
+from ..key_latency import KEY_LATENCIES
 from ..keymaps import Keymap
 from .. import variables
 
@@ -121,6 +122,85 @@ class PromptTableModel(QAbstractTableModel):
             return QModelIndex()
 
 
+class PagedTableModel(QAbstractTableModel):
+    """
+    A table model fetching its rows by pages, when the view needs them.
+
+    query_fn is called with the text of the minibuffer input, a limit and
+    an offset, and returns an iterable of at most limit row tuples, like
+    an sqlite3 cursor, starting at offset.
+
+    Each page is read at once: a cursor left open between pages would pin
+    its snapshot of the database, and the write-ahead log could not be
+    checkpointed while the prompt is open.
+    """
+
+    page_size = 100
+
+    def __init__(self, query_fn, columns=2, parent=None):
+        QAbstractTableModel.__init__(self, parent)
+        self._query_fn = query_fn
+        self._columns = columns
+        self._data = []
+        self._more = False
+        self._text = None
+
+    def rowCount(self, index=QModelIndex()):
+        if index.isValid():
+            return 0
+        return len(self._data)
+
+    def columnCount(self, index=QModelIndex()):
+        return self._columns
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+
+        return index.internalPointer()
+
+    def index(self, row, col, parent=QModelIndex()):
+        try:
+            return self.createIndex(row, col, self._data[row][col])
+        except IndexError:
+            return QModelIndex()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._more
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        rows = list(self._query_fn(self._text, self.page_size,
+                                   len(self._data)))
+        if len(rows) < self.page_size:
+            self._more = False
+        if rows:
+            first = len(self._data)
+            self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+            self._data.extend(rows)
+            self.endInsertRows()
+
+    def text_changed(self, text):
+        if text == self._text:
+            return
+        self._text = text
+        self.beginResetModel()
+        self._data = []
+        self._more = True
+        self.endResetModel()
+        self.fetchMore()
+
+    def remove_row(self, row):
+        """
+        Remove a row from the model, returns it.
+        """
+        self.beginRemoveRows(QModelIndex(), row, row)
+        data = self._data.pop(row)
+        self.endRemoveRows()
+        return data
+
+
 def _prompt_exec(prompt, loop):
     # mocked in tests to not block.
     loop.exec_()
@@ -160,8 +240,8 @@ class Prompt(QObject):
         # without this completer reference on self, visited_links_history
         # will (quite) randomly generate segfault...
         self.__completer_model = completer_model = self.completer_model()
-        if hasattr(completer_model, "text_changed"):
-            buffer_input.textEdited.connect(completer_model.text_changed)
+        # the text_changed method of the model, if any, is called by
+        # buffer_input before the completions are filtered.
         buffer_input.set_completer_model(completer_model)
         buffer_input.returnPressed.connect(self._on_edition_finished)
         buffer_input.completion_activated.connect(
@@ -260,7 +340,8 @@ class Prompt(QObject):
         if sync:
             loop = QEventLoop()
             self.closed.connect(loop.quit)
-            _prompt_exec(self, loop)
+            with KEY_LATENCIES.waiting():
+                _prompt_exec(self, loop)
             return self.value()
 
 
@@ -0,0 +1,77 @@
+# This file is part of webmacs.
+#
+# webmacs is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# webmacs is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
+
+from bisect import bisect_left, insort
+
+
+class PrefixIndex(object):
+    """
+    A mapping of string keys to values, which keys are kept sorted to find
+    the keys starting with a prefix by bisection.
+    """
+
+    def __init__(self, items=()):
+        self._values = dict(items)
+        self._keys = sorted(self._values)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def __setitem__(self, key, value):
+        if key not in self._values:
+            insort(self._keys, key)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        del self._values[key]
+        del self._keys[bisect_left(self._keys, key)]
+
+    def items(self):
+        return ((key, self._values[key]) for key in self._keys)
+
+    def starting_with(self, prefix):
+        """
+        Iterate over the keys starting with prefix, in order.
+        """
+        keys = self._keys
+        for i in range(bisect_left(keys, prefix), len(keys)):
+            if not keys[i].startswith(prefix):
+                break
+            yield keys[i]
+
+    def unique_key(self, prefix):
+        """
+        Returns the key starting with prefix if there is exactly one, else
+        None.
+        """
+        keys = self._keys
+        i = bisect_left(keys, prefix)
+        if i == len(keys) or not keys[i].startswith(prefix):
+            return None
+        if i + 1 < len(keys) and keys[i + 1].startswith(prefix):
+            return None
+        return keys[i]
@@ -25,6 +25,7 @@ from .autofill.db import PasswordDb
 from .ignore_certificates import IgnoredCertificates
 from .bookmarks import Bookmarks
 from .features import Features
+from .storage import Storage
 from . import variables, version
 
 
@@ -53,7 +54,8 @@ class Profile(object):
         if not os.path.isdir(path):
             os.makedirs(path)
 
-        self.q_profile.setRequestInterceptor(app.url_interceptor())
+        self.q_profile.setRequestInterceptor(
+            app.url_interceptor().request_interceptor())
 
         for handler in all_schemes():
             h = handler(app)
@@ -70,16 +72,14 @@ class Profile(object):
             session_fname = "session-{}.json".format(app.instance_name)
         self.session_file = os.path.join(path, session_fname)
 
-        self.visitedlinks \
-            = VisitedLinks(os.path.join(path, "visitedlinks.db"))
-        self.autofill \
-            = Autofill(PasswordDb(os.path.join(path, "autofill.db")))
-        self.ignored_certs \
-            = IgnoredCertificates(os.path.join(path, "ignoredcerts.db"))
-        self.bookmarks \
-            = Bookmarks(os.path.join(path, "bookmarks.db"))
-        self.features \
-            = Features(os.path.join(path, "features.db"))
+        self.storage = Storage(path)
+        self.visitedlinks = VisitedLinks(self.storage)
+        self.autofill = Autofill(PasswordDb(self.storage))
+        self.ignored_certs = IgnoredCertificates(self.storage)
+        self.bookmarks = Bookmarks(self.storage)
+        self.features = Features(self.storage)
+        # after the visited links, which are written on quit
+        app.aboutToQuit.connect(self.storage.close)
 
         self.q_profile.setCachePath(os.path.join(path, "cache"))
         self.q_profile.downloadRequested.connect(
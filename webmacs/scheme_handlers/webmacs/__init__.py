@@ -16,11 +16,13 @@
 import os
 import sys
 import re
+import time
 import importlib
 import inspect
 from itertools import groupby
 from PyQt5.QtCore import QBuffer, QFile, QUrlQuery
-from PyQt5.QtWebEngineCore import QWebEngineUrlSchemeHandler
+from PyQt5.QtWebEngineCore import QWebEngineUrlSchemeHandler, \
+    QWebEngineUrlRequestInfo
 from jinja2 import Environment, PackageLoader
 from ... import version, COMMANDS
 from ...variables import VARIABLES
@@ -32,10 +34,10 @@ _REQUESTS_HANDLER = []
 THIS_DIR = os.path.dirname(os.path.realpath(__file__))
 
 
-def register_page(match_url=None, visible=True):
+def register_page(match_url=None, visible=True, page_name=None):
     def wrapper(meth):
         if visible:
-            PAGES.append(meth.__name__)
+            PAGES.append(page_name or meth.__name__)
         if match_url is None:
             match = re.compile(r"^(%s)$" % re.escape(meth.__name__))
         elif isinstance(match_url, str):
@@ -103,23 +105,53 @@ class WebmacsSchemeHandler(QWebEngineUrlSchemeHandler):
     def downloads(self, job, _, name):
         self.reply_template(job, name, {})
 
+    @register_page()
+    def adblock(self, job, _, name):
+        from ...application import app
+
+        stats = app().url_interceptor().adblock_stats()
+        type_names = resource_type_names()
+
+        def by_count(counts, key=lambda k: k):
+            return sorted(((key(k), v) for k, v in counts.items()),
+                          key=lambda item: item[1], reverse=True)
+
+        engine_names = set(list_name for list_name, _ in stats["engines"])
+        self.reply_template(job, name, {
+            "stats": stats,
+            "engines": [(list_name, info, stats["lists"].get(list_name, 0))
+                        for list_name, info in stats["engines"]],
+            # lists without engine, like the hosts files
+            "other_lists": [(list_name, count) for list_name, count
+                            in by_count(stats["lists"])
+                            if list_name not in engine_names],
+            "sites": by_count(stats["sites"])[:50],
+            "types": by_count(stats["types"],
+                              lambda t: type_names.get(t, str(t))),
+        })
+
+    @register_page(match_url=r"^(perf/keys)$", page_name="perf/keys")
+    def perf_keys(self, job, _, name):
+        from ...key_latency import KEY_LATENCIES
+
+        slowest = KEY_LATENCIES.slowest()
+        for call in slowest:
+            call["time"] = time.strftime("%H:%M:%S",
+                                         time.localtime(call["time"]))
+        self.reply_template(job, "perf_keys", {
+            "enabled": KEY_LATENCIES.enabled,
+            "commands": KEY_LATENCIES.stats(),
+            "slowest": slowest,
+        })
+
     @register_page()
     def commands(self, job, _, name):
         self.reply_template(job, name, {"commands": COMMANDS})
 
     @register_page(match_url=r"^command/(\S+)$", visible=False)
     def command(self, job, _, command):
-        used_in_keymaps = []
-
-        for name, km in KEYMAPS.items():
-            def add(prefix, cmd, parent):
-                if cmd == command:
-                    used_in_keymaps.append((
-                        " ".join(str(k) for k in prefix),
-                        name,
-                    ))
-
-            km.traverse_commands(add)
+        used_in_keymaps = [(chord, name) for name, km in KEYMAPS.items()
+                           for chord in km.bindings_for(command)]
 
         cmd = COMMANDS[command]
 
@@ -143,13 +175,8 @@ class WebmacsSchemeHandler(QWebEngineUrlSchemeHandler):
     @register_page(match_url=r"^keymap/(\S+)$", visible=False)
     def keymap(self, job, _, keymap):
         km = KEYMAPS[keymap]
-        acc = []
-
-        def add(prefix, cmd, parent):
-            if isinstance(cmd, str):
-                acc.append((" ".join(str(k) for k in prefix), cmd, parent))
-
-        km.traverse_commands(add)
+        acc = [binding for binding in km.iter_bindings()
+               if isinstance(binding[1], str)]
 
         def by_parent(v):
             return v[2].name if v[2] else ""
@@ -218,19 +245,9 @@ class WebmacsSchemeHandler(QWebEngineUrlSchemeHandler):
         command_doc = fn.__doc__
         src_url = get_src_url(fn)
 
-        def _get_all_keys(km):
-            acc = []
-
-            cmd = command_name if named_command else fn
-
-            def add(prefix, cmd_, parent_):
-                if cmd == cmd_:
-                    acc.append(" ".join(str(k) for k in prefix))
-            km.traverse_commands(add)
-            return acc
-
         try:
-            all_keys = _get_all_keys(KEYMAPS[keymap])
+            all_keys = KEYMAPS[keymap].bindings_for(
+                command_name if named_command else fn)
         except KeyError:
             all_keys = (key,)
 
@@ -246,6 +263,18 @@ class WebmacsSchemeHandler(QWebEngineUrlSchemeHandler):
         })
 
 
+def resource_type_names():
+    """
+    Returns a dict of resource type values to readable names.
+    """
+    prefix = "ResourceType"
+    return {
+        int(getattr(QWebEngineUrlRequestInfo, attr)): attr[len(prefix):]
+        for attr in dir(QWebEngineUrlRequestInfo)
+        if attr.startswith(prefix) and attr != "ResourceTypeLast"
+    }
+
+
 def get_src_url(obj):
     lines, loc = inspect.getsourcelines(obj)
     return "webmacs://pydoc/{}?hl_lines={}-{}#line-{}".format(
@@ -0,0 +1,445 @@
+# This file is part of webmacs.
+#
+# webmacs is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# webmacs is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Sqlite databases of the profiles, shared by the webmacs instances running
+on a profile.
+"""
+
+import os
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from PyQt5.QtCore import QTimer, QObject, QCoreApplication
+
+from . import variables
+from .hooks import Hook
+from .runnable import RunnableFinishedEvent
+
+
+database_busy_timeout = variables.define_variable(
+    "database-busy-timeout",
+    "Time in milliseconds a write waits for another webmacs instance"
+    " writing to the same database. Writes from the user interface are"
+    " retried later instead of waiting longer.",
+    100,
+    type=variables.Int(min=0)
+)
+
+database_poll_interval = variables.define_variable(
+    "database-poll-interval",
+    "Interval in milliseconds at which the databases are checked for"
+    " changes made by other webmacs instances. 0 disables the check.",
+    2000,
+    type=variables.Int(min=0)
+)
+
+
+# background threads do not block the user interface, they can wait for
+# long operations like a VACUUM in another instance.
+THREAD_BUSY_TIMEOUT = 30.0
+
+# delay in milliseconds before the writes of a WriteQueue are retried when
+# the database is locked by another instance.
+BUSY_RETRY_DELAY = 500
+
+# the databases are read through memory mapped I/O up to this size
+MMAP_SIZE = 64 * 1024 * 1024
+
+
+def connect(path, timeout=None, **kwargs):
+    """
+    Open a connection to a database shared between instances.
+
+    timeout is the busy timeout in seconds, defaulting to the
+    database-busy-timeout variable.
+    """
+    if timeout is None:
+        timeout = database_busy_timeout.value / 1000
+    conn = sqlite3.connect(path, timeout=timeout, **kwargs)
+    # free pages can be given back to the file system with
+    # PRAGMA incremental_vacuum. This only applies to new databases, and
+    # must come before the journal mode. It is not set on existing ones as
+    # it counts as a change for the connections of the other instances.
+    if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # in WAL mode, readers and the writer do not block each other, and
+    # committing with synchronous=NORMAL does not fsync
+    retry_on_busy(conn.execute, "PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA mmap_size={}".format(MMAP_SIZE))
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def is_busy(exc):
+    """
+    Returns True if the sqlite error exc is raised because another
+    connection holds a lock.
+    """
+    return (isinstance(exc, sqlite3.OperationalError)
+            and str(exc).startswith(("database is locked",
+                                     "database table is locked")))
+
+
+def retry_on_busy(func, *args, attempts=5, delay=0.02):
+    """
+    Call func(*args), retrying with an exponential backoff while the
+    database is locked by another connection.
+    """
+    for attempt in range(attempts):
+        try:
+            return func(*args)
+        except sqlite3.OperationalError as exc:
+            if not is_busy(exc) or attempt == attempts - 1:
+                raise
+            logging.debug("Database is locked, retrying: %s", func)
+            time.sleep(delay * 2 ** attempt)
+
+
+@contextmanager
+def immediate_transaction(conn):
+    """
+    Run the block in a transaction taking the write lock at once, so
+    concurrent writers are serialized before anything is read.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def execute_write(conn, query, args=()):
+    """
+    Execute a write query in its own transaction. Given to Storage.write,
+    it is retried later while the database is locked by another instance.
+    """
+    with immediate_transaction(conn):
+        conn.execute(query, args)
+
+
+def migrate(conn, migrations):
+    """
+    Upgrade the schema of the database, versioned with the user_version
+    pragma. migrations[i] is a function taking the connection, upgrading
+    the schema from the version i to i + 1. Each one runs in a transaction,
+    as another instance may be upgrading the database at the same time.
+    """
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= len(migrations):
+        # up to date, no need to lock the database
+        return
+    for version, migration in enumerate(migrations):
+        with immediate_transaction(conn):
+            if conn.execute("PRAGMA user_version").fetchone()[0] > version:
+                continue
+            migration(conn)
+            # pragmas can not be given parameters
+            conn.execute("PRAGMA user_version = {:d}".format(version + 1))
+
+
+def sql_migration(*statements):
+    """
+    Returns a migration executing the given statements.
+    """
+    def migration(conn):
+        for statement in statements:
+            conn.execute(statement)
+    return migration
+
+
+class StorageFuture(QObject):
+    """
+    The result of a function submitted to a StorageWorker, delivered in the
+    GUI thread with a Qt event.
+    """
+
+    # keep the futures referenced until their result is delivered
+    PENDING = set()
+
+    def __init__(self):
+        QObject.__init__(self)
+        self._callbacks = []
+        self._done = False
+        self.error = False
+        self.result = None
+        self.PENDING.add(self)
+
+    def done(self):
+        return self._done
+
+    def then(self, callback):
+        """
+        Call callback(error, result) in the GUI thread once the function
+        returned. error is True if it raised, the exception being logged.
+        Returns the future.
+        """
+        if self._done:
+            callback(self.error, self.result)
+        else:
+            self._callbacks.append(callback)
+        return self
+
+    def set_result(self, error, result):
+        self.PENDING.discard(self)
+        self._done = True
+        self.error = error
+        self.result = result
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(error, result)
+            except Exception:
+                logging.exception("Error while handling a storage result")
+
+    def customEvent(self, evt):
+        if evt.type() == RunnableFinishedEvent.TYPE:
+            self.set_result(evt.error, evt.data)
+
+
+class StorageWorker(object):
+    """
+    A thread running the functions submitted from the GUI thread, one after
+    the other, so the GUI thread never waits for the disk or for a lock
+    held by another instance.
+
+    The worker has its own connections to the databases of the storage,
+    opened and upgraded with the migrations submitted with the first
+    function for them, so the GUI thread does not need to open them.
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run,
+                                        name="webmacs-storage", daemon=True)
+        self._thread.start()
+
+    def submit(self, filename, func, args, migrations=()):
+        future = StorageFuture()
+        self._queue.put((future, filename, migrations, func, args))
+        return future
+
+    def _run(self):
+        connections = {}
+        try:
+            while True:
+                task = self._queue.get()
+                if task is None:
+                    return
+                future, filename, migrations, func, args = task
+                error, result = False, None
+                try:
+                    conn = connections.get(filename)
+                    if conn is None:
+                        conn = connect(self._storage.db_path(filename),
+                                       timeout=THREAD_BUSY_TIMEOUT)
+                        migrate(conn, migrations)
+                        connections[filename] = conn
+                    result = func(conn, *args)
+                except Exception:
+                    error = True
+                    logging.exception("Error while running %s on %s",
+                                      func, filename)
+                QCoreApplication.postEvent(
+                    future, RunnableFinishedEvent(error, result))
+        finally:
+            for conn in connections.values():
+                conn.close()
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+class WriteQueue(object):
+    """
+    Run writes to a database in the GUI thread, in order.
+
+    When the database is locked by another instance, the write and the
+    ones queued after it are retried from a timer, so the GUI thread never
+    sleeps waiting for the lock.
+    """
+
+    def __init__(self, storage, filename, migrations=()):
+        self._storage = storage
+        self._filename = filename
+        self._conn = storage.connection(filename, migrations)
+        # (func, args, callback) of the writes not done yet
+        self._writes = deque()
+        self._timer = QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._run)
+
+    def __len__(self):
+        return len(self._writes)
+
+    def write(self, func, args, callback=None):
+        """
+        Call func(conn, *args), then callback(result) if given. Returns
+        True if it was done now, False if it is retried later.
+        """
+        self._writes.append((func, args, callback))
+        if self._timer.isActive():
+            return False
+        return self._run()
+
+    def _run(self):
+        while self._writes:
+            func, args, callback = self._writes[0]
+            try:
+                result = func(self._conn, *args)
+            except sqlite3.OperationalError as exc:
+                if not is_busy(exc):
+                    self._writes.popleft()
+                    logging.exception("Error while running %s on %s",
+                                      func, self._filename)
+                    continue
+                logging.debug("Database %s is locked, %d writes will be"
+                              " retried later", self._filename,
+                              len(self._writes))
+                self._timer.start(BUSY_RETRY_DELAY)
+                return False
+            self._writes.popleft()
+            if callback is not None:
+                callback(result)
+        return True
+
+    def hand_over(self):
+        """
+        Submit the remaining writes to the storage worker, which waits for
+        the lock. Their callbacks are not called.
+        """
+        self._timer.stop()
+        while self._writes:
+            func, args, _ = self._writes.popleft()
+            self._storage.submit(self._filename, func, *args)
+
+
+class Storage(object):
+    """
+    The databases of a profile, in the directory path.
+
+    It owns one connection per database, opened on first use with the
+    tuned pragmas and upgraded with the migrations of the database, a
+    WriteQueue per database written from the GUI thread, and a
+    StorageWorker started on first use to run queries asynchronously.
+
+    The databases are kept in separate files rather than attached to one
+    connection: a write transaction locks every attached database, so the
+    writes of the instances to unrelated databases would wait for each
+    other.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connections = {}
+        self._write_queues = {}
+        self._worker = None
+
+    def db_path(self, filename):
+        return os.path.join(self.path, filename)
+
+    def connection(self, filename, migrations=()):
+        conn = self._connections.get(filename)
+        if conn is None:
+            conn = connect(self.db_path(filename))
+            retry_on_busy(migrate, conn, migrations)
+            self._connections[filename] = conn
+        return conn
+
+    def submit(self, filename, func, *args, migrations=()):
+        """
+        Run func(conn, *args) in the storage thread, conn being its
+        connection to the database filename, upgraded with migrations when
+        the thread opens it. Returns a StorageFuture.
+        """
+        if self._worker is None:
+            self._worker = StorageWorker(self)
+        return self._worker.submit(filename, func, args, migrations)
+
+    def write(self, filename, func, *args, callback=None, migrations=()):
+        """
+        Run func(conn, *args) in the GUI thread with the WriteQueue of the
+        database filename, see WriteQueue.write. The database is opened
+        with the given migrations if it is not yet.
+        """
+        writes = self._write_queues.get(filename)
+        if writes is None:
+            writes = self._write_queues[filename] = WriteQueue(
+                self, filename, migrations)
+        return writes.write(func, args, callback)
+
+    def close(self):
+        # the writes still waiting for a lock are done by the worker, which
+        # is stopped once they are done.
+        for writes in self._write_queues.values():
+            writes.hand_over()
+        self._write_queues.clear()
+        if self._worker is not None:
+            self._worker.stop()
+            self._worker = None
+        for conn in self._connections.values():
+            conn.close()
+        self._connections.clear()
+
+
+class ChangeWatcher(object):
+    """
+    Call the changed hook when another connection, usually from another
+    webmacs instance, commits to the database of conn.
+
+    The data_version pragma is polled every database-poll-interval
+    milliseconds; it does not change for the commits of conn itself.
+    """
+
+    def __init__(self, conn):
+        self.changed = Hook()
+        self._conn = conn
+        self._version = self._data_version()
+        self._timer = QTimer()
+        self._timer.timeout.connect(self.check)
+        if database_poll_interval.value > 0:
+            self._timer.start(database_poll_interval.value)
+
+    def _data_version(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def check(self):
+        """
+        Returns True and call the changed hook if the database changed
+        since the last check.
+        """
+        try:
+            version = self._data_version()
+        except sqlite3.OperationalError as exc:
+            if not is_busy(exc):
+                raise
+            return False
+        if version == self._version:
+            return False
+        self._version = version
+        self.changed()
+        return True
+
+    def stop(self):
+        self._timer.stop()
@@ -13,42 +13,522 @@
 # You should have received a copy of the GNU General Public License
 # along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import math
+import logging
 import sqlite3
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from PyQt5.QtCore import QTimer, QCoreApplication
+
 from . import variables
+from .runnable import Runner
+from .storage import ChangeWatcher, THREAD_BUSY_TIMEOUT, connect, \
+    immediate_transaction, is_busy, retry_on_busy
 
 
 visited_links_display_limit = variables.define_variable(
     "visited-links-display-limit",
-    "Limit the number of history elements displayed in the"
-    " visited-links-history command.",
+    "Deprecated, this has no effect anymore: the history elements displayed"
+    " in the visited-links-history command are loaded as needed.",
     2000,
     type=variables.Int(min=1)
 )
 
+visited_links_flush_delay = variables.define_variable(
+    "visited-links-flush-delay",
+    "Delay in milliseconds before visited links are written to the database."
+    " The links visited in the meantime are written in one transaction.",
+    2000,
+    type=variables.Int(min=0)
+)
+
+visited_links_max_age = variables.define_variable(
+    "visited-links-max-age",
+    "Number of days after which a link not visited again is removed from"
+    " the history. 0 means no limit.",
+    0,
+    type=variables.Int(min=0)
+)
+
+visited_links_max_rows = variables.define_variable(
+    "visited-links-max-rows",
+    "Maximum number of links kept in the history. The links with the lowest"
+    " frecency (the least frequently and recently visited) are removed"
+    " first. 0 means no limit.",
+    0,
+    type=variables.Int(min=0)
+)
+
+
+# The frecency of a link is the sum of its visits, each one weighting half
+# as much every FRECENCY_HALF_LIFE seconds. To never update the score of
+# every link as time goes, ln(sum(exp(FRECENCY_DECAY * visit_time))) is
+# stored: it orders the links like the decayed sum would at any given time.
+FRECENCY_HALF_LIFE = 30 * 24 * 3600
+FRECENCY_DECAY = math.log(2) / FRECENCY_HALF_LIFE
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def logaddexp(a, b):
+    """
+    Returns ln(exp(a) + exp(b)), without overflowing.
+    """
+    if a < b:
+        a, b = b, a
+    return a + math.log1p(math.exp(b - a))
+
+
+def visit_score(lastseen, count=1):
+    """
+    The frecency of count visits at the lastseen datetime.
+    """
+    return (FRECENCY_DECAY * (lastseen - EPOCH).total_seconds()
+            + math.log(count))
+
+
+# Ranking every match of a short word would be slow on a big history, so
+# the search ranks the most recently added matching links only.
+SEARCH_CANDIDATES = 10000
+
+# delay in milliseconds before writing the visits again when the database
+# is locked by another instance.
+FLUSH_RETRY_DELAY = 500
+
+
+def fts_query(text):
+    """
+    Build a FTS5 query matching the entries containing words starting with
+    each word of text.
+    """
+    return " ".join('"{}"*'.format(word.replace('"', '""'))
+                    for word in text.split())
+
+
+def like_pattern(word):
+    return "%{}%".format(word.replace("\\", "\\\\").replace("%", "\\%")
+                         .replace("_", "\\_"))
+
+
+def _fts_insert(conn, rowid, url, title):
+    conn.execute("""
+    INSERT INTO visitedlinks_fts(rowid, url, title) VALUES (?, ?, ?)
+    """, (rowid, url, title))
+
+
+def write_visit(conn, fts, url, title, lastseen, count=1):
+    """
+    Add count visits of url at lastseen to the history, and update its
+    full text index if fts is True.
+    """
+    score = visit_score(lastseen, count)
+    row = conn.execute(
+        "SELECT rowid, title, frecency FROM visitedlinks WHERE url = ?",
+        (url,)
+    ).fetchone()
+    if row is None:
+        rowid = conn.execute("""
+        INSERT INTO visitedlinks (url, title, lastseen, visits, frecency)
+        VALUES (?, ?, ?, ?, ?)
+        """, (url, title, lastseen, count, score)).lastrowid
+        if fts:
+            _fts_insert(conn, rowid, url, title)
+        return
+
+    rowid, old_title, frecency = row
+    conn.execute("""
+    UPDATE visitedlinks
+    SET title = ?, lastseen = ?, visits = visits + ?, frecency = ?
+    WHERE rowid = ?
+    """, (title, lastseen, count, logaddexp(frecency, score), rowid))
+    if fts and title != old_title:
+        conn.execute("""
+        INSERT INTO visitedlinks_fts(visitedlinks_fts, rowid, url, title)
+        VALUES ('delete', ?, ?, ?)
+        """, (rowid, url, old_title))
+        _fts_insert(conn, rowid, url, title)
+
+
+def write_visits(conn, visits, fts):
+    """
+    Write the given (url, (title, lastseen, count)) visits in one
+    transaction.
+    """
+    with immediate_transaction(conn):
+        for url, (title, lastseen, count) in visits:
+            write_visit(conn, fts, url, title, lastseen, count)
+
+
+def remove_link(conn, url, fts):
+    """
+    Remove url from the history.
+    """
+    with immediate_transaction(conn):
+        row = conn.execute(
+            "SELECT rowid, title FROM visitedlinks WHERE url = ?", (url,)
+        ).fetchone()
+        if row is not None:
+            delete_links(conn, [(row[0], url, row[1])], fts)
+
+
+def has_fts_index(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'visitedlinks_fts'"
+    ).fetchone() is not None
+
+
+def delete_links(conn, rows, fts):
+    """
+    Delete the given (rowid, url, title) rows from the history, and from its
+    full text index if fts is True.
+    """
+    if fts:
+        # the deleted values must be given for an external content table
+        conn.executemany("""
+        INSERT INTO visitedlinks_fts(visitedlinks_fts, rowid, url, title)
+        VALUES ('delete', ?, ?, ?)
+        """, rows)
+    conn.executemany("DELETE FROM visitedlinks WHERE rowid = ?",
+                     ((row[0],) for row in rows))
+
+
+def insert_links(conn, links, fts):
+    """
+    Add the given (url, title, lastseen, visits) links to the history, and
+    to its full text index if fts is True. The visits of the links already
+    in the history are added to theirs, which keep their title.
+
+    Every visit of a link is considered made at its lastseen datetime.
+    """
+    merged = OrderedDict()
+    for url, title, lastseen, visits in links:
+        score = visit_score(lastseen, visits)
+        if url in merged:
+            old_title, old_lastseen, old_visits, old_score = merged[url]
+            if lastseen < old_lastseen:
+                title, lastseen = old_title, old_lastseen
+            visits += old_visits
+            score = logaddexp(score, old_score)
+        merged[url] = (title, lastseen, visits, score)
+    # walking the url index in order is much faster
+    merged = sorted(merged.items())
+
+    conn.create_function("logaddexp", 2, logaddexp)
+    last_rowid = conn.execute(
+        "SELECT max(rowid) FROM visitedlinks").fetchone()[0] or 0
+    conn.executemany("""
+    UPDATE visitedlinks
+    SET lastseen = max(lastseen, ?), visits = visits + ?,
+        frecency = logaddexp(frecency, ?)
+    WHERE url = ?
+    """, ((lastseen, visits, score, url)
+          for url, (_, lastseen, visits, score) in merged))
+    conn.executemany("""
+    INSERT OR IGNORE INTO visitedlinks (url, title, lastseen, visits, frecency)
+    VALUES (?, ?, ?, ?, ?)
+    """, ((url,) + link for url, link in merged))
+    if fts:
+        # the rowids of the new links are greater than the existing ones
+        conn.execute("""
+        INSERT INTO visitedlinks_fts(rowid, url, title)
+        SELECT rowid, url, title FROM visitedlinks WHERE rowid > ?
+        """, (last_rowid,))
+
+
+def count_visits(conn):
+    """
+    Count the visits of the links and compute their frecency.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS visitedlinks
+    (url TEXT PRIMARY KEY, title TEXT, lastseen DATE);
+    """)
+    conn.execute("""
+    ALTER TABLE visitedlinks ADD COLUMN visits INTEGER NOT NULL DEFAULT 1
+    """)
+    conn.execute("""
+    ALTER TABLE visitedlinks ADD COLUMN frecency REAL NOT NULL DEFAULT 0
+    """)
+    # dates are stored as naive datetimes, considered UTC by sqlite like
+    # by visit_score().
+    conn.execute("""
+    UPDATE visitedlinks SET frecency = ? * strftime('%s', lastseen)
+    """, (FRECENCY_DECAY,))
+    conn.execute("""
+    CREATE INDEX visitedlinks_lastseen ON visitedlinks (lastseen)
+    """)
+    conn.execute("""
+    CREATE INDEX visitedlinks_frecency ON visitedlinks (frecency)
+    """)
+
+
+MIGRATIONS = [count_visits]
+
 
 class VisitedLinks(object):
-    def __init__(self, dbbath):
-        self._conn = sqlite3.connect(dbbath)
-        self._conn.execute("""
-        CREATE TABLE IF NOT EXISTS visitedlinks
-        (url TEXT PRIMARY KEY, title TEXT, lastseen DATE);
-        """)
+    """
+    The history of visited links.
+
+    Visits are not written right away: they are queued, a link visited
+    again only replacing its queued visit, and written together once the
+    visited-links-flush-delay is elapsed or when the application quits.
+
+    Urls and titles are indexed in a FTS5 table when sqlite supports it.
+    The index uses the rowids of the visitedlinks table, so its rows must
+    never be replaced, only updated.
+
+    The database may be shared with other webmacs instances: when it is
+    locked by another one, the visits are kept queued and written later.
+    The changed hook is called when another instance writes to it.
+    """
+
+    def __init__(self, storage):
+        self.path = storage.db_path("visitedlinks.db")
+        self._storage = storage
+        self._conn = storage.connection("visitedlinks.db", MIGRATIONS)
+        self._fts = retry_on_busy(self._create_fts_index)
+        self._watcher = ChangeWatcher(self._conn)
+        self.changed = self._watcher.changed
+        # url -> (title, lastseen, count) of the visits not written yet
+        self._pending = OrderedDict()
+        self._flush_timer = QTimer()
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.timeout.connect(self.flush)
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self._flush_on_quit)
+
+    def _create_fts_index(self):
+        """
+        Create the full text index if needed, returns False if sqlite does
+        not support FTS5.
+        """
+        if has_fts_index(self._conn):
+            return True
+        try:
+            with immediate_transaction(self._conn):
+                if has_fts_index(self._conn):
+                    # created by another instance in the meantime
+                    return True
+                self._conn.execute("""
+                CREATE VIRTUAL TABLE visitedlinks_fts USING fts5
+                (url, title, content='visitedlinks', prefix='2 3');
+                """)
+                # index the existing history
+                self._conn.execute("""
+                INSERT INTO visitedlinks_fts(visitedlinks_fts)
+                VALUES ('rebuild')
+                """)
+        except sqlite3.OperationalError as exc:
+            if is_busy(exc):
+                raise
+            logging.warning("Visited links are not indexed: %s", exc)
+            return False
+        return True
+
+    def _write_visit(self, url, title, lastseen, count=1):
+        write_visit(self._conn, self._fts, url, title, lastseen, count)
 
     def visit(self, url, title):
-        self._conn.execute("""
-        INSERT OR REPLACE INTO visitedlinks (url, title, lastseen)
-        VALUES (?, ?, ?)
-        """, (url, title, datetime.now()))
-        self._conn.commit()
+        _, _, count = self._pending.pop(url, (None, None, 0))
+        self._pending[url] = (title, datetime.now(), count + 1)
+        if not self._flush_timer.isActive():
+            self._flush_timer.start(visited_links_flush_delay.value)
+
+    def _write_pending(self):
+        try:
+            write_visits(self._conn, self._pending.items(), self._fts)
+        except sqlite3.OperationalError as exc:
+            # the visits are kept to be written later only if the database
+            # is locked, to not fail again and again
+            if not is_busy(exc):
+                self._pending.clear()
+            raise
+        self._pending.clear()
+
+    def flush(self):
+        """
+        Write the pending visits in one transaction. Returns False if the
+        database is locked by another instance, the visits are then written
+        later.
+        """
+        self._flush_timer.stop()
+        if not self._pending:
+            return True
+        try:
+            self._write_pending()
+        except sqlite3.OperationalError as exc:
+            if not is_busy(exc):
+                raise
+            logging.debug("Visited links database is locked, %d visits"
+                          " will be written later", len(self._pending))
+            self._flush_timer.start(FLUSH_RETRY_DELAY)
+            return False
+        return True
+
+    def _flush_on_quit(self):
+        self._flush_timer.stop()
+        if self._pending:
+            # there is no later anymore, the storage worker waits for the
+            # lock until the storage is closed.
+            self._storage.submit("visitedlinks.db", write_visits,
+                                 list(self._pending.items()), self._fts)
+            self._pending.clear()
 
     def visited_urls(self):
-        return [(row[0], row[1]) for row in self._conn.execute(
+        """
+        Returns a cursor on the (url, title) of the visited links, the most
+        recently visited first.
+        """
+        self.flush()
+        return self._conn.execute(
             "select url, title from visitedlinks order by lastseen DESC"
-            " LIMIT %d" % visited_links_display_limit.value
-        )]
+        )
+
+    def search(self, text, limit=-1, offset=0):
+        """
+        Returns a cursor on the (url, title) of the visited links matching
+        every word of text, the best matches first. Without any word,
+        returns the links with the highest frecency first.
+
+        Only limit links are returned, after the offset first ones. A
+        negative limit returns them all.
+        """
+        words = text.split()
+        self.flush()
+        if not words:
+            # walks the frecency index, without sorting
+            return self._conn.execute(
+                "SELECT url, title FROM visitedlinks ORDER BY frecency DESC"
+                " LIMIT ? OFFSET ?", (limit, offset))
+        if self._fts:
+            return self._conn.execute("""
+            SELECT url, title FROM (
+              SELECT url, title, rank FROM visitedlinks_fts
+              WHERE visitedlinks_fts MATCH ? ORDER BY rowid DESC LIMIT ?
+            ) ORDER BY rank LIMIT ? OFFSET ?
+            """, (fts_query(text), SEARCH_CANDIDATES, limit, offset))
+
+        where = " AND ".join(
+            "(url LIKE ? ESCAPE '\\' OR title LIKE ? ESCAPE '\\')"
+            for _ in words)
+        args = []
+        for word in words:
+            args.extend((like_pattern(word),) * 2)
+        return self._conn.execute(
+            "SELECT url, title FROM visitedlinks WHERE " + where
+            + " ORDER BY frecency DESC LIMIT ? OFFSET ?",
+            args + [limit, offset])
 
     def remove(self, url):
-        self._conn.execute("""
-        DELETE from visitedlinks WHERE url = ?
-        """, (url,))
+        self._pending.pop(url, None)
+        # retried later if another instance is writing
+        self._storage.write("visitedlinks.db", remove_link, url, self._fts)
+
+    def check_changes(self):
+        """
+        Call the changed hook now if another connection wrote to the
+        database.
+        """
+        return self._watcher.check()
+
+    def stats(self):
+        """
+        Returns the number of links and the size in bytes of the database.
+        """
+        self.flush()
+
+        def pragma(name):
+            return self._conn.execute("PRAGMA " + name).fetchone()[0]
+
+        page_size = pragma("page_size")
+        wal_path = self.path + "-wal"
+        return {
+            "rows": self._conn.execute(
+                "SELECT count(*) FROM visitedlinks").fetchone()[0],
+            "size": pragma("page_count") * page_size,
+            "free": pragma("freelist_count") * page_size,
+            "wal_size": (os.path.getsize(wal_path)
+                         if os.path.isfile(wal_path) else 0),
+        }
+
+
+class VisitedLinksCompactRunner(Runner):
+    """
+    Remove the links exceeding the retention policy from the history, then
+    give the free pages back to the file system and optimize the database.
+
+    It uses its own connection, and deletes the links in small transactions
+    so the GUI threads of the instances sharing the database are never
+    blocked long when they write visits.
+    """
+
+    description = "visited links compaction"
+    batch_size = 1000
+
+    def __init__(self, dbpath, max_age, max_rows, **kwargs):
+        Runner.__init__(self, **kwargs)
+        self.dbpath = dbpath
+        self.max_age = max_age
+        self.max_rows = max_rows
+
+    def _delete(self, conn, fts, query, params):
+        """
+        Delete the links returned by query in one transaction, returns
+        their number.
+        """
+        with immediate_transaction(conn):
+            rows = conn.execute(query, params).fetchall()
+            delete_links(conn, rows, fts)
+        return len(rows)
+
+    def run_in_thread(self):
+        conn = connect(self.dbpath, timeout=THREAD_BUSY_TIMEOUT,
+                       isolation_level=None)
+        try:
+            fts = has_fts_index(conn)
+            removed = 0
+            if self.max_age > 0:
+                limit = datetime.now() - timedelta(days=self.max_age)
+                while True:
+                    count = self._delete(conn, fts, """
+                    SELECT rowid, url, title FROM visitedlinks
+                    WHERE lastseen < ? LIMIT ?
+                    """, (limit, self.batch_size))
+                    removed += count
+                    if count < self.batch_size:
+                        break
+
+            if self.max_rows > 0:
+                excess = conn.execute(
+                    "SELECT count(*) FROM visitedlinks"
+                ).fetchone()[0] - self.max_rows
+                while excess > 0:
+                    count = self._delete(conn, fts, """
+                    SELECT rowid, url, title FROM visitedlinks
+                    ORDER BY frecency LIMIT ?
+                    """, (min(excess, self.batch_size),))
+                    if count == 0:
+                        break
+                    removed += count
+                    excess -= count
+
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                # databases created before incremental vacuum was enabled
+                # need a full vacuum once. It may change the rowids, so the
+                # full text index is rebuilt.
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+                if fts:
+                    conn.execute("""
+                    INSERT INTO visitedlinks_fts(visitedlinks_fts)
+                    VALUES ('rebuild')
+                    """)
+            else:
+                conn.execute("PRAGMA incremental_vacuum")
+            conn.execute("PRAGMA optimize")
+            return removed
+        finally:
+            conn.close()
@@ -22,16 +22,22 @@ from PyQt5.QtWebEngineWidgets import QWebEnginePage, QWebEngineScript
 from PyQt5.QtWebChannel import QWebChannel
 from collections import namedtuple
 
+try:
+    from PyQt5 import sip
+except ImportError:
+    import sip
+
 from . import hooks, variables, windows
 from . import BUFFERS, current_minibuffer, minibuffer_show_info, \
     current_buffer, call_later, current_window, recent_buffers
 from .content_handler import WebContentHandler
 from .application import app
 from .minibuffer.prompt import YesNoPrompt
-from .autofill import FormData
+from .autofill import FormData, create_host
 from .autofill.prompt import AskPasswordPrompt, SavePasswordPrompt
 from .keyboardhandler import LOCAL_KEYMAP_SETTER
 from .mode import get_mode, Mode, get_auto_modename_for_url
+from .ignore_certificates import certificate_key
 
 
 close_buffer_close_window = variables.define_variable(
@@ -97,6 +103,18 @@ def close_buffer(wb):
     return True
 
 
+def _prefetched(prefetch, key, query, *args):
+    """
+    Returns the result of the (key, future) prefetch if it is for key and
+    done, else the result of query(*args).
+    """
+    if prefetch is not None:
+        prefetch_key, future = prefetch
+        if prefetch_key == key and future.done() and not future.error:
+            return future.result
+    return query(*args)
+
+
 class WebBuffer(QWebEnginePage):
     """
     Represent some web page content.
@@ -139,6 +157,9 @@ class WebBuffer(QWebEnginePage):
         self.linkHovered.connect(self.on_url_hovered)
         self.titleChanged.connect(self.update_title)
         self.__authentication_data = None
+        # (key, StorageFuture) of the data prefetched for the navigation
+        self.__auth_passwords = None
+        self.__cert_ignored = None
         self.__delay_loading_url = None
         self.__keymap_mode = Mode.KEYMAP_NORMAL
         self.__mode = get_mode("standard-mode")
@@ -277,11 +298,19 @@ class WebBuffer(QWebEnginePage):
                 feature_name = name
                 break
 
-        db = app().features()
+        def got_permission(error, permission):
+            # the buffer may have been closed in the meantime
+            if not sip.isdeleted(self):
+                self._set_feature_permission(url, feature, feature_name,
+                                             permission)
 
-        permission = db.get_permission(url.host(), feature)
+        app().features().get_permission_async(
+            url.host(), feature).then(got_permission)
 
-        if permission == QWebEnginePage.PermissionUnknown:
+    def _set_feature_permission(self, url, feature, feature_name,
+                                permission):
+        # permission is None if it could not be read
+        if permission in (None, QWebEnginePage.PermissionUnknown):
             permission = QWebEnginePage.PermissionDeniedByUser
             if feature_name:
                 prompt = YesNoPrompt("Allow enabling feature {} for {}?"
@@ -328,6 +357,8 @@ class WebBuffer(QWebEnginePage):
             sprompt = SavePasswordPrompt(autofill, self,
                                          self.__authentication_data)
             self.__authentication_data = None
+            # the prefetched credentials may be saved now
+            self.__auth_passwords = None
             current_minibuffer().do_prompt(sprompt, flash=True)
         else:
             autofill.complete_buffer(self, url)
@@ -345,9 +376,33 @@ class WebBuffer(QWebEnginePage):
 
             view.internal_view().setFocus()
 
+    def acceptNavigationRequest(self, url, type, is_main_frame):
+        if is_main_frame:
+            self._prefetch_site_data(url)
+        return QWebEnginePage.acceptNavigationRequest(self, url, type,
+                                                      is_main_frame)
+
+    def _prefetch_site_data(self, url):
+        # handle_authentication and certificateError must answer right
+        # away: the data they need is queried in the storage thread while
+        # the request is sent, so the GUI thread does not query it. This
+        # costs an indexed lookup in each database when the host changes,
+        # the results are kept while navigating on the same host.
+        if url.scheme() not in ("http", "https"):
+            return
+        host = create_host(url)
+        if self.__auth_passwords is None or self.__auth_passwords[0] != host:
+            self.__auth_passwords = (
+                host, app().autofill().auth_passwords_for_url_async(url))
+        key = certificate_key(url)
+        if self.__cert_ignored is None or self.__cert_ignored[0] != key:
+            self.__cert_ignored = (
+                key, app().ignored_certs().is_ignored_async(key))
+
     def handle_authentication(self, url, authenticator):
         autofill = app().autofill()
-        passwords = autofill.auth_passwords_for_url(url)
+        passwords = _prefetched(self.__auth_passwords, create_host(url),
+                                autofill.auth_passwords_for_url, url)
         if passwords:
             data = passwords[0]
             authenticator.setUser(data.username)
@@ -364,9 +419,9 @@ class WebBuffer(QWebEnginePage):
         authenticator.setPassword(data.password)
 
     def certificateError(self, error):
-        url = "{}:{}".format(error.url().host(), error.url().port(80))
+        url = certificate_key(error.url())
         db = app().ignored_certs()
-        if db.is_ignored(url):
+        if _prefetched(self.__cert_ignored, url, db.is_ignored, url):
             return True
 
         prompt = YesNoPrompt("[certificate error] {} - ignore ? "
@@ -375,6 +430,7 @@ class WebBuffer(QWebEnginePage):
 
         if prompt.value() == YesNoPrompt.ALWAYS:
             db.ignore(url)
+            self.__cert_ignored = None
         return prompt.value() in (YesNoPrompt.ALWAYS, YesNoPrompt.YES)
 
     def javaScriptConfirm(self, url, msg):